@@ -0,0 +1,329 @@
+"""Application analytics rollups: per-user and cohort aggregates kept up to date incrementally
+
+Each user with applications has one row in ``application_rollup`` holding:
+  - histograms: status counts, progress (0-100), documents done as a whole
+    percent of documents required, and deadlines by month
+  - the summary /api/applications/analytics returns: the counts, and the
+    mean and percentiles of each distribution
+The cohort row (scope "cohort", id 0) is the sum of every user's histograms.
+All histograms add up, so the cohort changes by the difference between a
+user's new and old histograms, and its percentiles stay exact. Reading a
+user's analytics is one primary-key lookup of the two rows.
+
+refresh() finds the users whose applications changed since its last pass
+from the (updated_at, id) index and the application tombstones, the same
+change tracking /api/sync uses (deltasync.py). It then recomputes those
+users ANALYTICS_BATCH_USERS at a time, with one GROUP BY query per batch. The
+watermark lives in ``application_rollup_state``; its row is locked for the
+whole pass, so workers refreshing at once take turns and no change is
+counted twice. A pass with no watermark yet, or with one older than the
+tombstones kept, rebuilds everything.
+
+init-db runs the first rebuild, and `flask --app app refresh-analytics`
+runs refresh() (or a full rebuild) from cron. Each gunicorn worker also
+starts a background thread that runs refresh() every
+ANALYTICS_REFRESH_SECONDS, but never a rebuild: until one has run the
+endpoint serves empty figures and the thread logs a warning. The thread
+skips a pass while another worker's holds the state row (FOR UPDATE SKIP
+LOCKED where the database has it), so workers don't queue up behind each
+other. The analytics endpoint only reads; it never refreshes.
+
+Configuration (environment):
+  ANALYTICS_REFRESH_SECONDS  seconds between a worker's background refreshes (default 5)
+  ANALYTICS_BATCH_USERS      users recomputed per query (default 500)
+"""
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+
+import sqlalchemy as sa
+
+import deltasync
+
+log = logging.getLogger('mcb.analytics')
+
+REFRESH_SECONDS = float(os.getenv('ANALYTICS_REFRESH_SECONDS', 5))
+BATCH_USERS = int(os.getenv('ANALYTICS_BATCH_USERS', 500))
+PERCENTILES = (25, 50, 75, 90)
+HISTOGRAMS = ('status', 'progress', 'docs', 'deadline_month')
+# Deadline histogram key for applications without one
+NO_DEADLINE = 'none'
+USER, COHORT = 'user', 'cohort'
+
+metadata = sa.MetaData()
+rollup_table = sa.Table(
+    'application_rollup', metadata,
+    sa.Column('scope', sa.String(10), primary_key=True),
+    sa.Column('scope_id', sa.Integer, primary_key=True, autoincrement=False),
+    # JSON: the additive histograms, and the summary served to clients
+    sa.Column('histograms', sa.Text, nullable=False),
+    sa.Column('summary', sa.Text, nullable=False),
+    sa.Column('computed_at', sa.DateTime, nullable=False),
+)
+state_table = sa.Table(
+    'application_rollup_state', metadata,
+    sa.Column('id', sa.Integer, primary_key=True, autoincrement=False),
+    # deltasync watermark of the changes already counted
+    sa.Column('watermark', sa.Text, nullable=True),
+    sa.Column('refreshed_at', sa.DateTime, nullable=True),
+)
+
+
+def install(engine):
+    """Create the rollup tables and the state row if missing"""
+    metadata.create_all(engine, checkfirst=True)
+    try:
+        with engine.begin() as conn:
+            if conn.execute(sa.select(state_table.c.id).where(state_table.c.id == 1)).first() is None:
+                conn.execute(state_table.insert().values(id=1))
+    except sa.exc.IntegrityError:
+        # Another worker inserted it first
+        pass
+
+
+# ----- histograms -----
+
+def _empty():
+    return {name: Counter() for name in HISTOGRAMS}
+
+
+def _load(text):
+    raw = json.loads(text)
+    histograms = {name: Counter(raw.get(name, {})) for name in HISTOGRAMS}
+    for name in ('progress', 'docs'):
+        histograms[name] = Counter({int(k): v for k, v in histograms[name].items()})
+    return histograms, raw.get('users', 0)
+
+
+def _dump(histograms, users=None):
+    raw = {name: dict(histograms[name]) for name in HISTOGRAMS}
+    if users is not None:
+        raw['users'] = users
+    return json.dumps(raw, sort_keys=True)
+
+
+def _distribution(histogram):
+    """Count, mean and nearest-rank percentiles of an {int value: count} histogram"""
+    total = sum(histogram.values())
+    if not total:
+        return {'count': 0, 'mean': None, **{'p%d' % p: None for p in PERCENTILES}}
+    result = {'count': total, 'mean': round(sum(v * n for v, n in histogram.items()) / total, 1)}
+    ranks = [(p, max(-(-p * total // 100), 1)) for p in PERCENTILES]
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        while ranks and seen >= ranks[0][1]:
+            result['p%d' % ranks.pop(0)[0]] = value
+    return result
+
+
+def summarize(histograms, users=None):
+    """The client-facing figures of one rollup"""
+    months = histograms['deadline_month']
+    summary = {
+        'applications': sum(histograms['status'].values()),
+        'status_counts': dict(sorted(histograms['status'].items())),
+        'progress': _distribution(histograms['progress']),
+        'docs_percent': _distribution(histograms['docs']),
+        'deadlines_by_month': {month: n for month, n in sorted(months.items()) if month != NO_DEADLINE},
+        'no_deadline': months.get(NO_DEADLINE, 0),
+    }
+    if users is not None:
+        summary['users'] = users
+    return summary
+
+
+def _compute(conn, table, user_ids):
+    """{user id: histograms} for ``user_ids``, from one grouped query; users without applications are left out"""
+    # Literal constants, so the expression in GROUP BY is textually the one selected
+    docs = sa.case((table.c.docs_total > sa.literal_column('0'),
+                    table.c.docs_done * sa.literal_column('100') // table.c.docs_total), else_=None)
+    rows = conn.execute(
+        sa.select(table.c.user_id, table.c.status, table.c.progress, docs, table.c.deadline, sa.func.count())
+        .where(table.c.user_id.in_(user_ids))
+        .group_by(table.c.user_id, table.c.status, table.c.progress, docs, table.c.deadline))
+    result = {}
+    for user_id, status, progress, docs_percent, deadline, n in rows:
+        histograms = result.get(user_id)
+        if histograms is None:
+            histograms = result[user_id] = _empty()
+        histograms['status'][status] += n
+        histograms['progress'][min(max(progress or 0, 0), 100)] += n
+        if docs_percent is not None:
+            histograms['docs'][min(max(int(docs_percent), 0), 100)] += n
+        histograms['deadline_month']['%04d-%02d' % (deadline.year, deadline.month) if deadline else NO_DEADLINE] += n
+    return result
+
+
+# ----- refresh -----
+
+class RollupRefresher:
+    def __init__(self, table, tombstone_kind='application'):
+        self.table = table
+        self.tombstone_kind = tombstone_kind
+        self._installed = False
+        self._install_lock = threading.Lock()
+        self._warned = False
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def ensure_installed(self, engine):
+        """install() once per process, so a database upgraded without init-db gets the tables on first use"""
+        if self._installed:
+            return
+        with self._install_lock:
+            if not self._installed:
+                install(engine)
+                self._installed = True
+
+    def _changed_users(self, conn, positions):
+        """User ids with application changes after ``positions``, and the positions after them"""
+        t = self.table
+        tombstones = deltasync.tombstone_table
+        deleted_query = sa.select(tombstones.c.owner_id, tombstones.c.deleted_at, tombstones.c.id).where(
+            tombstones.c.kind == self.tombstone_kind)
+        users = set()
+        positions = dict(positions)
+        for kind, query, time_column, id_column in (
+                ('applications', sa.select(t.c.user_id, t.c.updated_at, t.c.id), t.c.updated_at, t.c.id),
+                ('deleted', deleted_query, tombstones.c.deleted_at, tombstones.c.id)):
+            has_more = True
+            while has_more:
+                rows, positions[kind], has_more = deltasync.changed_since(
+                    conn, query, time_column, id_column, positions[kind], 5000)
+                users.update(row[0] for row in rows if row[0] is not None)
+        return users, positions
+
+    def _write(self, conn, user_ids, cohort, users):
+        """Recompute ``user_ids`` in batches, folding the differences into ``cohort``; returns the user count"""
+        r = rollup_table
+        now = datetime.utcnow()
+        user_ids = sorted(user_ids)
+        for i in range(0, len(user_ids), BATCH_USERS):
+            batch = user_ids[i:i + BATCH_USERS]
+            old = {row.scope_id: _load(row.histograms)[0] for row in conn.execute(
+                sa.select(r.c.scope_id, r.c.histograms).where(r.c.scope == USER, r.c.scope_id.in_(batch)))}
+            new = _compute(conn, self.table, batch)
+            for user_id in batch:
+                before, after = old.get(user_id), new.get(user_id)
+                users += (after is not None) - (before is not None)
+                for name in HISTOGRAMS:
+                    if after is not None:
+                        cohort[name].update(after[name])
+                    if before is not None:
+                        cohort[name].subtract(before[name])
+            conn.execute(sa.delete(r).where(r.c.scope == USER, r.c.scope_id.in_(batch)))
+            if new:
+                conn.execute(r.insert(), [
+                    {'scope': USER, 'scope_id': user_id, 'histograms': _dump(histograms),
+                     'summary': json.dumps(summarize(histograms)), 'computed_at': now}
+                    for user_id, histograms in new.items()])
+        return users
+
+    def refresh(self, engine, full=False, rebuild=True, skip_locked=False):
+        """Apply application changes since the last pass (or rebuild everything); returns users recomputed
+
+        With ``rebuild`` false a pass that needs a full rebuild does nothing and returns None. With
+        ``skip_locked`` a pass started while another one holds the state row returns 0 at once, on
+        databases with SKIP LOCKED; elsewhere it waits its turn.
+        """
+        r, s = rollup_table, state_table
+        self.ensure_installed(engine)
+        with engine.begin() as conn:
+            if skip_locked and conn.dialect.name in ('postgresql', 'mysql', 'mariadb'):
+                locked = conn.execute(sa.select(s.c.watermark).where(s.c.id == 1)
+                                      .with_for_update(skip_locked=True)).first()
+                if locked is None:
+                    return 0
+                watermark = locked.watermark
+            else:
+                # Locks the state row (PostgreSQL) or the database (SQLite) until commit: one pass at a time
+                watermark = conn.execute(s.update().where(s.c.id == 1).values(watermark=s.c.watermark)
+                                         .returning(s.c.watermark)).scalar()
+            positions = deltasync.decode_watermark(watermark) if watermark else None
+            if full or positions is None or any(deltasync.expired(p) for p in positions.values()):
+                return self._rebuild(conn) if rebuild else None
+
+            user_ids, positions = self._changed_users(conn, positions)
+            if user_ids:
+                cohort = conn.execute(
+                    sa.select(r.c.histograms).where(r.c.scope == COHORT, r.c.scope_id == 0)).scalar()
+                cohort, users = _load(cohort) if cohort else (_empty(), 0)
+                users = self._write(conn, user_ids, cohort, users)
+                self._write_cohort(conn, cohort, users)
+            conn.execute(s.update().where(s.c.id == 1).values(watermark=deltasync.encode_watermark(positions),
+                                                               refreshed_at=datetime.utcnow()))
+        return len(user_ids)
+
+    def _rebuild(self, conn):
+        r, s = rollup_table, state_table
+        # Taken before reading, so changes made during the rebuild are applied again by the next pass
+        settled = deltasync.settled_position(conn)
+        positions = {'applications': settled, 'deleted': settled}
+        conn.execute(sa.delete(r))
+        user_ids = conn.execute(sa.select(self.table.c.user_id).distinct()).scalars().all()
+        cohort = _empty()
+        users = self._write(conn, user_ids, cohort, 0)
+        self._write_cohort(conn, cohort, users)
+        conn.execute(s.update().where(s.c.id == 1).values(watermark=deltasync.encode_watermark(positions),
+                                                           refreshed_at=datetime.utcnow()))
+        log.info('Application rollups rebuilt for %d users', users)
+        return len(user_ids)
+
+    def _write_cohort(self, conn, cohort, users):
+        r = rollup_table
+        for histogram in cohort.values():
+            # Drop the zero and negative counts left by subtract()
+            histogram += Counter()
+        conn.execute(sa.delete(r).where(r.c.scope == COHORT, r.c.scope_id == 0))
+        conn.execute(r.insert().values(scope=COHORT, scope_id=0, histograms=_dump(cohort, users),
+                                       summary=json.dumps(summarize(cohort, users)), computed_at=datetime.utcnow()))
+
+    def refresh_pending(self, engine):
+        """refresh() without rebuilding, skipping a pass another worker is running; warns once if a rebuild is due"""
+        if self.refresh(engine, rebuild=False, skip_locked=True) is not None:
+            self._warned = False
+        elif not self._warned:
+            self._warned = True
+            log.warning('Application rollups need a full rebuild; run `flask --app app refresh-analytics`')
+
+    def run_forever(self, engine):
+        while not self._stop.wait(REFRESH_SECONDS):
+            try:
+                self.refresh_pending(engine)
+            except Exception:
+                log.exception('Application rollup refresh failed')
+
+    def start(self, engine):
+        """Start the background refresh thread in this process if it isn't running"""
+        # Called per analytics request; once the thread runs this is an attribute check, no lock
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self.run_forever, args=(engine,),
+                                                name='analytics-refresher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+def read(session, user_id):
+    """The user's and the cohort's summaries and when they were computed: one primary-key read"""
+    r = rollup_table
+    rows = session.execute(sa.select(r.c.scope, r.c.summary, r.c.computed_at).where(
+        sa.or_(sa.and_(r.c.scope == USER, r.c.scope_id == user_id),
+               sa.and_(r.c.scope == COHORT, r.c.scope_id == 0)))).all()
+    found = {row.scope: row for row in rows}
+    empty = summarize(_empty())
+    return {
+        'user': json.loads(found[USER].summary) if USER in found else empty,
+        'cohort': json.loads(found[COHORT].summary) if COHORT in found else dict(empty, users=0),
+        'computed_at': max((row.computed_at for row in rows), default=None),
+    }
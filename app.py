@@ -1,64 +1,233 @@
-from flask import Flask, request, redirect, url_for, session, flash, jsonify
-from flask_compress import Compress
-from functools import wraps
-from authlib.integrations.flask_client import OAuth
-from dotenv import load_dotenv, find_dotenv
+import time
+
+# Startup time is measured from here, so it includes importing Flask, SQLAlchemy and the modules below
+_import_started = time.perf_counter()
+
 import os
-from datetime import datetime, UTC, timedelta
+
+
+def load_env():
+    """Load .env files into the environment; skipped when FLASK_SKIP_DOTENV=1
+
+    1) .env in project root (next to this file), or the first .env found
+       walking up from the working directory when there is none
+    2) .env.local (optional) to override local settings
+    """
+    if os.getenv('FLASK_SKIP_DOTENV') == '1':
+        return
+    from dotenv import load_dotenv, find_dotenv
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    project_root_env = os.path.join(root, '.env')
+    if os.path.exists(project_root_env):
+        load_dotenv(project_root_env)
+    else:
+        discovered = find_dotenv(usecwd=True)
+        if discovered:
+            load_dotenv(discovered)
+
+    # Optional local overrides
+    local_env = os.path.join(root, '.env.local')
+    if os.path.exists(local_env):
+        load_dotenv(local_env, override=True)
+
+
+# Before the imports below: several modules read their settings at import time
+load_env()
+
+from flask import Blueprint, Flask, current_app, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, g, abort, send_from_directory
+from flask_cors import CORS
+import click
+from functools import wraps
+from datetime import date, datetime, timedelta, UTC
 import logging
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+import json
+import csv
+import io
+import threading
+from hashing import hash_password, hash_passwords, verify_password, HashPoolBusy
+import hashing
+import sessions
+from sessions import ServerSideSessionInterface, LRUCache, create_session_store
+from ratelimit import RateLimited, create_rate_limiter
+import sqlstats
+import metrics
+from respcache import ResponseCache
+from batch import BatchDispatcher, BatchError, BatchTooLarge
+from httpcompress import ResponseCompressor
+from jsonprovider import FastJSONProvider
+import dbrouting
+from dbrouting import use_primary
+from werkzeug.middleware.proxy_fix import ProxyFix
 import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-
-# Load environment variables from .env files if present (robust resolution)
-# 1) .env in project root (next to this file)
-# 2) .env discovered via find_dotenv (walks up directories)
-# 3) .env.local (optional) to override local settings
-project_root_env = os.path.join(os.path.dirname(__file__), '.env')
-loaded = False
-if os.path.exists(project_root_env):
-    load_dotenv(project_root_env)
-    loaded = True
-else:
-    discovered = find_dotenv(usecwd=True)
-    if discovered:
-        load_dotenv(discovered)
-        loaded = True
-
-# Optional local overrides
-local_env = os.path.join(os.path.dirname(__file__), '.env.local')
-if os.path.exists(local_env):
-    load_dotenv(local_env, override=True)
-    loaded = True
-
-# If still not loaded, attempt a last load with defaults (cwd)
-if not loaded:
-    load_dotenv()
-
-app = Flask(__name__)
-# Prefer SECRET_KEY from env; fall back to 'dev' for local/testing
-app.secret_key = os.getenv('SECRET_KEY', 'dev')  # Change this to a secure key in production
-Compress(app)  # Enable compression for better performance
-
-# Database configuration
-database_url = os.getenv('DATABASE_URL')
-if database_url:
-    if 'railway' in database_url:
+import outbox
+import usersearch
+import deltasync
+import deadlines
+import userwrites
+import profiling
+import analytics
+
+# Engines are created on first use (see dbrouting.LazySQLAlchemy)
+db = dbrouting.LazySQLAlchemy(session_options={'class_': dbrouting.RoutingSession})
+# Routes, hooks, error handlers and CLI commands; create_app() registers them
+bp = Blueprint('mcb', __name__, cli_group=None)
+
+
+def database_url():
+    url = os.getenv('DATABASE_URL')
+    if not url:
+        # Fallback to SQLite for local development
+        return 'sqlite:///mcb.db'
+    if 'railway' in url:
         # Railway provides PostgreSQL, ensure correct protocol
-        database_url = database_url.replace('postgres://', 'postgresql://')
-    elif 'mcbdatabase.railway.internal' in database_url:
-        # Use Railway private networking for database
-        pass  # Keep as-is, Railway handles the connection
-    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-else:
-    # Fallback to SQLite for local development
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///mcb.db'
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+        url = url.replace('postgres://', 'postgresql://')
+    return url
+
+
+def create_app(config=None):
+    """Build the Flask application
+
+    Only configuration happens here. Database engines, the Google OAuth
+    client, the hash pool and the email dispatcher are created on first use;
+    `flask --app app init-db` creates the schema and `flask --app app warmup`
+    opens everything ahead of traffic. ``config`` overrides settings read from
+    the environment.
+    """
+    app = Flask(__name__)
+    # Prefer SECRET_KEY from env; fall back to 'dev' for local/testing
+    app.secret_key = os.getenv('SECRET_KEY', 'dev')  # Change this to a secure key in production
+    # Behind Railway/other proxies, trust X-Forwarded-For from this many hops so remote_addr is the client
+    if int(os.getenv('TRUSTED_PROXY_COUNT', 0)):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv('TRUSTED_PROXY_COUNT')))
+    # Registered first so it runs after every other after_request hook; streamed bodies are never buffered
+    compressor.init_app(app)
+    # orjson-backed jsonify that encodes datetimes, result rows and models itself (see jsonprovider.py)
+    app.json = FastJSONProvider(app)
+    app.json.register(User, User.to_dict)
+    app.json.register(Application, Application.to_dict)
+
+    # Database configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    # Session cookie tweaks for local dev
+    app.config['SESSION_COOKIE_SAMESITE'] = 'None'
+    app.config['SESSION_COOKIE_SECURE'] = os.getenv('SESSION_COOKIE_SECURE', '1') == '1'  # True required for SameSite=None
+    app.config['SESSION_COOKIE_HTTPONLY'] = True
+
+    # Google OAuth: read strictly from environment (no hardcoding); the client is registered on first use
+    app.config['GOOGLE_CLIENT_ID'] = os.getenv('GOOGLE_CLIENT_ID') or None
+    app.config['GOOGLE_CLIENT_SECRET'] = os.getenv('GOOGLE_CLIENT_SECRET') or None
+
+    app.config.update(config or {})
+
+    # Pool size/overflow/recycle/pre-ping/statement timeout from DB_* environment variables
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          dbrouting.engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    # Optional read replica: GET requests read from it unless they (or this session recently) wrote
+    replica_url = os.getenv('DATABASE_REPLICA_URL')
+    if replica_url and 'SQLALCHEMY_BINDS' not in app.config:
+        replica_url = replica_url.replace('postgres://', 'postgresql://')
+        app.config['SQLALCHEMY_BINDS'] = {
+            dbrouting.REPLICA_BIND: dict(url=replica_url, **dbrouting.engine_options(replica_url, 'replica'))
+        }
+
+    db.init_app(app)
+    dbrouting.init_app(app, db)
+    # Per-request query counts, slow-query log and N+1 warnings
+    sqlstats.init_app(app)
+    # Sampling profiler for requests with X-Profile or PROFILE_SAMPLE_RATE; no hooks unless configured
+    profiling.init_app(app)
+
+    # Allow API access from frontend and other origins
+    CORS(app, origins=['https://mcb-frontend.up.railway.app', 'http://localhost:3000', 'http://localhost:3001'], supports_credentials=True, allow_headers=['Content-Type', 'Authorization'])
+
+    # ===== Server-side sessions =====
+    # The cookie only holds a session id; data lives in SESSION_BACKEND behind a local cache
+    app.session_interface = ServerSideSessionInterface(
+        create_session_store(
+            SESSION_BACKEND,
+            lambda: db.engine,
+            redis_url=os.getenv('SESSION_REDIS_URL'),
+            cache_size=int(os.getenv('SESSION_CACHE_SIZE', 4096)),
+            cache_ttl=float(os.getenv('SESSION_CACHE_TTL', 5)),
+        ),
+        ttl=int(os.getenv('SESSION_TTL', 7 * 24 * 3600)),
+    )
+
+    # Basic logging
+    logging.basicConfig(level=logging.INFO)
+
+    app.register_blueprint(bp)
+
+    startup = time.perf_counter() - _import_started
+    metrics.observe('mcb_app_startup_seconds', startup)
+    logging.getLogger('mcb.startup').info('App created %.0f ms after the app module started importing',
+                                          startup * 1000)
+    return app
+
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sql')
+
+
+# ===== Request metrics =====
+@bp.before_app_request
+def start_request_metrics():
+    # Kept on the request, not g: batched sub-requests share the batch's g and skip this hook
+    request.environ['mcb.metrics_start'] = time.perf_counter()
+    metrics.inc('mcb_http_requests_in_flight')
+
+
+@bp.after_app_request
+def record_request_metrics(response):
+    start = request.environ.get('mcb.metrics_start')
+    if start is not None:
+        # Label by view name without the blueprint prefix, as before the app factory
+        endpoint = (request.endpoint or 'none').rpartition('.')[2]
+        metrics.observe_request(endpoint, request.method, response.status_code, time.perf_counter() - start)
+        metrics.set_gauge('mcb_hash_pool_queue_depth', hashing.queue_depth())
+        # Don't create the engine just to report on it
+        engine = db.engines.created().get(None)
+        if engine is not None and hasattr(engine.pool, 'checkedout'):
+            metrics.set_gauge('mcb_db_pool_checked_out', engine.pool.checkedout())
+    return response
+
+
+@bp.teardown_app_request
+def finish_request_metrics(exc):
+    if 'mcb.metrics_start' in request.environ:
+        metrics.inc('mcb_http_requests_in_flight', amount=-1)
+
+
+@bp.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint; protected by METRICS_TOKEN when set"""
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != 'Bearer ' + token:
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route("/api/profiles")
+def list_profiles():
+    """Recent request profiles, newest first; requires the PROFILE_TOKEN bearer token"""
+    if not profiling.authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"profiles": profiling.list_profiles(), "enabled": profiling.enabled(),
+                    "format": profiling.FORMAT})
+
+
+@bp.route("/api/profiles/<profile_id>")
+def download_profile(profile_id):
+    """One profile file (speedscope JSON or collapsed stacks) by the id from X-Profile-Id"""
+    if not profiling.authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    filename = profiling.find(profile_id)
+    if filename is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_from_directory(profiling.PROFILE_DIR, filename, as_attachment=True,
+                               mimetype='application/json' if filename.endswith('.json') else 'text/plain')
 
 # Database Models
 class User(db.Model):
@@ -69,6 +238,8 @@ class User(db.Model):
     google_id = db.Column(db.String(100), unique=True, nullable=True)
     profile_picture = db.Column(db.String(500), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Delta sync watermark (see deltasync.py)
+    updated_at = db.Column(db.DateTime, default=deltasync.utcnow(), onupdate=deltasync.utcnow())
     is_premium = db.Column(db.Boolean, default=False)
     reset_token = db.Column(db.String(100), unique=True, nullable=True)
     reset_token_expires = db.Column(db.DateTime, nullable=True)
@@ -80,81 +251,310 @@ class User(db.Model):
             'name': self.name,
             'profile_picture': self.profile_picture,
             'google_id': self.google_id,
-            'created_at': self.created_at.isoformat(),
+            'created_at': self.created_at,
             'is_premium': self.is_premium
         }
 
-    def generate_reset_token(self):
-        self.reset_token = secrets.token_urlsafe(32)
-        self.reset_token_expires = datetime.utcnow() + timedelta(hours=1)
-        db.session.commit()
-        return self.reset_token
 
-    def verify_reset_token(self, token):
-        if self.reset_token == token and self.reset_token_expires > datetime.utcnow():
-            return True
-        return False
+# Case-insensitive email lookups and user search (see usersearch.py)
+db.Index('ix_user_email_lower', db.func.lower(User.email))
+db.Index('ix_user_name_lower', db.func.lower(User.name))
+# Keyset scans of /api/sync
+db.Index('ix_user_updated', User.updated_at, User.id)
 
-    def clear_reset_token(self):
-        self.reset_token = None
-        self.reset_token_expires = None
-        db.session.commit()
 
-# CORS configuration for API access
-from flask_cors import CORS
-# Allow API access from frontend and other origins
-CORS(app, origins=['https://mcb-frontend.up.railway.app', 'http://localhost:3000', 'http://localhost:3001'], supports_credentials=True, allow_headers=['Content-Type', 'Authorization'])
+def user_columns():
+    """Columns of User.to_dict(), for writes that return the user (see userwrites.py)"""
+    return [User.__table__.c[field] for field in USER_LIST_FIELDS]
 
-# Session cookie tweaks for local dev
-# Session cookie tweaks for local dev
-app.config.setdefault('SESSION_COOKIE_SAMESITE', 'None')
-app.config.setdefault('SESSION_COOKIE_SECURE', True)  # True required for SameSite=None
-app.config.setdefault('SESSION_COOKIE_HTTPONLY', True)
 
-# Basic logging
-logging.basicConfig(level=logging.INFO)
+def user_by_email(email):
+    """The user with this email, ignoring case (uses ix_user_email_lower)"""
+    if not email:
+        return None
+    return User.query.filter(db.func.lower(User.email) == email.strip().lower()).first()
+
+
+# Statuses counted as finished in the dashboard stats; everything else is active
+COMPLETED_STATUSES = ('Accepted', 'Rejected')
+
+
+class Application(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    name = db.Column(db.String(200), nullable=False)
+    type = db.Column(db.String(50), nullable=True)
+    status = db.Column(db.String(50), nullable=False, default='Draft')
+    deadline = db.Column(db.Date, nullable=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    docs_done = db.Column(db.Integer, nullable=False, default=0)
+    docs_total = db.Column(db.Integer, nullable=False, default=0)
+    logo = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=deltasync.utcnow(), onupdate=deltasync.utcnow())
+
+    __table_args__ = (
+        db.Index('ix_application_user_deadline', 'user_id', 'deadline'),
+        db.Index('ix_application_user_status', 'user_id', 'status'),
+        db.Index('ix_application_user_updated', 'user_id', 'updated_at', 'id'),
+        # Incremental refreshes of the deadline index
+        db.Index('ix_application_updated', 'updated_at', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'type': self.type,
+            'status': self.status,
+            'deadline': self.deadline,
+            'progress': self.progress,
+            'docs_done': self.docs_done,
+            'docs_total': self.docs_total,
+            'logo': self.logo
+        }
+
+
+def user_applications(user_id):
+    """A user's applications ordered by deadline (uses ix_application_user_deadline)"""
+    return db.session.scalars(
+        db.select(Application).where(Application.user_id == user_id).order_by(Application.deadline, Application.id)
+    ).all()
+
+
+def application_stats(user_id):
+    """Dashboard counters computed in one aggregate query"""
+    total, completed = db.session.execute(
+        db.select(
+            db.func.count(Application.id),
+            db.func.coalesce(db.func.sum(db.case((Application.status.in_(COMPLETED_STATUSES), 1), else_=0)), 0),
+        ).where(Application.user_id == user_id)
+    ).one()
+    return {
+        'total_applications': total,
+        'active_applications': total - completed,
+        'completed_applications': completed
+    }
+
+
+# Development only: new accounts start with the demo applications so the clients have something to show
+SEED_DEMO_APPLICATIONS = os.getenv('SEED_DEMO_APPLICATIONS', '0') == '1'
+
+
+def demo_application_rows(user_ids):
+    rows = []
+    for user_id in user_ids:
+        for item in _demo_applications():
+            row = {k: v for k, v in item.items() if k != 'id'}
+            row['user_id'] = user_id
+            rows.append(row)
+    return rows
+
+
+@db.event.listens_for(User, 'after_insert')
+def seed_user_applications(mapper, connection, user):
+    if SEED_DEMO_APPLICATIONS:
+        connection.execute(Application.__table__.insert(), demo_application_rows([user.id]))
+        deadline_index.mark_stale()
+
+
+# Upcoming deadlines per user, in memory (see deadlines.py)
+deadline_index = deadlines.DeadlineIndex(Application.__table__)
+# Per-user and cohort application aggregates in rollup tables (see analytics.py)
+application_rollups = analytics.RollupRefresher(Application.__table__)
+# "thread" refreshes the rollups from each worker; "off" leaves it to `flask refresh-analytics` from cron
+ANALYTICS_REFRESHER = os.getenv('ANALYTICS_REFRESHER', 'thread')
+
+
+def start_analytics_refresher():
+    """Start this worker's background rollup refresh (ANALYTICS_REFRESHER=thread)"""
+    if ANALYTICS_REFRESHER == 'thread':
+        application_rollups.start(db.engine)
+
+# Serialized users keyed by id, so authenticated requests don't hit the users table. Per worker:
+# invalidate_user() only clears this worker's entry, the others catch up within USER_CACHE_TTL
+user_cache = LRUCache(maxsize=int(os.getenv('USER_CACHE_SIZE', 4096)), ttl=float(os.getenv('USER_CACHE_TTL', 30)))
+
+# Rendered read responses per user, with ETags; writes invalidate by tag
+response_cache = ResponseCache(
+    maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', 2048)),
+    ttl=float(os.getenv('RESPONSE_CACHE_TTL', 30)),
+    get_user_id=lambda: session.get('user_id'),
+    enabled=os.getenv('RESPONSE_CACHE_ENABLED', '1') != '0',
+)
+
+# Negotiated br/zstd/gzip with a cache of compressed bodies (see httpcompress.py)
+compressor = ResponseCompressor(
+    algorithms=[a.strip() for a in os.getenv('COMPRESS_ALGORITHMS', 'br,zstd,gzip').split(',') if a.strip()],
+    min_size=int(os.getenv('COMPRESS_MIN_SIZE', 1024)),
+    levels={algorithm: int(os.getenv('COMPRESS_%s_LEVEL' % algorithm.upper(), level))
+            for algorithm, level in (('br', 4), ('zstd', 3), ('gzip', 6))},
+    cache_bytes=int(os.getenv('COMPRESS_CACHE_BYTES', 16 * 1024 * 1024)),
+)
+
+# Sub-requests of POST /api/batch; they reuse the batch request's user lookup
+batch_dispatcher = BatchDispatcher(
+    max_requests=int(os.getenv('BATCH_MAX_REQUESTS', 20)),
+    max_response_bytes=int(os.getenv('BATCH_MAX_RESPONSE_BYTES', 5 * 1024 * 1024)),
+    timeout=float(os.getenv('BATCH_TIMEOUT', 10)),
+    workers=int(os.getenv('BATCH_WORKERS', 4)),
+    shared_g=('current_user',),
+)
+BATCH_MAX_BODY_BYTES = int(os.getenv('BATCH_MAX_BODY_BYTES', 1024 * 1024))
 
 # ===== Google OAuth Configuration =====
-# Read strictly from environment (no hardcoding)
-app.config['GOOGLE_CLIENT_ID'] = os.getenv('GOOGLE_CLIENT_ID')
-app.config['GOOGLE_CLIENT_SECRET'] = os.getenv('GOOGLE_CLIENT_SECRET')
-
-if not app.config['GOOGLE_CLIENT_ID'] or not app.config['GOOGLE_CLIENT_SECRET']:
-    print("WARNING: Google OAuth not configured. Set GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET environment variables.")
-    # Don't raise error for deployment - allow app to start without OAuth
-    app.config['GOOGLE_CLIENT_ID'] = None
-    app.config['GOOGLE_CLIENT_SECRET'] = None
-
-# Initialize OAuth only if credentials are available
-oauth = None
-if app.config['GOOGLE_CLIENT_ID'] and app.config['GOOGLE_CLIENT_SECRET']:
-    oauth = OAuth(app)
+GOOGLE_DISCOVERY_URL = os.getenv('GOOGLE_DISCOVERY_URL', 'https://accounts.google.com/.well-known/openid-configuration')
+_oauth_lock = threading.Lock()
+
+
+def _register_google(app):
+    if not app.config['GOOGLE_CLIENT_ID'] or not app.config['GOOGLE_CLIENT_SECRET']:
+        logging.warning("Google OAuth not configured. Set GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET environment variables.")
+        return None
+    # Authlib (and requests) are only imported once Google sign-in is used
+    from oidc import CachedOAuth, OIDCCache, HTTP_TIMEOUT as OIDC_HTTP_TIMEOUT
+
+    oauth = CachedOAuth(app)
     oauth.register(
         name='google',
         client_id=app.config['GOOGLE_CLIENT_ID'],
         client_secret=app.config['GOOGLE_CLIENT_SECRET'],
-        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+        server_metadata_url=GOOGLE_DISCOVERY_URL,
         client_kwargs={
-            'scope': 'openid email profile'
+            'scope': 'openid email profile',
+            'default_timeout': OIDC_HTTP_TIMEOUT
         }
     )
+    # Discovery document and JWKS are cached with TTL instead of fetched per login
+    oauth.google.oidc_cache = OIDCCache(GOOGLE_DISCOVERY_URL)
+    return oauth.google
+
+
+def google_oauth():
+    """The app's Google OAuth client, registered on first use; None when not configured"""
+    app = current_app._get_current_object()
+    if 'mcb.google_oauth' not in app.extensions:
+        with _oauth_lock:
+            if 'mcb.google_oauth' not in app.extensions:
+                app.extensions['mcb.google_oauth'] = _register_google(app)
+    return app.extensions['mcb.google_oauth']
+
+
+@bp.app_errorhandler(HashPoolBusy)
+def hash_pool_busy(e):
+    response = jsonify({"error": "Server is busy, please try again"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+# ===== Rate limiting for auth routes =====
+# Per-IP and per-account token buckets (requests per minute) plus a cap on concurrent hashing requests
+rate_limiter = create_rate_limiter(
+    os.getenv('RATE_LIMIT_BACKEND', 'memory'),
+    redis_url=os.getenv('RATE_LIMIT_REDIS_URL', os.getenv('SESSION_REDIS_URL')),
+)
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') != '0'
+AUTH_RATE_PER_IP = int(os.getenv('AUTH_RATE_PER_IP', 20))
+AUTH_RATE_PER_ACCOUNT = int(os.getenv('AUTH_RATE_PER_ACCOUNT', 5))
+AUTH_MAX_CONCURRENT = int(os.getenv('AUTH_MAX_CONCURRENT', 32))
+
+
+@bp.app_errorhandler(RateLimited)
+def rate_limited_response(e):
+    metrics.inc('mcb_rate_limit_rejections_total', (('reason', e.reason),))
+    response = jsonify({"error": "Too many requests, please try again later"})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 429
+
+
+def rate_limited(hashes=True):
+    """Throttle POSTs to an auth route; ``hashes`` routes also count against AUTH_MAX_CONCURRENT"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED or request.method != "POST":
+                return view(*args, **kwargs)
+            rate_limiter.check("ip", request.remote_addr or "unknown", AUTH_RATE_PER_IP)
+            payload = request.get_json(silent=True)
+            # Any client input, including a JSON body that isn't an object or a non-string email, just skips
+            # the per-account bucket; the view rejects it
+            email = payload.get("email") if isinstance(payload, dict) else None
+            email = email.strip().lower() if isinstance(email, str) else ""
+            if email:
+                rate_limiter.check("account", email, AUTH_RATE_PER_ACCOUNT)
+            if not hashes:
+                return view(*args, **kwargs)
+            rate_limiter.acquire("auth", AUTH_MAX_CONCURRENT)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                rate_limiter.release("auth")
+
+        return wrapped
+
+    return decorator
+
+
+def check_login(user, password):
+    """Verify a user's password, upgrading an outdated hash on success"""
+    if not user or not user.password_hash:
+        return False
+    ok, needs_rehash = verify_password(user.password_hash, password)
+    if ok and needs_rehash:
+        user.password_hash = hash_password(password)
+        db.session.commit()
+    return ok
+
+
+def current_user():
+    """Serialized user for this session, loaded lazily through the user cache"""
+    if 'current_user' not in g:
+        user_data = None
+        user_id = session.get("user_id")
+        if user_id:
+            user_data = user_cache.get(user_id)
+            if user_data is None:
+                user = db.session.get(User, user_id)
+                if user:
+                    user_data = user.to_dict()
+                    user_cache.set(user_id, user_data)
+        g.current_user = user_data
+    return g.current_user
+
+
+def login_user(user):
+    """Bind a user (a User or a row of user_columns()) to the session and return their serialized data"""
+    user_data = user.to_dict() if isinstance(user, User) else dict(user._mapping)
+    # A new session id on every login, so an id planted before it (session fixation) stays anonymous
+    session.regenerate()
+    session["user_id"] = user_data["id"]
+    user_cache.set(user_data["id"], user_data)
+    g.current_user = user_data
+    return user_data
+
+
+def invalidate_user(user_id):
+    user_cache.delete(user_id)
+    g.pop('current_user', None)
+    response_cache.invalidate('user:%s' % user_id, 'applications:%s' % user_id, 'users')
 
 
 def login_required(view):
     @wraps(view)
     def wrapped(*args, **kwargs):
-        if not session.get("user"):
-            return redirect(url_for("login"))
+        if not current_user():
+            return redirect(url_for(".login"))
         return view(*args, **kwargs)
 
     return wrapped
 
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
+@rate_limited()
 def login():
     # If already authenticated, return user info
-    if request.method == "GET" and session.get("user"):
-        return jsonify({"user": session.get("user")})
+    if request.method == "GET" and current_user():
+        return jsonify({"user": current_user()})
 
     if request.method == "POST":
         data = request.get_json() or {}
@@ -165,17 +565,17 @@ def login():
             return jsonify({"error": "Please enter email and password"}), 400
 
         # Check database for user
-        user = User.query.filter_by(email=email).first()
-        if user and user.password_hash and check_password_hash(user.password_hash, password):
-            session["user"] = user.to_dict()
-            return jsonify({"message": "Login successful", "user": session["user"]})
+        user = user_by_email(email)
+        if check_login(user, password):
+            return jsonify({"message": "Login successful", "user": login_user(user)})
         else:
             return jsonify({"error": "Invalid email or password"}), 401
 
     # Return JSON for API calls
     return jsonify({"message": "Please use Google OAuth for authentication"})
 
-@app.route("/api/login", methods=["POST"])
+@bp.route("/api/login", methods=["POST"])
+@rate_limited()
 def api_login():
     """API endpoint for login"""
     data = request.get_json() or {}
@@ -186,14 +586,14 @@ def api_login():
         return jsonify({"error": "Please enter email and password"}), 400
 
     # Check database for user
-    user = User.query.filter_by(email=email).first()
-    if user and user.password_hash and check_password_hash(user.password_hash, password):
-        session["user"] = user.to_dict()
-        return jsonify({"message": "Login successful", "user": session["user"]})
+    user = user_by_email(email)
+    if check_login(user, password):
+        return jsonify({"message": "Login successful", "user": login_user(user)})
     else:
         return jsonify({"error": "Invalid email or password"}), 401
 
-@app.route("/api/register", methods=["POST"])
+@bp.route("/api/register", methods=["POST"])
+@rate_limited()
 def api_register():
     """API endpoint for user registration"""
     data = request.get_json() or {}
@@ -208,56 +608,67 @@ def api_register():
     if len(password) < 6:
         return jsonify({"error": "Password must be at least 6 characters"}), 400
 
-    # Check if user already exists
-    existing_user = User.query.filter_by(email=email).first()
-    if existing_user:
+    new_user = create_account(email, hash_password(password), name)
+    if new_user is None:
         return jsonify({"error": "User with this email already exists"}), 409
 
-    # Create new user
-    password_hash = generate_password_hash(password)
-    new_user = User(
-        email=email,
-        password_hash=password_hash,
-        name=name,
-        is_premium=False  # Default for regular registration
-    )
-
-    db.session.add(new_user)
-    db.session.commit()
-
     # Auto-login after registration
-    session["user"] = new_user.to_dict()
-    return jsonify({"message": "Registration successful", "user": session["user"]}), 201
+    return jsonify({"message": "Registration successful", "user": login_user(new_user)}), 201
+
+
+def create_account(email, password_hash, name, is_premium=False):
+    """Insert a user and their demo applications and commit; the user_columns() row, or None if the email is taken
+
+    The duplicate check is part of the INSERT, so two requests for one email
+    can't both create it.
+    """
+    new_user = userwrites.insert_user(db.session, User.__table__, {
+        "email": email,
+        "password_hash": password_hash,
+        "name": name,
+        "is_premium": is_premium,
+    }, user_columns())
+    if new_user is None:
+        db.session.rollback()
+        return None
+    if SEED_DEMO_APPLICATIONS:
+        # Core inserts skip the after_insert hook
+        db.session.execute(db.insert(Application), demo_application_rows([new_user.id]))
+    db.session.commit()
+    deadline_index.mark_stale()
+    response_cache.invalidate('users')
+    return new_user
 
 
-@app.route('/login/google')
+@bp.route('/login/google')
 def login_google():
-    if not oauth:
+    google = google_oauth()
+    if not google:
         return jsonify({'error': 'Google OAuth not configured'}), 500
     # Start Google OAuth flow - use frontend URL for callback since Google redirects to frontend
     frontend_url = os.getenv('FRONTEND_URL', request.headers.get('Referer', 'https://mcb-frontend.up.railway.app').split('/')[0] + '//' + request.headers.get('Referer', 'https://mcb-frontend.up.railway.app').split('/')[2])
     # redirect_uri = f"{frontend_url}/auth/google/callback"
     # Ensure redirect_uri points to the BACKEND, not the frontend, because the route is here in app.py
-    redirect_uri = url_for('auth_google_callback', _external=True)
+    redirect_uri = url_for('.auth_google_callback', _external=True)
     # If running behind a proxy (like Railway), force HTTPS if the scheme comes through as http but we know it's https
     if 'railway.app' in redirect_uri and redirect_uri.startswith('http://'):
         redirect_uri = redirect_uri.replace('http://', 'https://')
-    return oauth.google.authorize_redirect(redirect_uri)
+    return google.authorize_redirect(redirect_uri)
 
 
-@app.route('/auth/google/callback')
+@bp.route('/auth/google/callback')
+@use_primary
 def auth_google_callback():
     try:
-        token = oauth.google.authorize_access_token()
+        # Exchanges the code and validates the ID token locally against the cached JWKS
+        google = google_oauth()
+        token = google.authorize_access_token()
         logging.info('Google OAuth token received: %s', 'yes' if token else 'no')
-        # Try to get userinfo from the OIDC UserInfo endpoint
-        resp = oauth.google.get('https://openidconnect.googleapis.com/v1/userinfo')
-        userinfo = resp.json() if resp and resp.json() else None
-        logging.info('Google userinfo fetched: %s', 'yes' if userinfo else 'no')
-        if not userinfo:
-            # Fallback to ID token if userinfo not available
-            userinfo = oauth.google.parse_id_token(token)
-            logging.info('Parsed ID token for userinfo: %s', 'yes' if userinfo else 'no')
+        userinfo = dict(token.get('userinfo') or {})
+        if not userinfo.get('sub') or not userinfo.get('email'):
+            # Only call the UserInfo endpoint when the ID token lacks the claims we need
+            userinfo.update(google.userinfo())
+            logging.info('Google userinfo fetched: %s', 'yes' if userinfo else 'no')
 
         if not userinfo:
             return jsonify({'error': 'Google authentication failed'}), 400
@@ -265,7 +676,7 @@ def auth_google_callback():
         # Check if user exists in database, create if not
         user = User.query.filter_by(google_id=userinfo.get('sub')).first()
         if not user:
-            user = User.query.filter_by(email=userinfo.get('email')).first()
+            user = user_by_email(userinfo.get('email'))
             if not user:
                 # Create new user
                 user = User(
@@ -277,38 +688,68 @@ def auth_google_callback():
                 )
                 db.session.add(user)
                 db.session.commit()
+                response_cache.invalidate('users')
             else:
                 # Update existing user with Google ID
                 user.google_id = userinfo.get('sub')
                 user.profile_picture = userinfo.get('picture')
                 db.session.commit()
+                invalidate_user(user.id)
 
         # Save user session
-        session['user'] = user.to_dict()
+        user_data = login_user(user)
 
         # Return JSON for API calls
         return jsonify({
             'message': 'Authentication successful',
-            'user': session['user']
+            'user': user_data
         })
-    except Exception as e:
+    except Exception:
+        # The details (provider responses, token errors) go to the log, not the client
         logging.exception('Google authentication error')
-        return jsonify({'error': 'Google authentication error: %s' % str(e)}), 500
+        return jsonify({'error': 'Google authentication failed'}), 500
+
+
+# ===== Email outbox =====
+# "thread" runs a dispatcher in each worker; "off" leaves delivery to `flask send-emails`
+EMAIL_DISPATCHER = os.getenv('EMAIL_DISPATCHER', 'thread')
+_email_dispatcher = None
+_email_dispatcher_lock = threading.Lock()
+
+
+def email_dispatcher():
+    global _email_dispatcher
+    with _email_dispatcher_lock:
+        if _email_dispatcher is None:
+            _email_dispatcher = outbox.Dispatcher(db.engine)
+        return _email_dispatcher
+
+
+def start_email_dispatcher():
+    """Start this worker's dispatcher (EMAIL_DISPATCHER=thread) so rows queued before it existed are delivered"""
+    if EMAIL_DISPATCHER == 'thread':
+        email_dispatcher().wake()
 
 
 def send_reset_email(email, reset_token):
-    """Send password reset email (placeholder - implement with your email service)"""
+    """Queue the password reset email; delivery happens in the background dispatcher"""
     try:
-        # This is a placeholder - implement with your email service (SendGrid, Mailgun, etc.)
-        print(f"Password reset requested for {email}. Token: {reset_token}")
-        print(f"Reset link: https://your-frontend-url.com/reset-password?token={reset_token}")
-        # In production, send actual email here
+        frontend_url = os.getenv('FRONTEND_URL', 'https://mcb-frontend.up.railway.app')
+        body = (
+            "We received a request to reset your MCB password.\n\n"
+            f"Reset link: {frontend_url}/reset-password?token={reset_token}\n\n"
+            "The link expires in one hour. If you didn't ask for this, you can ignore this email."
+        )
+        outbox.enqueue(db.engine, email, "Reset your MCB password", body,
+                       dedupe_key=f"password_reset:{email.lower()}")
+        start_email_dispatcher()
         return True
-    except Exception as e:
-        print(f"Error sending reset email: {e}")
+    except Exception:
+        logging.exception('Error queueing reset email')
         return False
 
-@app.route("/forgot-password", methods=["POST"])
+@bp.route("/forgot-password", methods=["POST"])
+@rate_limited(hashes=False)
 def forgot_password():
     data = request.get_json() or {}
     email = data.get("email", "").strip()
@@ -316,21 +757,22 @@ def forgot_password():
     if not email:
         return jsonify({"error": "Please provide an email address"}), 400
 
-    user = User.query.filter_by(email=email).first()
-    if not user or not user.password_hash:
+    # Generate reset token
+    reset_token = secrets.token_urlsafe(32)
+    user = userwrites.set_reset_token(db.session, User.__table__, email, reset_token)
+    db.session.commit()
+    if user is None:
         # Don't reveal if email exists or not for security
         return jsonify({"message": "If an account with this email exists, a password reset link has been sent"}), 200
 
-    # Generate reset token
-    reset_token = user.generate_reset_token()
-
-    # Send reset email
-    if send_reset_email(email, reset_token):
+    # To the address on the account, not the one typed (which may differ in case or spacing)
+    if send_reset_email(user.email, reset_token):
         return jsonify({"message": "If an account with this email exists, a password reset link has been sent"}), 200
     else:
         return jsonify({"error": "Failed to send reset email"}), 500
 
-@app.route("/reset-password", methods=["POST"])
+@bp.route("/reset-password", methods=["POST"])
+@rate_limited()
 def reset_password():
     data = request.get_json() or {}
     token = data.get("token", "").strip()
@@ -339,19 +781,17 @@ def reset_password():
     if not token or not new_password:
         return jsonify({"error": "Please provide token and new password"}), 400
 
-    # Find user by reset token
-    user = User.query.filter_by(reset_token=token).first()
-    if not user or not user.verify_reset_token(token):
+    # Update the password of the user holding the token and clear it
+    user_id = userwrites.reset_password(db.session, User.__table__, token, hash_password(new_password))
+    if user_id is None:
+        db.session.rollback()
         return jsonify({"error": "Invalid or expired reset token"}), 400
-
-    # Update password
-    user.password_hash = generate_password_hash(new_password)
-    user.clear_reset_token()
     db.session.commit()
 
     return jsonify({"message": "Password reset successful"}), 200
 
-@app.route("/register", methods=["POST"])
+@bp.route("/register", methods=["POST"])
+@rate_limited()
 def register():
     data = request.get_json() or {}
     email = data.get("email", "").strip()
@@ -361,28 +801,14 @@ def register():
     if not email or not password or not name:
         return jsonify({"error": "Please provide email, password, and name"}), 400
 
-    # Check if user already exists
-    existing_user = User.query.filter_by(email=email).first()
-    if existing_user:
+    new_user = create_account(email, hash_password(password), name)
+    if new_user is None:
         return jsonify({"error": "User with this email already exists"}), 409
 
-    # Create new user
-    password_hash = generate_password_hash(password)
-    new_user = User(
-        email=email,
-        password_hash=password_hash,
-        name=name,
-        is_premium=False  # Default for regular registration
-    )
-
-    db.session.add(new_user)
-    db.session.commit()
-
     # Auto-login after registration
-    session["user"] = new_user.to_dict()
-    return jsonify({"message": "Registration successful", "user": session["user"]}), 201
+    return jsonify({"message": "Registration successful", "user": login_user(new_user)}), 201
 
-@app.route("/api/users", methods=["POST"])
+@bp.route("/api/users", methods=["POST"])
 @login_required
 def create_user():
     """Admin endpoint to create users (requires authentication)"""
@@ -395,126 +821,428 @@ def create_user():
     if not email or not password or not name:
         return jsonify({"error": "Please provide email, password, and name"}), 400
 
-    # Check if user already exists
-    existing_user = User.query.filter_by(email=email).first()
-    if existing_user:
+    new_user = create_account(email, hash_password(password), name, is_premium)
+    if new_user is None:
         return jsonify({"error": "User with this email already exists"}), 409
 
-    # Create new user
-    password_hash = generate_password_hash(password)
-    new_user = User(
-        email=email,
-        password_hash=password_hash,
-        name=name,
-        is_premium=is_premium
-    )
-
-    db.session.add(new_user)
-    db.session.commit()
-
     return jsonify({
         "message": "User created successfully",
-        "user": new_user.to_dict()
+        "user": new_user
     }), 201
 
-@app.route("/api/users", methods=["GET"])
+# Columns that may be requested through ?fields= on the user listing
+USER_LIST_FIELDS = ('id', 'email', 'name', 'profile_picture', 'google_id', 'created_at', 'is_premium')
+USERS_PAGE_DEFAULT = 100
+USERS_PAGE_MAX = 1000
+USERS_STREAM_BATCH = 500
+
+
+def _parse_user_fields(raw):
+    """Turn ?fields=a,b into a tuple of User columns (id is always included for the cursor)"""
+    if not raw:
+        return USER_LIST_FIELDS
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in USER_LIST_FIELDS]
+    if unknown:
+        raise ValueError("Unknown fields: %s" % ', '.join(unknown))
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return tuple(dict.fromkeys(fields))
+
+
+def _int_arg(name, default=None, minimum=0):
+    """Query parameter ``name`` as an int of at least ``minimum``; ValueError for anything else"""
+    raw = request.args.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        value = None
+    if value is None or value < minimum:
+        raise ValueError("%s must be an integer of at least %d" % (name, minimum))
+    return value
+
+
+def _user_row_to_dict(row, fields):
+    data = {}
+    for field in fields:
+        value = getattr(row, field)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        data[field] = value
+    return data
+
+
+def _stream_users(query, fields, fmt):
+    """Stream rows of ``query`` as NDJSON or CSV without loading the whole result"""
+    def generate():
+        rows = db.session.execute(query.execution_options(yield_per=USERS_STREAM_BATCH))
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(fields)
+            for partition in rows.partitions():
+                for row in partition:
+                    writer.writerow(_user_row_to_dict(row, fields).values())
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for row in rows:
+                yield current_app.json.dumps(row) + "\n"
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+@bp.route("/api/users", methods=["GET"])
 @login_required
+@response_cache.cached(lambda uid: ['users'])
 def get_users():
-    """Get all users (requires authentication)"""
-    users = User.query.all()
+    """List users with keyset pagination (requires authentication)
+
+    Query parameters:
+      cursor  - return users with id greater than this value
+      limit   - page size (default 100, max 1000)
+      fields  - comma separated subset of columns to load
+      format  - "ndjson" streams every row after the cursor, one JSON object per line
+    A cursor or limit that isn't a whole number, or a limit under 1, is a 400.
+    """
+    try:
+        fields = _parse_user_fields(request.args.get("fields"))
+        cursor = _int_arg("cursor", 0)
+        limit = _int_arg("limit", minimum=1)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    columns = [getattr(User, field) for field in fields]
+    query = db.select(*columns).where(User.id > cursor).order_by(User.id)
+
+    wants_ndjson = (request.args.get("format") == "ndjson"
+                    or request.accept_mimetypes.best == "application/x-ndjson")
+    if wants_ndjson:
+        if limit:
+            query = query.limit(limit)
+        return _stream_users(query, fields, "ndjson")
+
+    limit = min(max(limit or USERS_PAGE_DEFAULT, 1), USERS_PAGE_MAX)
+    # Fetch one extra row to know whether another page exists
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        "users": rows,
+        "next_cursor": rows[-1].id if has_more else None
+    })
+
+@bp.route("/api/users/export", methods=["GET"])
+@login_required
+def export_users():
+    """Stream every user as CSV or NDJSON (requires authentication)"""
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    try:
+        fields = _parse_user_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = db.select(*[getattr(User, field) for field in fields]).order_by(User.id)
+    response = _stream_users(query, fields, fmt)
+    response.headers["Content-Disposition"] = "attachment; filename=users.%s" % fmt
+    return response
+
+
+BULK_IMPORT_CHUNK = int(os.getenv('BULK_IMPORT_CHUNK', 500))
+BULK_IMPORT_MAX_ROWS = int(os.getenv('BULK_IMPORT_MAX_ROWS', 50000))
+
+
+# Yielded by _read_import_rows() for a row that isn't valid UTF-8
+_NOT_UTF8 = object()
+
+
+def _read_import_rows():
+    """Yield dict rows from a CSV or NDJSON request body without buffering it
+
+    Bytes that aren't UTF-8 are decoded as U+FFFD; rows containing it are
+    yielded as _NOT_UTF8, unparsable NDJSON lines as None.
+    """
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8", errors="replace")
+    if request.mimetype == "text/csv":
+        for row in csv.DictReader(stream):
+            if any("\ufffd" in value for value in row.values() if isinstance(value, str)):
+                yield _NOT_UTF8
+            else:
+                yield row
+    else:
+        for line in stream:
+            line = line.strip()
+            if "\ufffd" in line:
+                yield _NOT_UTF8
+            elif line:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+
+def _import_chunk(chunk, seen, results):
+    """Validate, dedupe, hash and insert one chunk of (row number, row) pairs
+
+    Returns False when the hash pool stayed busy: the chunk's new rows are
+    reported as rejected and nothing of it was written.
+    """
+    candidates = []
+    for row_number, row in chunk:
+        if not isinstance(row, dict):
+            results.append({"row": row_number, "status": "error",
+                            "error": "Not valid UTF-8" if row is _NOT_UTF8 else "Invalid row"})
+            continue
+        email = str(row.get("email") or "").strip()
+        password = str(row.get("password") or "").strip()
+        name = str(row.get("name") or "").strip()
+        if not email or not password or not name:
+            results.append({"row": row_number, "email": email, "status": "error",
+                            "error": "email, password and name are required"})
+            continue
+        if email.lower() in seen:
+            results.append({"row": row_number, "email": email, "status": "duplicate"})
+            continue
+        seen.add(email.lower())
+        is_premium = row.get("is_premium", False)
+        if isinstance(is_premium, str):
+            is_premium = is_premium.strip().lower() in ("1", "true", "yes")
+        candidates.append((row_number, {"email": email, "password": password, "name": name,
+                                        "is_premium": bool(is_premium)}))
+
+    if not candidates:
+        return True
+
+    lowered = db.func.lower(User.email)
+    existing = set(db.session.scalars(
+        db.select(lowered).where(lowered.in_([c["email"].lower() for _, c in candidates]))))
+    new_rows = []
+    for row_number, candidate in candidates:
+        if candidate["email"].lower() in existing:
+            results.append({"row": row_number, "email": candidate["email"], "status": "duplicate"})
+        else:
+            new_rows.append((row_number, candidate))
+
+    try:
+        hashes = hash_passwords([c.pop("password") for _, c in new_rows])
+    except HashPoolBusy:
+        for row_number, candidate in new_rows:
+            results.append({"row": row_number, "email": candidate["email"], "status": "rejected",
+                            "error": "Server is busy, please try again"})
+        return False
+    for (_, candidate), password_hash in zip(new_rows, hashes):
+        candidate["password_hash"] = password_hash
+
+    # Same guard as registration: a row whose email another request took meanwhile, in any case, is skipped
+    created = userwrites.insert_users(db.session, User.__table__, [c for _, c in new_rows],
+                                      (User.id, User.email))
+    if SEED_DEMO_APPLICATIONS and created:
+        # Bulk inserts skip the after_insert hook
+        db.session.execute(db.insert(Application), demo_application_rows([row.id for row in created]))
+        deadline_index.mark_stale()
+    db.session.commit()
+    ids = {row.email: row.id for row in created}
+    for row_number, candidate in new_rows:
+        if candidate["email"] in ids:
+            results.append({"row": row_number, "email": candidate["email"], "status": "created",
+                            "id": ids[candidate["email"]]})
+        else:
+            results.append({"row": row_number, "email": candidate["email"], "status": "duplicate"})
+    return True
+
+
+@bp.route("/api/users/import", methods=["POST"])
+@login_required
+def import_users():
+    """Bulk create users from a CSV (text/csv) or NDJSON body (requires authentication)
+
+    Chunks are committed as they are read. Rows past BULK_IMPORT_MAX_ROWS, or
+    after the hash pool stayed busy, are not imported: the report counts them
+    as rejected and the status is 413 or 503, but it still lists every row
+    that was written.
+    """
+    results = []
+    seen = set()
+    chunk = []
+    skipped = 0
+    error, code = None, 200
+    for row_number, row in enumerate(_read_import_rows(), start=1):
+        if error is None and row_number > BULK_IMPORT_MAX_ROWS:
+            error, code = "Import is limited to %d rows" % BULK_IMPORT_MAX_ROWS, 413
+        if error is not None:
+            skipped += 1
+            continue
+        chunk.append((row_number, row))
+        if len(chunk) >= BULK_IMPORT_CHUNK:
+            if not _import_chunk(chunk, seen, results):
+                error, code = "Server is busy, please try again", 503
+            chunk = []
+    if chunk and not _import_chunk(chunk, seen, results):
+        error, code = "Server is busy, please try again", 503
+
+    summary = {status: sum(1 for r in results if r["status"] == status)
+               for status in ("created", "duplicate", "error", "rejected")}
+    summary["rejected"] += skipped
+    if summary["created"]:
+        response_cache.invalidate('users')
+    results.sort(key=lambda r: r["row"])
+    body = {"summary": summary, "results": results}
+    if error is not None:
+        body["error"] = error
+    return jsonify(body), code
+
+
+USER_SEARCH_DEFAULT = 20
+USER_SEARCH_MAX = 100
+
+
+@bp.route("/api/users/search", methods=["GET"])
+@login_required
+@response_cache.cached(lambda uid: ['users'])
+def search_users():
+    """Find users by email or name (requires authentication)
+
+    Query parameters:
+      q       - case-insensitive prefix or substring of the email or name
+      offset  - number of ranked results to skip (use next_offset from the previous page)
+      limit   - page size (default 20, max 100)
+      fields  - comma separated subset of columns to return
+    """
+    q = request.args.get("q", "").strip()
+    if not q or len(q) > 100:
+        return jsonify({"error": "q must be 1 to 100 characters"}), 400
+    try:
+        fields = _parse_user_fields(request.args.get("fields"))
+        offset = max(request.args.get("offset", 0, type=int), 0)
+        limit = min(max(request.args.get("limit", USER_SEARCH_DEFAULT, type=int), 1), USER_SEARCH_MAX)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows, has_more = usersearch.search(db.session, db.engine, User.__table__, q,
+                                       [getattr(User, field) for field in fields], limit, offset)
     return jsonify({
-        "users": [user.to_dict() for user in users]
+        "users": rows,
+        "next_offset": offset + len(rows) if has_more else None
     })
 
-@app.route("/api/users/<int:user_id>", methods=["GET"])
+
+@bp.route("/api/users/<int:user_id>", methods=["GET"])
 @login_required
+@response_cache.cached(lambda uid, user_id: ['user:%s' % user_id])
 def get_user(user_id):
     """Get specific user by ID (requires authentication)"""
     user = User.query.get_or_404(user_id)
-    return jsonify({"user": user.to_dict()})
+    return jsonify({"user": user})
 
-@app.route("/api/users/<int:user_id>", methods=["PUT"])
+@bp.route("/api/users/<int:user_id>", methods=["PUT"])
 @login_required
 def update_user(user_id):
     """Update user (requires authentication)"""
-    user = User.query.get_or_404(user_id)
     data = request.get_json() or {}
 
     # Update allowed fields
-    if "name" in data:
-        user.name = data["name"]
-    if "is_premium" in data:
-        user.is_premium = data["is_premium"]
+    values = {field: data[field] for field in ("name", "is_premium") if field in data}
 
     # Only update password if provided
     if "password" in data and data["password"]:
-        user.password_hash = generate_password_hash(data["password"])
+        values["password_hash"] = hash_password(data["password"])
 
+    user = userwrites.update_user(db.session, User.__table__, user_id, values, user_columns())
+    if user is None:
+        db.session.rollback()
+        abort(404)
     db.session.commit()
+    invalidate_user(user_id)
 
     return jsonify({
         "message": "User updated successfully",
-        "user": user.to_dict()
+        "user": user
     })
 
-@app.route("/api/users/<int:user_id>", methods=["DELETE"])
+@bp.route("/api/users/<int:user_id>", methods=["DELETE"])
 @login_required
 def delete_user(user_id):
     """Delete user (requires authentication)"""
-    user = User.query.get_or_404(user_id)
-
-    db.session.delete(user)
+    # Tombstones let /api/sync clients drop the user and its applications
+    deltasync.delete_where(db.session, Application.__table__, 'application', Application.user_id == user_id,
+                           owner_column=Application.user_id)
+    if not deltasync.delete_where(db.session, User.__table__, 'user', User.id == user_id):
+        db.session.rollback()
+        abort(404)
     db.session.commit()
+    deadline_index.mark_stale()
+    invalidate_user(user_id)
 
     return jsonify({"message": "User deleted successfully"})
 
-@app.route("/logout")
+@bp.route("/api/hash-pool/stats")
+@login_required
+def hash_pool_stats():
+    """Password hashing latency and queue depth (requires authentication)"""
+    return jsonify({"hash_pool": hashing.stats()})
+
+@bp.route("/api/rate-limit/stats")
+@login_required
+def rate_limit_stats():
+    """Requests rejected by the auth rate limiter in this worker (requires authentication)"""
+    return jsonify({"rate_limit": rate_limiter.stats()})
+
+@bp.route("/logout")
 def logout():
+    # Drops the stored record along with the cookie, so the old id can't be replayed
     session.clear()
+    session.regenerate()
+    g.pop('current_user', None)
     return jsonify({'message': 'Logged out successfully'})
 
 
-@app.route("/")
+@bp.route("/")
 def home():
     return jsonify({"message": "MCB College Application Assistant API", "version": "1.0.0"})
 
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
+@response_cache.cached(lambda uid: ['user:%s' % uid, 'applications:%s' % uid])
 def dashboard():
     # Always return JSON for API calls from React
-    user = session.get('user', {})
+    user = current_user()
     return jsonify({
         'user': user,
         'dashboard_data': {
-            'applications': _demo_applications(),
-            'stats': {
-                'total_applications': 4,
-                'active_applications': 3,
-                'completed_applications': 1
-            }
+            'applications': user_applications(user['id']),
+            'stats': application_stats(user['id'])
         }
     })
 
 
-@app.route('/account')
+@bp.route('/account')
 @login_required
 def account():
     # Return JSON for API calls
-    user = session.get('user', {})
+    user = current_user()
     return jsonify({'user': user})
 
 
 # -------------------- API Routes (JSON responses for React frontend) --------------------
 
 def _demo_applications():
+    """Starter applications for development accounts (see SEED_DEMO_APPLICATIONS), with deadlines around today"""
+    today = date.today()
     return [
         {
             'id': 1,
             'name': 'Stanford University',
             'type': 'Early Action',
             'status': 'In Progress',
-            'deadline': '2025-11-01',
+            'deadline': today + timedelta(days=30),
             'progress': 60,
             'docs_done': 3,
             'docs_total': 5,
@@ -525,7 +1253,7 @@ def _demo_applications():
             'name': 'MIT',
             'type': 'Regular Decision',
             'status': 'Submitted',
-            'deadline': '2025-01-05',
+            'deadline': today - timedelta(days=30),
             'progress': 100,
             'docs_done': 5,
             'docs_total': 5,
@@ -536,7 +1264,7 @@ def _demo_applications():
             'name': 'SAT December',
             'type': 'Test Registration',
             'status': 'Draft',
-            'deadline': '2025-12-01',
+            'deadline': today + timedelta(days=60),
             'progress': 20,
             'docs_done': 1,
             'docs_total': 3,
@@ -547,7 +1275,7 @@ def _demo_applications():
             'name': 'Harvard University',
             'type': 'Regular Decision',
             'status': 'Accepted',
-            'deadline': '2025-01-01',
+            'deadline': today - timedelta(days=45),
             'progress': 100,
             'docs_done': 5,
             'docs_total': 5,
@@ -556,54 +1284,268 @@ def _demo_applications():
     ]
 
 
-@app.route('/api/applications')
+@bp.route('/api/applications')
 @login_required
+@response_cache.cached(lambda uid: ['applications:%s' % uid])
 def api_applications():
-    apps = _demo_applications()
+    apps = user_applications(current_user()['id'])
     return jsonify({'applications': apps})
 
 
-@app.route('/api/applications/<int:app_id>')
+@bp.route('/api/applications/<int:app_id>')
 @login_required
+@response_cache.cached(lambda uid, app_id: ['applications:%s' % uid])
 def api_application_detail(app_id: int):
-    apps = _demo_applications()
-    app_item = next((a for a in apps if a['id'] == app_id), None)
-    if not app_item:
+    app_item = db.session.get(Application, app_id)
+    if not app_item or app_item.user_id != current_user()['id']:
         return jsonify({'error': 'Application not found'}), 404
     return jsonify({'application': app_item})
 
 
-@app.route('/api/applications/analytics')
+@bp.route('/api/applications/analytics')
 @login_required
+@response_cache.cached(lambda uid: ['applications:%s' % uid])
 def api_applications_analytics():
-    apps = _demo_applications()
-    return jsonify({'analytics': apps})
+    """Status counts, progress and document percentiles and deadlines by month, for the user and everyone"""
+    application_rollups.ensure_installed(db.engine)
+    # Outside gunicorn nothing else starts it; once running this is a pid check without a lock
+    start_analytics_refresher()
+    return jsonify({'analytics': analytics.read(db.session, current_user()['id'])})
 
 
-@app.route('/api/schools')
+@bp.route('/api/schools')
 @login_required
 def api_schools():
     return jsonify({'schools': []})
 
 
-@app.route('/api/deadlines')
+DEADLINES_DEFAULT_DAYS = 30
+# Open /api/deadlines/stream connections per worker. The stream's generator sleeps between checks, so
+# on gthread and sync workers each open stream pins one of the worker's threads for DEADLINE_STREAM_SECONDS:
+# 2 streams take half of a default gthread worker (GUNICORN_THREADS=4). Only gevent workers, where the
+# sleep yields to other greenlets, should take many streams; the shorter default lifetime elsewhere hands
+# the thread back sooner (EventSource reconnects by itself).
+_STREAMS_ON_GEVENT = os.getenv('GUNICORN_WORKER_CLASS') == 'gevent'
+DEADLINE_STREAM_MAX = int(os.getenv('DEADLINE_STREAM_MAX', 1000 if _STREAMS_ON_GEVENT else 2))
+DEADLINE_STREAM_SECONDS = float(os.getenv('DEADLINE_STREAM_SECONDS', 3600 if _STREAMS_ON_GEVENT else 300))
+DEADLINE_STREAM_HEARTBEAT = 15
+_deadline_streams = threading.BoundedSemaphore(DEADLINE_STREAM_MAX)
+
+
+@bp.route('/api/deadlines')
 @login_required
 def api_deadlines():
-    return jsonify({'deadlines': []})
+    """The current user's applications due in the next ?days= days (default 30), soonest first"""
+    days = min(max(request.args.get('days', DEADLINES_DEFAULT_DAYS, type=int), 0), deadlines.HORIZON_DAYS)
+    deadline_index.refresh(db.engine)
+    return jsonify({'deadlines': deadline_index.due(current_user()['id'], days)})
+
 
+def _sse_event(event, data, event_id=None):
+    return ('id: %s\n' % event_id if event_id else '') + 'event: %s\ndata: %s\n\n' % (event, data)
 
-@app.route('/api/mentor')
+
+@bp.route('/api/deadlines/stream')
+@login_required
+def api_deadlines_stream():
+    """Server-Sent Events: the deadlines inside the widest reminder window, then a "reminder" event
+    whenever an application enters a narrower window"""
+    user_id = current_user()['id']
+    engine = db.engine
+    dumps = current_app.json.dumps
+    deadline_index.refresh(engine)
+    # Don't hold a pooled connection for the life of the stream
+    db.session.close()
+    tracker = deadlines.ReminderTracker(deadline_index, user_id)
+    # Taken after the setup above, which may raise; from here on the response's close releases it
+    if not _deadline_streams.acquire(blocking=False):
+        response = jsonify({'error': 'Too many open deadline streams, please try again later'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    def generate():
+        yield 'retry: 10000\n\n'
+        yield _sse_event('deadlines', dumps({'deadlines': tracker.snapshot(), 'windows': tracker.windows}))
+        now = time.monotonic()
+        end, last_sent = now + DEADLINE_STREAM_SECONDS, now
+        while time.monotonic() < end:
+            time.sleep(min(deadlines.REFRESH_SECONDS, DEADLINE_STREAM_HEARTBEAT))
+            deadline_index.refresh(engine)
+            for item in tracker.reminders():
+                yield _sse_event('reminder', dumps(item), '%s-%s' % (item['application_id'], item['window']))
+                last_sent = time.monotonic()
+            if time.monotonic() - last_sent >= DEADLINE_STREAM_HEARTBEAT:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.call_on_close(_deadline_streams.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tell nginx-style proxies not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@bp.route('/api/mentor')
 @login_required
 def api_mentor():
     return jsonify({'mentor': {}})
 
 
-# Create database tables
-if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
+SYNC_PAGE_DEFAULT = 500
+SYNC_PAGE_MAX = 1000
+SYNC_USER_FIELDS = USER_LIST_FIELDS + ('updated_at',)
+
+
+@bp.route('/api/sync')
+# Pages are large and rarely repeat (cache misses); level 1 is within a few percent of the default's size
+@compressor.levels(br=1, zstd=1, gzip=1)
+@login_required
+def api_sync():
+    """Users, the current user's applications and deletions changed since ?since=<watermark>
+
+    Without since every row is sent. Pass the returned watermark as since
+    for the next page (while has_more is true) and the next sync.
+    """
+    limit = min(max(request.args.get('limit', SYNC_PAGE_DEFAULT, type=int), 1), SYNC_PAGE_MAX)
+    since = request.args.get('since')
+    if since:
+        try:
+            positions = deltasync.decode_watermark(since)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if 'deleted' not in positions or deltasync.expired(positions['deleted']):
+            return jsonify({'error': 'Watermark expired, sync again without since'}), 410
+    else:
+        # A new client has nothing to delete; only deletions from now on matter
+        positions = {'deleted': deltasync.settled_position(db.session)}
+
+    user_id = current_user()['id']
+    user_rows, positions['users'], users_more = deltasync.changed_since(
+        db.session, db.select(*[getattr(User, f) for f in SYNC_USER_FIELDS]),
+        User.updated_at, User.id, positions.get('users'), limit)
+    apps, positions['applications'], apps_more = deltasync.changed_since(
+        db.session, db.select(Application).where(Application.user_id == user_id),
+        Application.updated_at, Application.id, positions.get('applications'), limit, scalars=True)
+    deleted, positions['deleted'], deleted_more = deltasync.tombstones_since(
+        db.session, positions['deleted'], limit, user_id)
+
+    return jsonify({
+        'users': user_rows,
+        'applications': [dict(a.to_dict(), updated_at=a.updated_at) for a in apps],
+        'deleted': [{'kind': row.kind, 'id': row.object_id, 'deleted_at': row.deleted_at} for row in deleted],
+        'watermark': deltasync.encode_watermark(positions),
+        'has_more': users_more or apps_more or deleted_more,
+    })
+
+
+@bp.route('/api/batch', methods=['POST'])
+@login_required
+def api_batch():
+    """Run several API requests in one round trip; see batch.py for the format"""
+    if request.content_length and request.content_length > BATCH_MAX_BODY_BYTES:
+        return jsonify({'error': 'Batch request body too large'}), 413
+    payload = request.get_json(silent=True)
+    try:
+        items = batch_dispatcher.parse(payload)
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 413 if isinstance(e, BatchTooLarge) else 400
+    body = batch_dispatcher.run(current_app._get_current_object(), items, parallel=payload.get('parallel') is True)
+    return Response(body, mimetype='application/json')
+
+
+@bp.cli.command('seed-demo-applications')
+def seed_demo_applications_command():
+    """Give the demo applications to existing users that have none"""
+    has_apps = db.select(Application.user_id).where(Application.user_id == User.id).exists()
+    user_ids = db.session.scalars(db.select(User.id).where(~has_apps)).all()
+    for i in range(0, len(user_ids), 1000):
+        db.session.execute(db.insert(Application), demo_application_rows(user_ids[i:i + 1000]))
+    db.session.commit()
+    deadline_index.mark_stale()
+    print(f"Seeded applications for {len(user_ids)} users")
+
+
+@bp.cli.command('prune-tombstones')
+def prune_tombstones_command():
+    """Delete sync tombstones older than SYNC_TOMBSTONE_DAYS"""
+    print(f"Pruned {deltasync.prune(db.engine)} tombstones")
+
+
+@bp.cli.command('refresh-analytics')
+@click.option('--full', is_flag=True, help='Recompute every user instead of the changed ones')
+def refresh_analytics_command(full):
+    """Bring the application analytics rollups up to date"""
+    print(f"Recomputed analytics for {application_rollups.refresh(db.engine, full=full)} users")
+
+
+@bp.cli.command('send-emails')
+def send_emails_command():
+    """Run the email outbox dispatcher in the foreground"""
+    email_dispatcher().run_forever()
+
+
+def init_db():
+    """Create missing tables, columns and indexes: models, sync tracking, user search, analytics rollups,
+    the email outbox and (SESSION_BACKEND=sql) sessions; and build the analytics rollups if they need it"""
+    db.create_all()
+    deltasync.install(db.engine, User.__table__, Application.__table__)
+    outbox.install(db.engine)
+    usersearch.install(db.engine, User.__table__)
+    analytics.install(db.engine)
+    if SESSION_BACKEND == 'sql':
+        sessions.metadata.create_all(db.engine, checkfirst=True)
+    # The first rebuild runs here (and in refresh-analytics), never in an analytics request
+    application_rollups.refresh(db.engine)
+
+
+def warm_up():
+    """Do the work create_app() defers, so the first requests don't pay for it
+
+    Returns the seconds spent per step.
+    """
+    timings = {}
+    start = time.perf_counter()
+    init_db()
+    timings['schema'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for engine in db.engines.values():
+        with engine.connect():
+            pass
+    timings['db_connect'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hash_password(secrets.token_urlsafe(8))  # starts this process's hash pool
+    timings['hash_pool'] = time.perf_counter() - start
+
+    google = google_oauth()
+    if google:
+        start = time.perf_counter()
+        google.load_server_metadata()
+        google.fetch_jwk_set()
+        timings['oidc'] = time.perf_counter() - start
+    return timings
+
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create the database schema (safe to run on every deploy)"""
+    init_db()
+    print("Database schema is up to date")
+
+
+@bp.cli.command('warmup')
+def warmup_command():
+    """Create the schema and open DB connections, the hash pool and OIDC metadata"""
+    for step, seconds in warm_up().items():
+        print(f"{step}: {seconds * 1000:.0f} ms")
+
 
 if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        init_db()
     try:
         # Use PORT environment variable for Railway, default to 8000 for local development
         port = int(os.getenv('PORT', 8000))
@@ -0,0 +1,194 @@
+"""Several API requests in one round trip
+
+POST /api/batch takes {"requests": [{"id", "method", "path", "headers",
+"body"}, ...], "parallel": false} and runs every item through the app's own
+URL map and view functions, without another HTTP request. The answer is one
+JSON document, {"responses": [{"id", "status", "headers", "body"}, ...]}, in
+the order of the items; the JSON a view returned is copied into it as is.
+
+Items run one after the other inside the batch request's app context, so they
+share its g (the user loaded by the batch's auth check), its DB session and
+its server-side session. With "parallel": true and only GET/HEAD items, items
+run concurrently on a small thread pool instead, each in its own app context
+and DB session, with the values of ``shared_g`` copied from the batch request.
+
+Items skip the before/after-request hooks (metrics, SQL stats, CORS,
+compression, session saving); the batch response goes through them once.
+Streaming responses and nested batches are refused per item. Limits: items
+per batch, seconds of work (items not started in time get 504) and bytes of
+item responses (items past the limit get 413).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+from flask import g, request, session
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+
+log = logging.getLogger('mcb.batch')
+
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE')
+SAFE_METHODS = ('GET', 'HEAD')
+# Response headers copied into each item; clients use them for caching and retries
+PASSED_HEADERS = ('Content-Type', 'ETag', 'Cache-Control', 'Retry-After', 'Location')
+
+
+class BatchError(ValueError):
+    """The batch request itself is invalid"""
+
+
+class BatchTooLarge(BatchError):
+    """The batch has more items than allowed"""
+
+
+class BatchDispatcher:
+    def __init__(self, max_requests=20, max_response_bytes=5 * 1024 * 1024, timeout=10.0, workers=4,
+                 shared_g=()):
+        self.max_requests = max_requests
+        self.max_response_bytes = max_response_bytes
+        self.timeout = timeout
+        self.workers = workers
+        self.shared_g = shared_g
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def parse(self, payload):
+        """Validated items of a batch request body; raises BatchError"""
+        if not isinstance(payload, dict) or not isinstance(payload.get('requests'), list):
+            raise BatchError('Body must be a JSON object with a "requests" list')
+        raw_items = payload['requests']
+        if not raw_items:
+            raise BatchError('"requests" is empty')
+        if len(raw_items) > self.max_requests:
+            raise BatchTooLarge('At most %d requests per batch' % self.max_requests)
+
+        items = []
+        for index, raw in enumerate(raw_items):
+            if not isinstance(raw, dict):
+                raise BatchError('Request %d is not an object' % index)
+            method = str(raw.get('method') or 'GET').upper()
+            if method not in METHODS:
+                raise BatchError('Request %d: unsupported method %s' % (index, method))
+            path = raw.get('path')
+            if not isinstance(path, str) or not path.startswith('/') or path.startswith('//'):
+                raise BatchError('Request %d: "path" must be an absolute path' % index)
+            if urlsplit(path).path.rstrip('/') == request.path.rstrip('/'):
+                raise BatchError('Request %d: batches cannot be nested' % index)
+            headers = raw.get('headers') or {}
+            if not isinstance(headers, dict) or not all(isinstance(v, str) for v in headers.values()):
+                raise BatchError('Request %d: "headers" must map names to strings' % index)
+            items.append({'id': raw.get('id', index), 'method': method, 'path': path,
+                          'headers': headers, 'body': raw.get('body')})
+        return items
+
+    def _pool(self):
+        with self._lock:
+            # A pool inherited across fork has no threads; start one per process
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='mcb-batch')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _environ(self, item):
+        builder = EnvironBuilder(
+            path=item['path'], method=item['method'], headers=item['headers'],
+            json=item['body'] if item['body'] is not None else None,
+            base_url=request.host_url,
+            # The client address after ProxyFix, for per-IP rate limits
+            environ_base={'REMOTE_ADDR': request.remote_addr or ''},
+        )
+        try:
+            return builder.get_environ()
+        finally:
+            builder.close()
+
+    @staticmethod
+    def _encode(item_id, status, headers, body=b'', is_json=False):
+        head = json.dumps({'id': item_id, 'status': status, 'headers': headers})
+        if not body:
+            body = b'null'
+        elif not is_json:
+            body = json.dumps(body.decode('utf-8', 'replace')).encode()
+        return head[:-1].encode() + b', "body": ' + body + b'}'
+
+    def _error(self, item_id, status, message):
+        return self._encode(item_id, status, {}, json.dumps({'error': message}).encode(), True)
+
+    def _dispatch(self, app, item_id, environ, outer_session):
+        ctx = app.request_context(environ)
+        # Reuse the batch request's session instead of loading it again
+        ctx.session = outer_session
+        ctx.push()
+        try:
+            try:
+                rv = app.dispatch_request()
+            except HTTPException as e:
+                rv = app.handle_http_exception(e)
+                if isinstance(rv, HTTPException):
+                    # No error handler for it: the default error page
+                    rv = rv.get_response(ctx.request.environ)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            response = app.make_response(rv)
+            if response.is_streamed:
+                response.close()
+                return self._error(item_id, 400, "Streaming responses can't be batched")
+            headers = {name: response.headers[name] for name in PASSED_HEADERS if name in response.headers}
+            return self._encode(item_id, response.status_code, headers, response.get_data(), response.is_json)
+        except Exception:
+            log.exception('Batch item %s %s failed', environ['REQUEST_METHOD'], environ['PATH_INFO'])
+            db = app.extensions.get('sqlalchemy')
+            if db is not None:
+                db.session.rollback()
+            return self._error(item_id, 500, 'Internal server error')
+        finally:
+            ctx.pop()
+
+    def _dispatch_in_thread(self, app, item_id, environ, outer_session, shared):
+        with app.app_context():
+            for name, value in shared.items():
+                setattr(g, name, value)
+            return self._dispatch(app, item_id, environ, outer_session)
+
+    def run(self, app, items, parallel=False):
+        """Dispatch ``items`` (from parse()) and return the JSON body of the batch response"""
+        deadline = time.monotonic() + self.timeout
+        outer_session = session._get_current_object()
+        environs = [self._environ(item) for item in items]
+        results = []
+
+        if parallel and all(item['method'] in SAFE_METHODS for item in items):
+            shared = {name: g.get(name) for name in self.shared_g if name in g}
+            pool = self._pool()
+            futures = [pool.submit(self._dispatch_in_thread, app, item['id'], environ, outer_session, shared)
+                       for item, environ in zip(items, environs)]
+            wait(futures, timeout=max(deadline - time.monotonic(), 0))
+            for item, future in zip(items, futures):
+                if future.done():
+                    results.append(future.result())
+                else:
+                    future.cancel()
+                    results.append(self._error(item['id'], 504, 'Batch time limit exceeded'))
+        else:
+            size = 0
+            for item, environ in zip(items, environs):
+                if time.monotonic() >= deadline:
+                    results.append(self._error(item['id'], 504, 'Batch time limit exceeded'))
+                elif size > self.max_response_bytes:
+                    results.append(self._error(item['id'], 413, 'Batch response size limit exceeded'))
+                else:
+                    results.append(self._dispatch(app, item['id'], environ, outer_session))
+                    size += len(results[-1])
+
+        size = 0
+        for i, (item, result) in enumerate(zip(items, results)):
+            size += len(result)
+            if size > self.max_response_bytes:
+                results[i] = self._error(item['id'], 413, 'Batch response size limit exceeded')
+        return b'{"responses": [' + b', '.join(results) + b']}'
@@ -0,0 +1,112 @@
+"""Cost of the application analytics rollups: rebuild, incremental refresh and the endpoint read
+
+Seeds --users users with --apps applications each (random status, progress,
+documents and deadlines), then reports:
+  - a full rebuild of the rollup tables
+  - refresh() after --changed users each had one application updated
+  - refresh() with nothing changed
+Each refresh starts after SYNC_SETTLE_SECONDS, once the writes before it have
+left the settle window (which refresh() otherwise reads again).
+  - GET /api/applications/analytics through the test client (response cache
+    off, refreshes throttled as in production), against computing the same
+    cohort figures from the application table on every request
+
+    python benchmarks/bench_analytics.py --users 20000 --apps 10
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATUSES = ('Draft', 'In Progress', 'Submitted', 'Accepted', 'Rejected')
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--apps', type=int, default=10)
+    parser.add_argument('--changed', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=300)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='mcb_analytics_')
+    os.environ.update(DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'), FLASK_SKIP_DOTENV='1',
+                      RATE_LIMIT_ENABLED='0', RESPONSE_CACHE_ENABLED='0', SESSION_BACKEND='memory',
+                      SEED_DEMO_APPLICATIONS='0', METRICS_DIR=os.path.join(tmp, 'metrics'),
+                      SQL_SLOW_QUERY_MS='60000', ANALYTICS_REFRESHER='off')
+    sys.path.insert(0, ROOT)
+    import app as mcb
+    import deltasync
+
+    app = mcb.create_app({'SESSION_COOKIE_SECURE': False})
+    rng = random.Random(1)
+    with app.app_context():
+        mcb.init_db()
+        now = datetime.utcnow()
+        mcb.db.session.execute(mcb.db.insert(mcb.User), [
+            {'email': 'user%d@example.com' % i, 'name': 'User %d' % i, 'created_at': now}
+            for i in range(1, args.users + 1)])
+        for first in range(1, args.users + 1, 1000):
+            mcb.db.session.execute(mcb.db.insert(mcb.Application), [
+                {'user_id': user_id, 'name': 'School %d' % n, 'status': rng.choice(STATUSES),
+                 'progress': rng.randint(0, 100), 'docs_done': rng.randint(0, 6), 'docs_total': rng.choice((0, 4, 6)),
+                 'deadline': rng.choice((None, date(2026, rng.randint(1, 12), rng.randint(1, 28))))}
+                for user_id in range(first, min(first + 1000, args.users + 1)) for n in range(args.apps)])
+        mcb.db.session.commit()
+        engine = mcb.db.engine
+        rollups = mcb.application_rollups
+
+        time.sleep(deltasync.SETTLE_SECONDS)
+        seconds, users = timed(lambda: rollups.refresh(engine, full=True))
+        print('full rebuild           %8.0f ms  (%d users, %d applications)' % (
+            seconds * 1000, users, args.users * args.apps))
+
+        table = mcb.Application.__table__
+        changed = rng.sample(range(1, args.users + 1), args.changed)
+        ids = mcb.db.session.execute(mcb.db.select(mcb.db.func.min(table.c.id)).where(
+            table.c.user_id.in_(changed)).group_by(table.c.user_id)).scalars().all()
+        mcb.db.session.execute(table.update().where(table.c.id.in_(ids)).values(
+            progress=50))
+        mcb.db.session.commit()
+        time.sleep(deltasync.SETTLE_SECONDS)
+        seconds, users = timed(lambda: rollups.refresh(engine))
+        print('incremental refresh    %8.1f ms  (%d users recomputed)' % (seconds * 1000, users))
+        time.sleep(deltasync.SETTLE_SECONDS)
+        seconds, users = timed(lambda: rollups.refresh(engine))
+        print('refresh, no changes    %8.1f ms  (%d users recomputed)' % (seconds * 1000, users))
+
+    client = app.test_client()
+    client.post('/api/register', json={'email': 'bench@example.com', 'password': 'benchpass', 'name': 'Bench'})
+    client.get('/api/applications/analytics')
+    samples = []
+    for _ in range(args.requests):
+        seconds, _ = timed(lambda: client.get('/api/applications/analytics'))
+        samples.append(seconds)
+    print('GET analytics          %8.2f ms p50, %.2f ms max' % (statistics.median(samples) * 1000,
+                                                                max(samples) * 1000))
+
+    with app.app_context():
+        table = mcb.Application.__table__
+        docs = mcb.db.case((table.c.docs_total > 0, table.c.docs_done * 100 // table.c.docs_total))
+
+        def on_the_fly():
+            return [mcb.db.session.execute(mcb.db.select(column, mcb.db.func.count()).group_by(column)).all()
+                    for column in (table.c.status, table.c.progress, docs, table.c.deadline)]
+
+        seconds = statistics.median(timed(on_the_fly)[0] for _ in range(5))
+        print('cohort from raw rows   %8.1f ms per request' % (seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""CPU per request versus bytes saved for each compression algorithm and level
+
+Renders real response bodies through the test client (a seeded SQLite
+database with --users users), then compresses each body with every available
+algorithm at several levels and reports the time per request, the compressed
+size and the microseconds spent per KiB saved. Bodies below COMPRESS_MIN_SIZE
+are marked: the app sends them uncompressed.
+
+It then times whole requests for a large body with compression off, with
+compression but no cache, and with the cache of compressed bodies warm.
+
+    python benchmarks/bench_compression.py --users 2000 --repeat 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROUTES = ('/', '/account', '/api/deadlines', '/dashboard', '/api/applications', '/api/users?limit=100',
+          '/api/users?limit=1000', '/api/sync?limit=500')
+LEVELS = {'gzip': (1, 6, 9), 'br': (1, 4, 6, 9, 11), 'zstd': (1, 3, 6, 12, 19)}
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=300, help='requests per mode in the end-to-end comparison')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='mcb_compress_')
+    os.environ.update(DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'), FLASK_SKIP_DOTENV='1',
+                      RATE_LIMIT_ENABLED='0', RESPONSE_CACHE_ENABLED='0', SESSION_BACKEND='memory',
+                      METRICS_DIR=os.path.join(tmp, 'metrics'))
+    sys.path.insert(0, ROOT)
+    import app as mcb
+    import httpcompress
+
+    app = mcb.create_app({'SESSION_COOKIE_SECURE': False})
+    with app.app_context():
+        mcb.init_db()
+        now = datetime.utcnow()
+        mcb.db.session.execute(mcb.db.insert(mcb.User), [
+            {'email': 'user%d@example.com' % i, 'name': 'User %d' % i, 'created_at': now, 'is_premium': i % 7 == 0}
+            for i in range(1, args.users + 1)])
+        mcb.db.session.commit()
+
+    client = app.test_client()
+    client.post('/api/register', json={'email': 'bench@example.com', 'password': 'benchpass', 'name': 'Bench'})
+    bodies = {route: client.get(route).get_data() for route in ROUTES}
+    algorithms = [a for a in ('gzip', 'br', 'zstd') if httpcompress.COMPRESSORS[a] is not None]
+    missing = sorted(set(LEVELS) - set(algorithms))
+    if missing:
+        print('not installed: %s' % ', '.join(missing))
+
+    print('%-24s %8s %-5s %5s %9s %9s %7s %12s' % ('route', 'bytes', 'algo', 'level', 'us/req', 'out bytes',
+                                                   'ratio', 'us/KiB saved'))
+    for route, body in bodies.items():
+        skipped = ' (below COMPRESS_MIN_SIZE)' if len(body) < mcb.compressor.min_size else ''
+        for algorithm in algorithms:
+            for level in LEVELS[algorithm]:
+                seconds, out = timed(lambda: httpcompress.COMPRESSORS[algorithm](body, level), args.repeat)
+                saved = len(body) - len(out)
+                per_kib = '%12.1f' % (seconds * 1e6 / (saved / 1024)) if saved > 0 else '%12s' % '-'
+                print('%-24s %8d %-5s %5d %9.1f %9d %6.1f%% %s%s' % (
+                    route, len(body), algorithm, level, seconds * 1e6, len(out), 100.0 * len(out) / len(body),
+                    per_kib, skipped))
+
+    route = '/api/users?limit=1000'
+    print('\nwhole requests for %s (%d bytes), %d each' % (route, len(bodies[route]), args.requests))
+    cache = mcb.compressor.cache
+    for label, encoding, use_cache in (('identity', None, False), ('br, no cache', 'br', False),
+                                       ('br, cache warm', 'br', True), ('gzip, no cache', 'gzip', False),
+                                       ('gzip, cache warm', 'gzip', True)):
+        mcb.compressor.cache = cache if use_cache else None
+        headers = {'Accept-Encoding': encoding} if encoding else {}
+        client.get(route, headers=headers)
+        seconds, response = timed(lambda: client.get(route, headers=headers), args.requests)
+        print('%-18s %8.2f ms/req  %8d bytes' % (label, seconds * 1000, len(response.get_data())))
+    mcb.compressor.cache = cache
+    if cache is not None:
+        print('cache: %s' % cache.stats())
+
+
+if __name__ == '__main__':
+    main()
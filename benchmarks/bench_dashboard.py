@@ -0,0 +1,89 @@
+"""Dashboard latency over a large seeded applications table
+
+Seeds a fresh SQLite database with --users users and --apps applications per
+user, then requests /dashboard for random users (response cache disabled) and
+reports latency percentiles together with the query plans used.
+
+    python benchmarks/bench_dashboard.py --users 100000 --apps 20 --requests 2000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATUSES = ('Draft', 'In Progress', 'Submitted', 'Accepted', 'Rejected')
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+
+def seed(mcb, users, apps, batch=2000):
+    db = mcb.db
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    for first in range(1, users + 1, batch):
+        ids = range(first, min(first + batch, users + 1))
+        db.session.execute(db.insert(mcb.User), [
+            {'id': i, 'email': 'user%d@example.com' % i, 'name': 'User %d' % i, 'created_at': now} for i in ids])
+        db.session.execute(db.insert(mcb.Application), [
+            {'user_id': i, 'name': 'School %d' % n, 'type': 'Regular Decision',
+             'status': STATUSES[(i + n) % len(STATUSES)], 'deadline': date(2025, 1, 1) + timedelta(days=(i * 7 + n) % 365),
+             'progress': (i + n) % 101, 'docs_done': n % 6, 'docs_total': 5}
+            for i in ids for n in range(apps)])
+        db.session.commit()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--apps', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='mcb_bench_')
+    os.environ.update(DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                      RESPONSE_CACHE_ENABLED='0', SEED_DEMO_APPLICATIONS='0', SESSION_BACKEND='memory')
+    sys.path.insert(0, ROOT)
+    import app as mcb
+
+    app = mcb.create_app({'SESSION_COOKIE_SECURE': False})
+    with app.app_context():
+        mcb.db.create_all()
+        elapsed = seed(mcb, args.users, args.apps)
+        print('seeded %d users x %d applications in %.1fs' % (args.users, args.apps, elapsed))
+        conn = mcb.db.session.connection()
+        for label, query in (('list', mcb.db.select(mcb.Application).where(mcb.Application.user_id == 1)
+                                      .order_by(mcb.Application.deadline, mcb.Application.id)),
+                             ('stats', mcb.db.select(
+                                 mcb.db.func.count(mcb.Application.id),
+                                 mcb.db.func.sum(mcb.db.case(
+                                     (mcb.Application.status.in_(mcb.COMPLETED_STATUSES), 1), else_=0)))
+                                       .where(mcb.Application.user_id == 1))):
+            sql = str(query.compile(conn, compile_kwargs={'literal_binds': True}))
+            plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql).all()
+            print('plan %-5s: %s' % (label, '; '.join(row[-1] for row in plan)))
+
+    client = app.test_client()
+    latencies = []
+    for _ in range(args.requests):
+        with client.session_transaction() as sess:
+            sess['user_id'] = random.randint(1, args.users)
+        start = time.perf_counter()
+        response = client.get('/dashboard')
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+
+    print('/dashboard over %d requests: p50=%.2fms p95=%.2fms p99=%.2fms' % (
+        len(latencies), percentile(latencies, 0.50) * 1000, percentile(latencies, 0.95) * 1000,
+        percentile(latencies, 0.99) * 1000))
+
+
+if __name__ == '__main__':
+    main()
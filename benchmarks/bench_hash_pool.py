@@ -0,0 +1,114 @@
+"""Login flood benchmark: p99 latency of a non-auth route with and without the hash pool
+
+Runs the app on a local threaded server, floods /api/login from several
+threads and measures GET / latency at the same time. The run is repeated with
+HASH_POOL_WORKERS=0 (hashes inline in the request thread) and with the pool.
+
+    python benchmarks/bench_hash_pool.py --flood 16 --seconds 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    if not samples:
+        return 0.0
+    return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+
+def run_child(args):
+    import requests
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, ROOT)
+    import app as mcb
+
+    app = mcb.create_app({'SESSION_COOKIE_SECURE': False})
+    with app.app_context():
+        mcb.db.create_all()
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%d' % server.server_port
+
+    # A baseline that can't register or log in would flood with cheap 401/503s and never hash
+    r = requests.post(base + '/api/register', json={'email': 'bench@example.com', 'password': 'benchpass',
+                                                    'name': 'Bench'})
+    r.raise_for_status()
+    r = requests.post(base + '/api/login', json={'email': 'bench@example.com', 'password': 'benchpass'})
+    r.raise_for_status()
+
+    stop = time.monotonic() + args.seconds
+    logins = []
+
+    def flood():
+        s = requests.Session()
+        while time.monotonic() < stop:
+            r = s.post(base + '/api/login', json={'email': 'bench@example.com', 'password': 'benchpass'})
+            logins.append(r.status_code)
+
+    threads = [threading.Thread(target=flood) for _ in range(args.flood)]
+    for t in threads:
+        t.start()
+
+    probe = requests.Session()
+    latencies = []
+    while time.monotonic() < stop:
+        start = time.perf_counter()
+        probe.get(base + '/')
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.01)
+
+    for t in threads:
+        t.join()
+    server.shutdown()
+    print(json.dumps({
+        'hash_pool_workers': os.environ.get('HASH_POOL_WORKERS'),
+        'logins': len(logins),
+        'logins_rejected': sum(1 for code in logins if code == 503),
+        'probe_requests': len(latencies),
+        'probe_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'probe_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--flood', type=int, default=16, help='concurrent login threads')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 2) // 2, 1), help='hash pool size')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    results = []
+    for workers in (0, args.workers):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ,
+                       DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                       HASH_POOL_WORKERS=str(workers),
+                       RATE_LIMIT_ENABLED='0')
+            out = subprocess.run(
+                [sys.executable, __file__, '--child', '--flood', str(args.flood), '--seconds', str(args.seconds)],
+                env=env, capture_output=True, text=True, check=True)
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    for r in results:
+        label = 'inline' if r['hash_pool_workers'] == '0' else 'pool(%s)' % r['hash_pool_workers']
+        print('%-10s logins=%-6d rejected=%-6d GET / p50=%.2fms p99=%.2fms' % (
+            label, r['logins'], r['logins_rejected'], r['probe_p50_ms'], r['probe_p99_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""JSON encoding cost of get_users-sized responses
+
+Loads --rows user rows the way GET /api/users does and times building the
+response three ways:
+  dicts + Flask default   the previous path: a dict per row with isoformat(),
+                          then Flask's stdlib provider
+  rows + stdlib           FastJSONProvider with JSON_BACKEND=stdlib, rows passed as is
+  rows + orjson           FastJSONProvider with orjson, rows passed as is
+and then whole GET /api/users?limit=N requests through the test client with
+each backend (response cache off).
+
+    python benchmarks/bench_json.py --rows 100,1000 --repeat 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', default='100,1000', help='comma separated page sizes')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    sizes = [int(n) for n in args.rows.split(',')]
+
+    tmp = tempfile.mkdtemp(prefix='mcb_json_')
+    os.environ.update(DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'), FLASK_SKIP_DOTENV='1',
+                      RATE_LIMIT_ENABLED='0', RESPONSE_CACHE_ENABLED='0', SESSION_BACKEND='memory',
+                      SEED_DEMO_APPLICATIONS='0', METRICS_DIR=os.path.join(tmp, 'metrics'))
+    sys.path.insert(0, ROOT)
+    import app as mcb
+    from flask.json.provider import DefaultJSONProvider
+
+    app = mcb.create_app({'SESSION_COOKIE_SECURE': False})
+    with app.app_context():
+        mcb.init_db()
+        now = datetime.utcnow()
+        mcb.db.session.execute(mcb.db.insert(mcb.User), [
+            {'email': 'user%d@example.com' % i, 'name': 'User %d' % i, 'created_at': now, 'is_premium': i % 7 == 0}
+            for i in range(1, max(sizes) + 1)])
+        mcb.db.session.commit()
+
+    fields = mcb.USER_LIST_FIELDS
+    columns = [getattr(mcb.User, field) for field in fields]
+    fast = app.json
+    flask_default = DefaultJSONProvider(app)
+    print('backend available: %s' % ('orjson' if mcb.FastJSONProvider.backend == 'orjson' else 'stdlib only'))
+
+    print('%6s %-22s %10s %10s' % ('rows', 'path', 'ms/resp', 'us/row'))
+    with app.test_request_context():
+        for n in sizes:
+            rows = mcb.db.session.execute(mcb.db.select(*columns).order_by(mcb.User.id).limit(n)).all()
+            cases = [('dicts + Flask default',
+                      lambda: flask_default.response({'users': [mcb._user_row_to_dict(r, fields) for r in rows],
+                                                      'next_cursor': None}))]
+            for backend in ('stdlib', 'orjson'):
+                if backend == 'orjson' and mcb.FastJSONProvider.backend != 'orjson':
+                    continue
+
+                def encode(backend=backend):
+                    fast.backend = backend
+                    return fast.response({'users': rows, 'next_cursor': None})
+                cases.append(('rows + %s' % backend, encode))
+            for label, fn in cases:
+                seconds = timed(fn, args.repeat)
+                print('%6d %-22s %10.3f %10.2f' % (n, label, seconds * 1000, seconds * 1e6 / n))
+        fast.backend = mcb.FastJSONProvider.backend
+
+    client = app.test_client()
+    client.post('/api/register', json={'email': 'bench@example.com', 'password': 'benchpass', 'name': 'Bench'})
+    print('\nwhole GET /api/users requests')
+    for n in sizes:
+        for backend in ('stdlib', 'orjson'):
+            if backend == 'orjson' and mcb.FastJSONProvider.backend != 'orjson':
+                continue
+            fast.backend = backend
+            seconds = timed(lambda: client.get('/api/users?limit=%d' % n), max(args.repeat // 4, 10))
+            print('%6d %-22s %10.3f ms/req' % (n, backend, seconds * 1000))
+    fast.backend = mcb.FastJSONProvider.backend
+
+
+if __name__ == '__main__':
+    main()
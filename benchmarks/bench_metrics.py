@@ -0,0 +1,63 @@
+"""Per-request cost of the metrics hooks, and a multi-process aggregation check
+
+    python benchmarks/bench_metrics.py --requests 200000 --workers 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Process
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def record_one(metrics, i):
+    # Mirrors what the before/after/teardown request hooks in app.py do
+    metrics.inc('mcb_http_requests_in_flight')
+    metrics.observe_request('endpoint_%d' % (i % 20), 'GET', 200, (i % 100) / 1000.0)
+    metrics.set_gauge('mcb_hash_pool_queue_depth', 0)
+    metrics.set_gauge('mcb_db_pool_checked_out', 1)
+    metrics.inc('mcb_http_requests_in_flight', amount=-1)
+
+
+def worker(n):
+    import metrics
+    for i in range(n):
+        record_one(metrics, i)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='mcb_bench_metrics_')
+    import metrics
+
+    start = time.perf_counter()
+    for i in range(args.requests):
+        record_one(metrics, i)
+    elapsed = time.perf_counter() - start
+    print('hooks: %.2f us per request (%d requests)' % (elapsed / args.requests * 1e6, args.requests))
+
+    per_worker = args.requests // args.workers
+    procs = [Process(target=worker, args=(per_worker,)) for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    start = time.perf_counter()
+    samples = metrics.collect()
+    collect_ms = (time.perf_counter() - start) * 1000
+    total = sum(v for k, v in samples.items() if k.startswith('mcb_http_requests_total'))
+    expected = args.requests + per_worker * args.workers
+    print('aggregated requests_total=%d expected=%d (%s), collect took %.2f ms' % (
+        total, expected, 'ok' if total == expected else 'MISMATCH', collect_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Google sign-in callback latency against a local stand-in OIDC provider
+
+Every provider request is delayed by --latency seconds to mimic a network
+round trip. The "cached" run is the current flow: discovery and JWKS come
+from the TTL cache and the ID token is validated locally, so a warm login
+makes a single call (the token exchange). The "userinfo" run strips the ID
+token claims, forcing the UserInfo round trip the callback used to make on
+every login.
+The first login pays for the JWKS fetch (discovery is loaded by /login/google).
+
+    python benchmarks/bench_oidc.py --latency 0.05 --logins 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlparse
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from oidc_stub import StubOIDCProvider
+
+
+def login(client):
+    start = client.get('/login/google')
+    authorize = requests.get(start.headers['Location'], allow_redirects=False, timeout=10)
+    callback = urlparse(authorize.headers['Location'])
+    t0 = time.perf_counter()
+    response = client.get(callback.path + '?' + callback.query)
+    elapsed = time.perf_counter() - t0
+    assert response.status_code == 200, response.get_json()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every provider request')
+    parser.add_argument('--logins', type=int, default=50)
+    args = parser.parse_args()
+
+    provider = StubOIDCProvider(latency=args.latency).start()
+    tmp = tempfile.mkdtemp(prefix='mcb_bench_')
+    os.environ.update(DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'), SESSION_BACKEND='memory',
+                      GOOGLE_CLIENT_ID=provider.client_id, GOOGLE_CLIENT_SECRET='stub-secret',
+                      GOOGLE_DISCOVERY_URL=provider.discovery_url)
+    import app as mcb
+
+    app = mcb.create_app({'SESSION_COOKIE_SECURE': False})
+    with app.app_context():
+        mcb.db.create_all()
+    client = app.test_client()
+
+    cold = login(client)
+    print('cold login (JWKS fetched): %.1f ms' % (cold * 1000))
+
+    for label, id_token_has_email in (('cached', True), ('userinfo', False)):
+        provider.id_token_has_email = id_token_has_email
+        provider.requests.clear()
+        timings = sorted(login(client) for _ in range(args.logins))
+        calls = sum(n for path, n in provider.requests.items() if path != '/authorize') / args.logins
+        print('%-8s p50=%.1f ms p95=%.1f ms, provider calls per login=%.1f %s' % (
+            label, timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.95)] * 1000, calls,
+            dict(provider.requests)))
+    provider.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Request latency with the sampling profiler off, armed and sampling
+
+Times GET requests through the test client against a database with --users
+users in three setups:
+  off        neither PROFILE_TOKEN nor PROFILE_SAMPLE_RATE: no hooks registered
+  armed      PROFILE_TOKEN set, requests without X-Profile
+  sampling   every request carries X-Profile, so it is sampled and its profile
+             written to PROFILE_DIR
+Rounds alternate between the setups so drift in machine speed hits them
+equally; the reported figure is the median round.
+
+    python benchmarks/bench_profiling.py --users 1000 --requests 2000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ('/', '/api/users?limit=100')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per route and setup')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='mcb_profiling_')
+    os.environ.update(DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'), FLASK_SKIP_DOTENV='1',
+                      RATE_LIMIT_ENABLED='0', RESPONSE_CACHE_ENABLED='0', SESSION_BACKEND='memory',
+                      SEED_DEMO_APPLICATIONS='0', METRICS_DIR=os.path.join(tmp, 'metrics'),
+                      PROFILE_DIR=os.path.join(tmp, 'profiles'))
+    os.environ.pop('PROFILE_TOKEN', None)
+    os.environ.pop('PROFILE_SAMPLE_RATE', None)
+    sys.path.insert(0, ROOT)
+    import logging
+    import app as mcb
+    import profiling
+
+    logging.getLogger('mcb.profiling').setLevel(logging.WARNING)
+    off = mcb.create_app({'SESSION_COOKIE_SECURE': False})
+    profiling.TOKEN = 'bench'
+    armed = mcb.create_app({'SESSION_COOKIE_SECURE': False})
+    with off.app_context():
+        mcb.init_db()
+        now = datetime.utcnow()
+        mcb.db.session.execute(mcb.db.insert(mcb.User), [
+            {'email': 'user%d@example.com' % i, 'name': 'User %d' % i, 'created_at': now}
+            for i in range(1, args.users + 1)])
+        mcb.db.session.commit()
+
+    clients = {}
+    for label, app in (('off', off), ('armed', armed)):
+        clients[label] = app.test_client()
+        clients[label].post('/api/register', json={'email': 'bench-%s@example.com' % label,
+                                                   'password': 'benchpass', 'name': 'Bench'})
+
+    setups = (('off', {}), ('armed', {}), ('sampling', {'X-Profile': 'bench'}))
+    print('%-10s %-22s %10s' % ('setup', 'route', 'us/req'))
+    for route in ROUTES:
+        rounds = {label: [] for label, _ in setups}
+        for _ in range(args.rounds):
+            for label, headers in setups:
+                client = clients['off' if label == 'off' else 'armed']
+                client.get(route, headers=headers)
+                start = time.perf_counter()
+                for _ in range(args.requests // args.rounds):
+                    client.get(route, headers=headers)
+                rounds[label].append((time.perf_counter() - start) / (args.requests // args.rounds))
+        for label, _ in setups:
+            print('%-10s %-22s %10.1f' % (label, route, statistics.median(rounds[label]) * 1e6))
+    print('\nprofiles kept: %d' % len(profiling.list_profiles()))
+
+
+if __name__ == '__main__':
+    main()
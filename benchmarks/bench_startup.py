@@ -0,0 +1,92 @@
+"""Cold start time of the app in fresh processes
+
+Each run starts a new Python process that imports app, calls create_app()
+and serves a first request without the database (GET /) and a first one that
+queries it (POST /api/login for an unknown account), through the test client.
+With --gunicorn it also measures how long `gunicorn wsgi:app` takes from
+launch until it answers GET /.
+
+    python benchmarks/bench_startup.py --runs 10 --gunicorn
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from loadtest import ROOT, free_port, percentile
+
+CHILD = r'''
+import json, time
+t0 = time.perf_counter()
+import app as mcb
+t1 = time.perf_counter()
+flask_app = mcb.create_app()
+t2 = time.perf_counter()
+client = flask_app.test_client()
+client.get('/')
+t3 = time.perf_counter()
+client.post('/api/login', json={'email': 'nobody@example.com', 'password': 'not-a-password'})
+t4 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'create_app': t2 - t1, 'first_request': t3 - t2, 'first_db_request': t4 - t3}))
+'''
+
+
+def run_child(env):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    timings = json.loads(out.strip().splitlines()[-1])
+    timings['process_total'] = time.perf_counter() - start
+    return timings
+
+
+def gunicorn_ready(env):
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(['gunicorn', 'wsgi:app', '-c', 'gunicorn.conf.py'], cwd=ROOT,
+                            env=dict(env, PORT=str(port), WEB_CONCURRENCY='1'),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                requests.get('http://127.0.0.1:%d/' % port, timeout=1)
+                return time.perf_counter() - start
+            except requests.ConnectionError:
+                if proc.poll() is not None:
+                    raise RuntimeError('gunicorn exited with %s' % proc.returncode)
+                time.sleep(0.01)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--gunicorn', action='store_true', help='also time gunicorn from launch to first response')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='mcb_startup_')
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(tmp, 'startup.db'), FLASK_SKIP_DOTENV='1',
+               RATE_LIMIT_ENABLED='0', METRICS_DIR=os.path.join(tmp, 'metrics'))
+    subprocess.run([sys.executable, '-c', 'import app\nwith app.create_app().app_context(): app.init_db()'],
+                   cwd=ROOT, env=env, check=True, capture_output=True)
+
+    runs = [run_child(env) for _ in range(args.runs)]
+    for step in ('import', 'create_app', 'first_request', 'first_db_request', 'process_total'):
+        samples = [r[step] for r in runs]
+        print('%-17s p50=%6.1f ms  max=%6.1f ms' % (step, percentile(samples, 0.5) * 1000, max(samples) * 1000))
+
+    if args.gunicorn:
+        samples = [gunicorn_ready(env) for _ in range(args.runs)]
+        print('%-17s p50=%6.1f ms  max=%6.1f ms' % ('gunicorn_ready', percentile(samples, 0.5) * 1000,
+                                                     max(samples) * 1000))
+
+
+if __name__ == '__main__':
+    main()
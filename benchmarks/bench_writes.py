@@ -0,0 +1,126 @@
+"""Write throughput of concurrent registrations: check-then-insert vs. one INSERT ... ON CONFLICT
+
+Registers --users new accounts from --threads threads two ways, against a
+fresh SQLite file (or --database-url):
+  select + insert   the previous path: user_by_email(), then an ORM insert
+                    and commit
+  insert returning  userwrites.insert_user(), the duplicate check inside
+                    the INSERT
+and reports registrations per second and statements per registration. Then
+every thread registers the same email at once: the previous path can pass
+its check in several threads and fail with IntegrityError, the single
+statement creates the user once and reports a duplicate to the others.
+
+Passwords are hashed once up front so the numbers are the database path only
+(demo applications are not seeded). Whole POST /api/register requests, hashes
+included, are timed at the end with a cheap PASSWORD_HASH_METHOD.
+
+    python benchmarks/bench_writes.py --users 2000 --threads 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_threads(threads, fn):
+    workers = [threading.Thread(target=fn, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000, help='registrations per mode')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=300, help='whole POST /api/register requests')
+    parser.add_argument('--database-url', help='default: a SQLite file in a temp dir')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='mcb_writes_')
+    os.environ.update(DATABASE_URL=args.database_url or 'sqlite:///' + os.path.join(tmp, 'bench.db'),
+                      FLASK_SKIP_DOTENV='1', RATE_LIMIT_ENABLED='0', RESPONSE_CACHE_ENABLED='0',
+                      SESSION_BACKEND='memory', SEED_DEMO_APPLICATIONS='0', EMAIL_DISPATCHER='off',
+                      PASSWORD_HASH_METHOD='pbkdf2:sha256:1000', SQL_SLOW_QUERY_MS='60000',
+                      METRICS_DIR=os.path.join(tmp, 'metrics'))
+    sys.path.insert(0, ROOT)
+    import app as mcb
+    import userwrites
+    from sqlalchemy import event
+    from sqlalchemy.exc import IntegrityError
+
+    app = mcb.create_app({'SESSION_COOKIE_SECURE': False})
+    with app.app_context():
+        mcb.init_db()
+        engine = mcb.db.engine
+        password_hash = mcb.hash_password('benchpass')
+    statements = [0]
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(*_):
+        statements[0] += 1
+
+    def select_insert(email):
+        if mcb.user_by_email(email):
+            return False
+        mcb.db.session.add(mcb.User(email=email, password_hash=password_hash, name='Bench', is_premium=False))
+        mcb.db.session.commit()
+        return True
+
+    def insert_returning(email):
+        row = userwrites.insert_user(mcb.db.session, mcb.User.__table__, {
+            'email': email, 'password_hash': password_hash, 'name': 'Bench', 'is_premium': False,
+        }, mcb.user_columns())
+        mcb.db.session.commit()
+        return row is not None
+
+    print('%-18s %8s %10s %10s' % ('path', 'users', 'users/s', 'stmts/user'))
+    for label, register in (('select + insert', select_insert), ('insert returning', insert_returning)):
+        per_thread = args.users // args.threads
+
+        def work(i):
+            with app.app_context():
+                for n in range(per_thread):
+                    register('%s-%d-%d@example.com' % (label.split()[0], i, n))
+
+        statements[0] = 0
+        seconds = run_threads(args.threads, work)
+        total = per_thread * args.threads
+        print('%-18s %8d %10.0f %10.1f' % (label, total, total / seconds, statements[0] / total))
+
+    print('\n%d threads registering one email at once' % args.threads)
+    for label, register in (('select + insert', select_insert), ('insert returning', insert_returning)):
+        outcomes = []
+        barrier = threading.Barrier(args.threads)
+
+        def race(i):
+            with app.app_context():
+                barrier.wait()
+                try:
+                    outcomes.append('created' if register('race-%s@example.com' % label.split()[0]) else 'duplicate')
+                except IntegrityError:
+                    mcb.db.session.rollback()
+                    outcomes.append('IntegrityError')
+
+        run_threads(args.threads, race)
+        print('%-18s %s' % (label, ', '.join('%s %d' % (o, outcomes.count(o)) for o in sorted(set(outcomes)))))
+
+    client = app.test_client()
+    start = time.perf_counter()
+    for n in range(args.requests):
+        client.post('/api/register', json={'email': 'req-%d@example.com' % n, 'password': 'benchpass',
+                                           'name': 'Bench'})
+    seconds = time.perf_counter() - start
+    print('\nwhole POST /api/register: %.2f ms/req' % (seconds * 1000 / args.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Throughput of the gunicorn worker modes under a fixed client load
+
+Starts `gunicorn wsgi:app -c gunicorn.conf.py` once per worker class against a
+fresh SQLite database, registers one account per client, and has every client
+loop over an authenticated read mix (plus a login every --login-every
+requests) for --seconds. Reports requests/s and latency percentiles per mode.
+
+    python benchmarks/loadtest.py --modes sync,gthread,gevent --clients 32 --seconds 20
+"""
+import argparse
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READ_MIX = ('/dashboard', '/api/applications', '/account', '/api/users?limit=20', '/')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p), len(samples) - 1)] if samples else 0.0
+
+
+def wait_ready(base, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('gunicorn exited with %s' % proc.returncode)
+        try:
+            requests.get(base + '/', timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+@contextmanager
+def serve(env):
+    """Run `gunicorn -c gunicorn.conf.py` with ``env`` and yield its base URL"""
+    port = free_port()
+    env = dict(env, PORT=str(port))
+    proc = subprocess.Popen(['gunicorn', 'wsgi:app', '-c', 'gunicorn.conf.py'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = 'http://127.0.0.1:%d' % port
+    try:
+        wait_ready(base, proc)
+        yield base
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def run_mode(mode, args):
+    tmp = tempfile.mkdtemp(prefix='mcb_load_')
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=mode,
+               DATABASE_URL='sqlite:///' + os.path.join(tmp, 'load.db'),
+               SESSION_COOKIE_SECURE='0', RATE_LIMIT_ENABLED='0', RESPONSE_CACHE_ENABLED='0',
+               METRICS_DIR=os.path.join(tmp, 'metrics'))
+    with serve(env) as base:
+        sessions = []
+        for i in range(args.clients):
+            s = requests.Session()
+            s.post(base + '/api/register', json={'email': 'load%d@example.com' % i, 'password': 'loadtest',
+                                                 'name': 'Load %d' % i}, timeout=60).raise_for_status()
+            sessions.append(s)
+
+        latencies, errors = [], []
+        stop = time.monotonic() + args.seconds
+
+        def client(i, s):
+            n = 0
+            while time.monotonic() < stop:
+                n += 1
+                start = time.perf_counter()
+                try:
+                    if args.login_every and n % args.login_every == 0:
+                        r = s.post(base + '/api/login', json={'email': 'load%d@example.com' % i,
+                                                              'password': 'loadtest'}, timeout=30)
+                    else:
+                        r = s.get(base + READ_MIX[n % len(READ_MIX)], timeout=30)
+                    if r.status_code >= 400:
+                        errors.append(r.status_code)
+                except requests.RequestException as e:
+                    errors.append(type(e).__name__)
+                latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client, args=(i, s)) for i, s in enumerate(sessions)]
+        began = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - began
+        return {'mode': mode, 'requests': len(latencies), 'rps': len(latencies) / elapsed, 'errors': dict(Counter(errors)),
+                'p50_ms': percentile(latencies, 0.5) * 1000, 'p99_ms': percentile(latencies, 0.99) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default='sync,gthread,gevent')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--login-every', type=int, default=50, help='send a login every N requests per client (0 = never)')
+    args = parser.parse_args()
+
+    print('cpus=%d clients=%d seconds=%.0f' % (os.cpu_count(), args.clients, args.seconds))
+    for mode in args.modes.split(','):
+        r = run_mode(mode, args)
+        print('%-8s %7.1f req/s  p50=%7.1f ms  p99=%7.1f ms  requests=%d errors=%s' % (
+            r['mode'], r['rps'], r['p50_ms'], r['p99_ms'], r['requests'], r['errors'] or 0))
+
+
+if __name__ == '__main__':
+    main()
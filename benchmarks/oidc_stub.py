@@ -0,0 +1,123 @@
+"""Local stand-in OpenID Connect provider
+
+Serves discovery, JWKS, authorize, token and userinfo endpoints on
+127.0.0.1 with an optional artificial delay per request, signs ID tokens with
+a throwaway RSA key and counts requests per path. Used by bench_oidc.py and
+handy for exercising the Google login flow without network access:
+
+    provider = StubOIDCProvider(latency=0.05).start()
+    os.environ['GOOGLE_DISCOVERY_URL'] = provider.discovery_url
+"""
+import json
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from authlib.jose import JsonWebKey, jwt
+
+
+class StubOIDCProvider:
+    def __init__(self, latency=0.0, client_id='stub-client', id_token_has_email=True):
+        self.latency = latency
+        self.client_id = client_id
+        # False leaves email out of the ID token so clients must call /userinfo
+        self.id_token_has_email = id_token_has_email
+        self.rotate_key('stub-key')
+        self.requests = Counter()
+        self._codes = {}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.base_url = 'http://127.0.0.1:%d' % self._server.server_port
+        self.discovery_url = self.base_url + '/.well-known/openid-configuration'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        # Later connections are refused instead of waiting for a read timeout
+        self._server.server_close()
+
+    def rotate_key(self, kid):
+        """Sign ID tokens with a new key; the JWKS only serves the current one"""
+        self.key = JsonWebKey.generate_key('RSA', 2048, is_private=True, options={'kid': kid})
+
+    def metadata(self):
+        return {
+            'issuer': self.base_url,
+            'authorization_endpoint': self.base_url + '/authorize',
+            'token_endpoint': self.base_url + '/token',
+            'userinfo_endpoint': self.base_url + '/userinfo',
+            'jwks_uri': self.base_url + '/jwks',
+            'id_token_signing_alg_values_supported': ['RS256'],
+        }
+
+    def profile(self):
+        return {'sub': 'stub-user-1', 'email': 'stub.user@example.com', 'name': 'Stub User',
+                'picture': 'https://example.com/stub.png'}
+
+    def id_token_claims(self, nonce=None):
+        now = int(time.time())
+        claims = dict(self.profile(), iss=self.base_url, aud=self.client_id, iat=now, exp=now + 3600)
+        if not self.id_token_has_email:
+            del claims['email']
+        if nonce:
+            claims['nonce'] = nonce
+        return claims
+
+    def _handler(self):
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, body, status=200):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                provider.requests[url.path] += 1
+                time.sleep(provider.latency)
+                if url.path == '/.well-known/openid-configuration':
+                    return self._json(provider.metadata())
+                if url.path == '/jwks':
+                    return self._json({'keys': [provider.key.as_dict(is_private=False)]})
+                if url.path == '/userinfo':
+                    return self._json(provider.profile())
+                if url.path == '/authorize':
+                    params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                    code = secrets.token_urlsafe(16)
+                    provider._codes[code] = params.get('nonce')
+                    self.send_response(302)
+                    self.send_header('Location', params['redirect_uri'] + '?' + urlencode(
+                        {'code': code, 'state': params.get('state', '')}))
+                    self.end_headers()
+                    return
+                self._json({'error': 'not_found'}, 404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                provider.requests[url.path] += 1
+                time.sleep(provider.latency)
+                body = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+                if url.path != '/token':
+                    return self._json({'error': 'not_found'}, 404)
+                code = body.get('code', [''])[0]
+                if code not in provider._codes:
+                    return self._json({'error': 'invalid_grant'}, 400)
+                nonce = provider._codes.pop(code)
+                id_token = jwt.encode({'alg': 'RS256', 'kid': provider.key.kid}, provider.id_token_claims(nonce),
+                                      provider.key)
+                self._json({'access_token': secrets.token_urlsafe(16), 'token_type': 'Bearer',
+                            'expires_in': 3600, 'id_token': id_token.decode()})
+
+        return Handler
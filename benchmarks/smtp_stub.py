@@ -0,0 +1,108 @@
+"""Local stand-in SMTP server
+
+Speaks enough SMTP for smtplib (EHLO/HELO, NOOP, MAIL, RCPT, DATA, RSET,
+QUIT) on 127.0.0.1, keeps every accepted message and can reject the next
+messages with a temporary error. Used by tests/test_outbox.py and handy for
+watching the email outbox deliver without a real mail server:
+
+    server = StubSMTPServer().start()
+    os.environ.update(SMTP_HOST='127.0.0.1', SMTP_PORT=str(server.port), SMTP_USE_TLS='0')
+"""
+import socketserver
+import threading
+import time
+from collections import Counter
+from email import message_from_bytes
+
+
+class StubSMTPServer:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        # Accepted messages as email.message.Message, with envelope_from/envelope_to attributes
+        self.messages = []
+        self.connections = 0
+        self.commands = Counter()
+        # Called with the message before it is accepted, e.g. to change state mid-send
+        self.on_message = None
+        self._failures = []
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def fail_next(self, count=1, reply='451 4.3.0 Try again later'):
+        """Reject the next ``count`` messages at DATA with ``reply``"""
+        with self._lock:
+            self._failures.extend([reply] * count)
+
+    def _next_failure(self):
+        with self._lock:
+            return self._failures.pop(0) if self._failures else None
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def read_data(self):
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line in (b'.\r\n', b'.\n'):
+                        return b''.join(lines)
+                    lines.append(line[1:] if line.startswith(b'..') else line)
+
+            def handle(self):
+                with server._lock:
+                    server.connections += 1
+                self.reply('220 stub ESMTP')
+                sender, recipients = None, []
+                for raw in self.rfile:
+                    line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+                    verb = line.split(' ', 1)[0].upper()
+                    server.commands[verb] += 1
+                    if verb in ('EHLO', 'HELO'):
+                        self.reply('250 stub')
+                    elif verb == 'NOOP':
+                        self.reply('250 OK')
+                    elif verb == 'RSET':
+                        sender, recipients = None, []
+                        self.reply('250 OK')
+                    elif verb == 'MAIL':
+                        sender, recipients = line.split(':', 1)[1].strip().strip('<>'), []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        recipients.append(line.split(':', 1)[1].strip().strip('<>'))
+                        self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        message = message_from_bytes(self.read_data())
+                        message.envelope_from, message.envelope_to = sender, recipients
+                        time.sleep(server.latency)
+                        if server.on_message is not None:
+                            server.on_message(message)
+                        failure = server._next_failure()
+                        if failure:
+                            self.reply(failure)
+                        else:
+                            with server._lock:
+                                server.messages.append(message)
+                            self.reply('250 OK queued')
+                        sender, recipients = None, []
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('502 Command not implemented')
+
+        return Handler
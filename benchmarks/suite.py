@@ -0,0 +1,286 @@
+"""Per-route throughput and latency suite with baseline comparison
+
+Seeds a database with --users accounts (all with the password "benchpass")
+and --apps applications each, starts the app under gunicorn.conf.py, logs in
+--concurrency clients as different seeded users and drives every route in
+ROUTES for --seconds with those clients. Reports requests/s and p50/p95/p99
+per route and writes them as JSON.
+
+    # SQLite (seeded database kept at --db-path and reused by later runs)
+    python benchmarks/suite.py --users 100000 --db-path /tmp/mcb_100k.db --output baseline.json
+    # after a change: fail if any route is more than 15% slower or lower throughput
+    python benchmarks/suite.py --users 100000 --db-path /tmp/mcb_100k.db --output new.json \\
+        --compare baseline.json --threshold 15
+    # compare two stored result files without running anything
+    python benchmarks/suite.py --results new.json --compare baseline.json
+    # local PostgreSQL (must be empty, or seeded earlier with the same --users)
+    python benchmarks/suite.py --database-url postgresql://localhost/mcb_bench --users 1000000
+
+Auth rate limiting is disabled for the run. Routes that destroy the seeded
+state or need an outside service are not driven: DELETE /api/users/<id>,
+/logout, /reset-password (one-time tokens), /api/users/import and the Google
+OAuth routes.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import requests
+
+from loadtest import ROOT, percentile, serve
+
+PASSWORD = 'benchpass'
+STATUSES = ('Draft', 'In Progress', 'Submitted', 'Accepted', 'Rejected')
+
+# name, method, path, JSON body. Paths and bodies are formatted per request with
+# the client's user_id/email/app_id, a random other_id/cursor and a fresh `n`.
+# Read-only routes come first so the writes don't change what they measure.
+# What the mobile and desktop clients fetch on startup, as one POST /api/batch
+STARTUP_BATCH = [{'path': path} for path in ('/account', '/dashboard', '/api/applications', '/api/deadlines',
+                                             '/api/schools', '/api/mentor')]
+
+ROUTES = [
+    ('home', 'GET', '/', None),
+    ('account', 'GET', '/account', None),
+    ('dashboard', 'GET', '/dashboard', None),
+    ('applications', 'GET', '/api/applications', None),
+    ('application_detail', 'GET', '/api/applications/{app_id}', None),
+    ('applications_analytics', 'GET', '/api/applications/analytics', None),
+    ('schools', 'GET', '/api/schools', None),
+    ('deadlines', 'GET', '/api/deadlines', None),
+    ('mentor', 'GET', '/api/mentor', None),
+    ('users_page', 'GET', '/api/users?limit=100&cursor={cursor}', None),
+    ('user_detail', 'GET', '/api/users/{other_id}', None),
+    ('users_export', 'GET', '/api/users/export?format=ndjson', None),
+    ('hash_pool_stats', 'GET', '/api/hash-pool/stats', None),
+    ('rate_limit_stats', 'GET', '/api/rate-limit/stats', None),
+    ('metrics', 'GET', '/metrics', None),
+    ('login', 'POST', '/api/login', {'email': '{email}', 'password': PASSWORD}),
+    ('forgot_password', 'POST', '/forgot-password', {'email': '{email}'}),
+    ('user_update', 'PUT', '/api/users/{user_id}', {'name': 'Bench {n}'}),
+    ('user_create', 'POST', '/api/users', {'email': 'created-{run}-{n}@example.com', 'password': PASSWORD,
+                                           'name': 'Created {n}'}),
+    ('register', 'POST', '/api/register', {'email': 'registered-{run}-{n}@example.com', 'password': PASSWORD,
+                                           'name': 'Registered {n}'}),
+    ('startup_batch', 'POST', '/api/batch', {'requests': STARTUP_BATCH}),
+]
+
+
+def seed(mcb, users, apps, batch=5000):
+    """Insert users user1..userN@example.com with `apps` applications each"""
+    db = mcb.db
+    password_hash = mcb.hash_password(PASSWORD)
+    now = datetime.utcnow()
+    for first in range(1, users + 1, batch):
+        numbers = range(first, min(first + batch, users + 1))
+        ids = db.session.scalars(db.insert(mcb.User).returning(mcb.User.id, sort_by_parameter_order=True), [
+            {'email': 'user%d@example.com' % i, 'name': 'User %d' % i, 'password_hash': password_hash,
+             'created_at': now} for i in numbers]).all()
+        if apps:
+            db.session.execute(db.insert(mcb.Application), [
+                {'user_id': uid, 'name': 'School %d' % n, 'type': 'Regular Decision',
+                 'status': STATUSES[(i + n) % len(STATUSES)],
+                 'deadline': date(2025, 1, 1) + timedelta(days=(i * 7 + n) % 365),
+                 'progress': (i + n) % 101, 'docs_done': n % 6, 'docs_total': 5}
+                for i, uid in zip(numbers, ids) for n in range(apps)])
+        db.session.commit()
+
+
+def prepare_database(env, args):
+    """Create and seed the database unless it already holds this data set"""
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    import app as mcb
+
+    app = mcb.create_app()
+    with app.app_context():
+        mcb.db.create_all()
+        seeded = mcb.db.session.scalar(mcb.db.select(mcb.db.func.count(mcb.User.id)).where(
+            mcb.User.email.like('user%@example.com')))
+        if seeded == 0:
+            start = time.perf_counter()
+            seed(mcb, args.users, args.apps)
+            print('seeded %d users x %d applications in %.1fs' % (args.users, args.apps, time.perf_counter() - start))
+        elif seeded != args.users:
+            sys.exit('database already holds %d seeded users, not %d; use an empty database' % (seeded, args.users))
+        else:
+            print('reusing database with %d seeded users' % seeded)
+
+        step = max(args.users // args.concurrency, 1)
+        clients = []
+        for i in range(args.concurrency):
+            email = 'user%d@example.com' % (1 + (i * step) % args.users)
+            user_id = mcb.db.session.scalar(mcb.db.select(mcb.User.id).where(mcb.User.email == email))
+            app_id = mcb.db.session.scalar(mcb.db.select(mcb.db.func.min(mcb.Application.id))
+                                           .where(mcb.Application.user_id == user_id))
+            clients.append({'email': email, 'user_id': user_id, 'app_id': app_id})
+        max_id = mcb.db.session.scalar(mcb.db.select(mcb.db.func.max(mcb.User.id)))
+    return clients, max_id
+
+
+def drive(base, sessions, clients, route, seconds, max_id, run, counter):
+    """Send one route from every client for `seconds`; returns latencies (s) and error counts"""
+    name, method, path, body = route
+    latencies, errors = [], Counter()
+    stop = time.monotonic() + seconds
+
+    def client(s, ctx, rng):
+        while time.monotonic() < stop:
+            values = dict(ctx, other_id=rng.randint(1, max_id), cursor=rng.randint(0, max_id), n=next(counter), run=run)
+            url = base + path.format(**values)
+            payload = {k: v.format(**values) if isinstance(v, str) else v for k, v in body.items()} if body else None
+            start = time.perf_counter()
+            try:
+                r = s.request(method, url, json=payload, timeout=60)
+                if r.status_code >= 400:
+                    errors[r.status_code] += 1
+            except requests.RequestException as e:
+                errors[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(s, ctx, random.Random(i)))
+               for i, (s, ctx) in enumerate(zip(sessions, clients))]
+    began = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.monotonic() - began
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': dict(errors),
+        'error_rate': sum(errors.values()) / max(len(latencies), 1),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    tmp = tempfile.mkdtemp(prefix='mcb_suite_')
+    database_url = args.database_url or 'sqlite:///' + (args.db_path or os.path.join(tmp, 'suite.db'))
+    # Worker recycling would drop keep-alive connections mid-measurement
+    env = {'DATABASE_URL': database_url, 'SESSION_COOKIE_SECURE': '0', 'RATE_LIMIT_ENABLED': '0',
+           'SEED_DEMO_APPLICATIONS': '0', 'METRICS_DIR': os.path.join(tmp, 'metrics'),
+           'GUNICORN_MAX_REQUESTS': os.getenv('GUNICORN_MAX_REQUESTS', '0')}
+    if args.no_response_cache:
+        env['RESPONSE_CACHE_ENABLED'] = '0'
+    clients, max_id = prepare_database(env, args)
+
+    selected = set(args.routes.split(',')) if args.routes else None
+    routes = [r for r in ROUTES if selected is None or r[0] in selected]
+    if args.apps == 0:
+        routes = [r for r in routes if '{app_id}' not in r[2]]
+    run = '%x' % int(time.time())
+    counter = itertools.count()
+
+    results = {'meta': {
+        'revision': git_revision(), 'started_at': datetime.utcnow().isoformat() + 'Z',
+        'database': database_url.split(':', 1)[0], 'users': args.users, 'apps': args.apps,
+        'concurrency': args.concurrency, 'seconds': args.seconds,
+        'worker_class': os.getenv('GUNICORN_WORKER_CLASS', 'gthread'), 'cpus': os.cpu_count(),
+        'python': platform.python_version(), 'response_cache': not args.no_response_cache,
+    }, 'routes': {}}
+
+    with serve(dict(os.environ, **env)) as base:
+        sessions = []
+        for ctx in clients:
+            s = requests.Session()
+            s.post(base + '/api/login', json={'email': ctx['email'], 'password': PASSWORD},
+                   timeout=60).raise_for_status()
+            sessions.append(s)
+
+        print('%-24s %9s %9s %9s %9s %8s' % ('route', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+        for route in routes:
+            if args.warmup:
+                drive(base, sessions, clients, route, args.warmup, max_id, run, counter)
+            summary = summarize(*drive(base, sessions, clients, route, args.seconds, max_id, run, counter))
+            results['routes'][route[0]] = summary
+            print('%-24s %9.1f %9.1f %9.1f %9.1f %8d' % (route[0], summary['rps'], summary['p50_ms'],
+                                                         summary['p95_ms'], summary['p99_ms'],
+                                                         sum(summary['errors'].values())))
+    return results
+
+
+def compare(results, baseline, threshold, metric):
+    """Print per-route deltas against ``baseline``; returns the regressed route names"""
+    regressed = []
+    print('\n%-24s %12s %12s %9s %9s' % ('route', metric + ' base', metric + ' new', 'latency', 'req/s'))
+    for name, new in results['routes'].items():
+        old = baseline['routes'].get(name)
+        if old is None:
+            print('%-24s %12s %12.1f  (not in baseline)' % (name, '-', new[metric]))
+            continue
+        latency_delta = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0.0
+        rps_delta = (new['rps'] - old['rps']) / old['rps'] * 100 if old['rps'] else 0.0
+        failed = (latency_delta > threshold or rps_delta < -threshold
+                  or new['error_rate'] > old['error_rate'] + 0.01)
+        if failed:
+            regressed.append(name)
+        print('%-24s %12.1f %12.1f %+8.1f%% %+8.1f%%%s' % (name, old[metric], new[metric], latency_delta,
+                                                          rps_delta, '  REGRESSION' if failed else ''))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000, help='seeded accounts (1k to 1M)')
+    parser.add_argument('--apps', type=int, default=5, help='applications per seeded account')
+    parser.add_argument('--database-url', help='database to seed and use instead of a SQLite file')
+    parser.add_argument('--db-path', help='SQLite file to seed once and reuse (default: fresh temp file)')
+    parser.add_argument('--concurrency', type=int, default=16, help='authenticated clients sending at once')
+    parser.add_argument('--seconds', type=float, default=10, help='measured seconds per route')
+    parser.add_argument('--warmup', type=float, default=1, help='unmeasured seconds per route before measuring')
+    parser.add_argument('--routes', help='comma separated route names (default: all)')
+    parser.add_argument('--no-response-cache', action='store_true', help='run with RESPONSE_CACHE_ENABLED=0')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--results', help='compare this stored results file instead of running')
+    parser.add_argument('--compare', help='baseline results file; exit 1 if a route regressed')
+    parser.add_argument('--threshold', type=float, default=10, help='allowed regression in percent')
+    parser.add_argument('--metric', default='p95_ms', choices=('p50_ms', 'p95_ms', 'p99_ms'),
+                        help='latency percentile compared against the baseline')
+    args = parser.parse_args()
+
+    if args.results:
+        with open(args.results) as f:
+            results = json.load(f)
+    else:
+        results = run_suite(args)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print('results written to %s' % args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = compare(results, baseline, args.threshold, args.metric)
+        if regressed:
+            sys.exit('%d route(s) regressed by more than %g%%: %s' % (len(regressed), args.threshold,
+                                                                    ', '.join(regressed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Database engine tuning, lazy engine creation and read-replica routing
+
+LazySQLAlchemy creates each engine on first use rather than in init_app, so
+building the app does not import DB drivers or set up pools. engine_options() turns DB_* environment variables into SQLAlchemy engine
+options. Every engine uses TimedQueuePool, which records how long each
+connection checkout waited in the mcb_db_pool_checkout_seconds histogram.
+
+When DATABASE_REPLICA_URL is set it is registered as the "replica" bind and
+RoutingSession sends the reads of GET/HEAD requests there. Everything else
+goes to the primary: writes, reads in a request that already wrote, reads in
+views marked with @use_primary, and every read for DB_REPLICA_STICKY_SECONDS
+after the same client performed a write (read-your-writes while the replica
+catches up). That deadline travels in its own short-lived cookie rather than
+in the server-side session, so anonymous writes don't create session records.
+
+Configuration (environment):
+  DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE (seconds),
+  DB_POOL_PRE_PING ("1"), DB_STATEMENT_TIMEOUT_MS (PostgreSQL only),
+  DATABASE_REPLICA_URL, DB_REPLICA_STICKY_SECONDS (default 5)
+"""
+import functools
+import os
+import threading
+import time
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.pool import QueuePool
+
+import metrics
+
+REPLICA_BIND = 'replica'
+STICKY_SECONDS = float(os.getenv('DB_REPLICA_STICKY_SECONDS', 5))
+# Holds the time until which the client's reads go to the primary
+STICKY_COOKIE = 'mcb_db_primary'
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports how long callers waited for a connection"""
+
+    bind_name = 'primary'
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe('mcb_db_pool_checkout_seconds', time.perf_counter() - start,
+                            (('bind', self.bind_name),))
+
+
+class LazyEngines(dict):
+    """Bind key -> engine mapping whose engines are created on first access"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, functools.partial):
+            with self._lock:
+                value = super().__getitem__(key)
+                if isinstance(value, functools.partial):
+                    value = value()
+                    super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def created(self):
+        """The engines that exist already, by bind key, without creating the others"""
+        return {key: value for key, value in super().items() if not isinstance(value, functools.partial)}
+
+
+class LazySQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy extension that defers creating engines until they are used"""
+
+    def init_app(self, app):
+        self._app_engines[app] = LazyEngines()
+        super().init_app(app)
+
+    def _make_engine(self, bind_key, options, app):
+        return functools.partial(super()._make_engine, bind_key, options, app)
+
+    def created_engines(self):
+        """Engines created so far by any app (e.g. to dispose them after a fork)"""
+        return [engine for engines in list(self._app_engines.values()) for engine in engines.created().values()]
+
+
+def engine_options(url, bind_name='primary'):
+    """Engine options for ``url`` from the DB_* environment variables"""
+    url = sa.engine.make_url(url)
+    if url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:'):
+        # In-memory SQLite needs Flask-SQLAlchemy's StaticPool
+        return {}
+
+    options = {'poolclass': type('TimedQueuePool_%s' % bind_name, (TimedQueuePool,), {'bind_name': bind_name})}
+    for env, option, cast in (('DB_POOL_SIZE', 'pool_size', int),
+                              ('DB_MAX_OVERFLOW', 'max_overflow', int),
+                              ('DB_POOL_TIMEOUT', 'pool_timeout', float),
+                              ('DB_POOL_RECYCLE', 'pool_recycle', int)):
+        if os.getenv(env):
+            options[option] = cast(os.getenv(env))
+    options['pool_pre_ping'] = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+
+    statement_timeout = os.getenv('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout and url.drivername.startswith('postgresql'):
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % int(statement_timeout)}
+    return options
+
+
+def use_primary(view):
+    """Send every query of a GET view to the primary (for GET routes that write)"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        g._db_use_primary = True
+        return view(*args, **kwargs)
+
+    return wrapped
+
+
+def _reads_from_replica():
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    if g.get('_db_use_primary') or g.get('_db_wrote'):
+        return False
+    try:
+        primary_until = float(request.cookies.get(STICKY_COOKIE, 0))
+    except ValueError:
+        primary_until = 0
+    return primary_until < time.time()
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and REPLICA_BIND in self._db.engines
+                and not getattr(clause, 'is_dml', False) and not self._flushing
+                and _reads_from_replica()):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _mark_write(*args):
+    if has_request_context():
+        g._db_wrote = True
+
+
+def _mark_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_write()
+
+
+def init_app(app, db):
+    for identifier, fn in (('after_flush', _mark_write), ('do_orm_execute', _mark_dml)):
+        if not sa.event.contains(RoutingSession, identifier, fn):
+            sa.event.listen(RoutingSession, identifier, fn)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('_db_wrote') and REPLICA_BIND in app.config.get('SQLALCHEMY_BINDS', {}):
+            cookies = app.session_interface
+            response.set_cookie(
+                STICKY_COOKIE, '%.3f' % (time.time() + STICKY_SECONDS),
+                max_age=max(int(STICKY_SECONDS), 1),
+                httponly=True,
+                domain=cookies.get_cookie_domain(app),
+                path=cookies.get_cookie_path(app),
+                secure=cookies.get_cookie_secure(app),
+                samesite=cookies.get_cookie_samesite(app),
+            )
+        return response
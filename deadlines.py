@@ -0,0 +1,203 @@
+"""In-memory deadline index and the reminders pushed by /api/deadlines/stream
+
+DeadlineIndex keeps every application whose deadline falls within
+DEADLINE_HORIZON_DAYS of today in one sorted list per user, ordered by
+(deadline, id). "Due in the next N days" for a user is two bisects and a
+slice, with no database query and no scan.
+
+The index is loaded from the database on first use and rebuilt when the date
+changes, so the horizon moves along. In between, refresh() applies changes
+since its last pass:
+  - rows whose updated_at moved: a range scan on (updated_at, id)
+  - deleted applications: the tombstones from deltasync
+It refreshes at most every DEADLINE_REFRESH_SECONDS, or on the next query
+after mark_stale(), which this process calls after it writes applications.
+Each worker keeps its own index, so a write made by another worker shows up
+within DEADLINE_REFRESH_SECONDS.
+
+ReminderTracker follows one client's deadlines as they cross the reminder
+windows (DEADLINE_REMINDER_DAYS, e.g. 7, 1 and 0 days before).
+
+Configuration (environment):
+  DEADLINE_HORIZON_DAYS     days ahead kept in memory (default 366)
+  DEADLINE_REFRESH_SECONDS  longest time between refreshes (default 5)
+  DEADLINE_REMINDER_DAYS    reminder windows in days (default "7,1,0")
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+
+import deltasync
+
+log = logging.getLogger('mcb.deadlines')
+
+HORIZON_DAYS = int(os.getenv('DEADLINE_HORIZON_DAYS', 366))
+REFRESH_SECONDS = float(os.getenv('DEADLINE_REFRESH_SECONDS', 5))
+REMINDER_DAYS = tuple(sorted({int(d) for d in os.getenv('DEADLINE_REMINDER_DAYS', '7,1,0').split(',') if d.strip()},
+                             reverse=True))
+# Applications in these statuses get no reminders
+DONE_STATUSES = ('Submitted', 'Accepted', 'Rejected')
+
+
+class DeadlineIndex:
+    def __init__(self, table, today=date.today):
+        self.table = table
+        self._today = today
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # user id -> sorted [(deadline, application id)]
+        self._by_user = {}
+        # application id -> (user id, deadline, name, type, status)
+        self._apps = {}
+        self._day = None
+        self._positions = None
+        self._refreshed_at = 0.0
+        self._stale = True
+
+    def mark_stale(self):
+        """Apply database changes before the next query (call after writing applications)"""
+        self._stale = True
+
+    def __len__(self):
+        return len(self._apps)
+
+    # ----- maintenance -----
+
+    def _columns(self):
+        t = self.table
+        return sa.select(t.c.id, t.c.user_id, t.c.deadline, t.c.name, t.c.type, t.c.status, t.c.updated_at)
+
+    def _in_horizon(self, deadline):
+        return deadline is not None and self._day <= deadline <= self._day + timedelta(days=HORIZON_DAYS)
+
+    def _remove(self, app_id):
+        old = self._apps.pop(app_id, None)
+        if old is None:
+            return
+        entries = self._by_user[old[0]]
+        i = bisect.bisect_left(entries, (old[1], app_id))
+        if i < len(entries) and entries[i] == (old[1], app_id):
+            del entries[i]
+        if not entries:
+            del self._by_user[old[0]]
+
+    def _upsert(self, row):
+        self._remove(row.id)
+        if self._in_horizon(row.deadline):
+            self._apps[row.id] = (row.user_id, row.deadline, row.name, row.type, row.status)
+            bisect.insort(self._by_user.setdefault(row.user_id, []), (row.deadline, row.id))
+
+    def _rebuild(self, conn, today):
+        # Positions taken before loading, so changes made during the load are applied again afterwards
+        settled = deltasync.settled_position(conn)
+        positions = {'applications': settled, 'deleted': settled}
+        t = self.table
+        rows = conn.execute(self._columns().where(
+            t.c.deadline.between(today, today + timedelta(days=HORIZON_DAYS)))).all()
+        by_user = {}
+        apps = {}
+        for row in rows:
+            apps[row.id] = (row.user_id, row.deadline, row.name, row.type, row.status)
+            by_user.setdefault(row.user_id, []).append((row.deadline, row.id))
+        for entries in by_user.values():
+            entries.sort()
+        with self._lock:
+            self._by_user, self._apps, self._day, self._positions = by_user, apps, today, positions
+        log.info('Deadline index rebuilt for %s: %d applications', today, len(apps))
+
+    def _apply_changes(self, conn):
+        t = self.table
+        tombstones = deltasync.tombstone_table
+        deleted_query = sa.select(tombstones.c.id, tombstones.c.object_id, tombstones.c.deleted_at).where(
+            tombstones.c.kind == 'application')
+        positions = dict(self._positions)
+        while True:
+            rows, positions['applications'], apps_more = deltasync.changed_since(
+                conn, self._columns(), t.c.updated_at, t.c.id, positions['applications'], 1000)
+            deleted, positions['deleted'], deleted_more = deltasync.changed_since(
+                conn, deleted_query, tombstones.c.deleted_at, tombstones.c.id, positions['deleted'], 1000)
+            with self._lock:
+                for row in rows:
+                    self._upsert(row)
+                for row in deleted:
+                    self._remove(row.object_id)
+            if not (apps_more or deleted_more):
+                break
+        self._positions = positions
+
+    def refresh(self, engine, force=False):
+        """Bring the index up to date if it is stale, older than REFRESH_SECONDS or from another day"""
+        today = self._today()
+        if not force and today == self._day and not self._stale \
+                and time.monotonic() - self._refreshed_at < REFRESH_SECONDS:
+            return
+        # One refresh at a time; other callers answer from the current state unless there is none
+        if not self._refresh_lock.acquire(blocking=self._day is None or today != self._day):
+            return
+        try:
+            self._stale = False
+            with engine.connect() as conn:
+                if today != self._day:
+                    self._rebuild(conn, today)
+                self._apply_changes(conn)
+            self._refreshed_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    # ----- queries -----
+
+    def due(self, user_id, days, start=None):
+        """The user's applications due from ``start`` (default today) through ``days`` later, by deadline
+
+        Returns dicts with the application fields and days_left.
+        """
+        start = start or self._today()
+        end = start + timedelta(days=days)
+        with self._lock:
+            entries = self._by_user.get(user_id, ())
+            lo = bisect.bisect_left(entries, (start,))
+            hi = bisect.bisect_right(entries, (end, float('inf')))
+            found = [(app_id, self._apps[app_id]) for _, app_id in entries[lo:hi]]
+        return [{'application_id': app_id, 'name': name, 'type': app_type, 'status': status,
+                 'deadline': deadline, 'days_left': (deadline - start).days}
+                for app_id, (_, deadline, name, app_type, status) in found]
+
+
+class ReminderTracker:
+    """The reminder window each of one user's applications was last reported in"""
+
+    def __init__(self, index, user_id, windows=REMINDER_DAYS):
+        self.index = index
+        self.user_id = user_id
+        self.windows = windows
+        self._reported = {}
+
+    def _window(self, days_left):
+        inside = [w for w in self.windows if days_left <= w]
+        return inside[-1] if inside else None
+
+    def snapshot(self):
+        """Everything currently inside the widest window; later reminders are relative to it"""
+        items = [item for item in self.index.due(self.user_id, self.windows[0])
+                 if item['status'] not in DONE_STATUSES]
+        self._reported = {item['application_id']: self._window(item['days_left']) for item in items}
+        return items
+
+    def reminders(self):
+        """Applications that entered a narrower window (or appeared) since the last call"""
+        items = [item for item in self.index.due(self.user_id, self.windows[0])
+                 if item['status'] not in DONE_STATUSES]
+        reported = {}
+        new = []
+        for item in items:
+            window = self._window(item['days_left'])
+            reported[item['application_id']] = window
+            if self._reported.get(item['application_id'], float('inf')) > window:
+                new.append(dict(item, window=window))
+        self._reported = reported
+        return new
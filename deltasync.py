@@ -0,0 +1,175 @@
+"""Change tracking for delta sync: updated_at watermarks and delete tombstones
+
+Synced tables carry an ``updated_at`` column set on insert and on every update,
+indexed together with the id. Its value is utcnow(), the database server's
+clock, as are tombstone times and settled positions, so app hosts whose
+clocks disagree can't stamp a row behind a watermark already handed out. Rows are deleted through
+delete_where(), which writes one row per deleted object to the ``tombstone``
+table in the same transaction.
+
+A client's watermark holds a (time, id) position per kind of change. Each
+page is a keyset range scan over the (updated_at, id) index after that
+position. A client that is up to date gets empty range scans. When a kind
+runs out of rows, its position is moved back to SYNC_SETTLE_SECONDS ago.
+Rows written by transactions that committed after a later timestamp was
+already visible are then sent again on the next sync. Clients apply rows by
+id, so a repeated row is harmless.
+
+Tombstones older than SYNC_TOMBSTONE_DAYS are removed by prune() (`flask
+prune-tombstones`). A watermark older than that is rejected because deletes
+may have been lost, and the client starts over without one.
+
+Configuration (environment):
+  SYNC_SETTLE_SECONDS    seconds of changes sent again at the end of a sync (default 2)
+  SYNC_TOMBSTONE_DAYS    days tombstones are kept (default 30)
+"""
+import base64
+import binascii
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateIndex
+
+SETTLE_SECONDS = float(os.getenv('SYNC_SETTLE_SECONDS', 2))
+TOMBSTONE_DAYS = float(os.getenv('SYNC_TOMBSTONE_DAYS', 30))
+
+class utcnow(sa.sql.expression.FunctionElement):
+    """The database server's current time in UTC, as a naive DATETIME"""
+    type = sa.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    # Time of the statement rather than of the transaction start (now()), closer to the commit
+    return "(statement_timestamp() AT TIME ZONE 'UTC')"
+
+
+@compiles(utcnow, 'sqlite')
+def _utcnow_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP has whole seconds; this is the microsecond text SQLAlchemy stores DateTime as
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+metadata = sa.MetaData()
+tombstone_table = sa.Table(
+    'tombstone', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('kind', sa.String(20), nullable=False),
+    sa.Column('object_id', sa.Integer, nullable=False),
+    # User whose data the object was (None for objects every user can see)
+    sa.Column('owner_id', sa.Integer, nullable=True),
+    sa.Column('deleted_at', sa.DateTime, nullable=False),
+    sa.Index('ix_tombstone_deleted', 'deleted_at', 'id'),
+)
+
+
+def install(engine, *tables):
+    """Create the tombstone table and add ``updated_at`` and its indexes to ``tables`` where missing
+
+    Rows that predate the column get their created_at as updated_at.
+    """
+    metadata.create_all(engine, checkfirst=True)
+    with engine.begin() as conn:
+        for table in tables:
+            column = table.c.updated_at
+            if column.name not in {c['name'] for c in sa.inspect(conn).get_columns(table.name)}:
+                conn.exec_driver_sql('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    engine.dialect.identifier_preparer.format_table(table),
+                    column.name, column.type.compile(engine.dialect)))
+                conn.execute(table.update().values({column: sa.func.coalesce(table.c.created_at, utcnow())}))
+            for index in table.indexes:
+                if any(c is column for c in index.columns):
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def delete_where(session, table, kind, where, owner_column=None):
+    """Delete the rows of ``table`` matching ``where`` and log a ``kind`` tombstone for each
+
+    The DELETE returns the ids it removed and the tombstones are inserted from
+    them, in the session's transaction; nothing is inserted when no row
+    matched. Returns the number of deleted rows.
+    """
+    owner = owner_column if owner_column is not None else sa.null()
+    deleted = session.execute(sa.delete(table).where(where).returning(table.c.id, owner)).all()
+    if deleted:
+        session.execute(tombstone_table.insert().values(deleted_at=utcnow()), [
+            {'kind': kind, 'object_id': object_id, 'owner_id': owner_id}
+            for object_id, owner_id in deleted])
+    return len(deleted)
+
+
+def settled_position(session):
+    """Position of a kind with no unsent changes: SETTLE_SECONDS ago by the database clock"""
+    return (session.execute(sa.select(utcnow())).scalar() - timedelta(seconds=SETTLE_SECONDS), 0)
+
+
+def changed_since(session, query, time_column, id_column, position, limit, scalars=False):
+    """One page of ``query`` rows changed after ``position``: (rows, next position, has_more)
+
+    ``position`` is a (time, id) pair or None for every row. ``scalars``
+    returns the first column of each row (ORM objects).
+    """
+    if position is not None:
+        query = query.where(sa.tuple_(time_column, id_column) > sa.tuple_(*position))
+    query = query.order_by(time_column, id_column).limit(limit + 1)
+    rows = (session.scalars(query) if scalars else session.execute(query)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        position = (getattr(rows[-1], time_column.key), getattr(rows[-1], id_column.key))
+    if not has_more:
+        settled = settled_position(session)
+        position = min(position, settled) if position is not None else settled
+    return rows, position, has_more
+
+
+def tombstones_since(session, position, limit, owner_id):
+    """One page of tombstones after ``position`` visible to ``owner_id``; see changed_since()"""
+    t = tombstone_table
+    query = sa.select(t.c.id, t.c.kind, t.c.object_id, t.c.deleted_at).where(
+        sa.or_(t.c.owner_id.is_(None), t.c.owner_id == owner_id))
+    return changed_since(session, query, t.c.deleted_at, t.c.id, position, limit)
+
+
+def expired(position):
+    """Whether tombstones after ``position`` may already have been pruned"""
+    return position[0] < datetime.utcnow() - timedelta(days=TOMBSTONE_DAYS)
+
+
+def prune(engine):
+    """Delete tombstones older than TOMBSTONE_DAYS; returns how many"""
+    cutoff = datetime.utcnow() - timedelta(days=TOMBSTONE_DAYS)
+    with engine.begin() as conn:
+        return conn.execute(sa.delete(tombstone_table).where(tombstone_table.c.deleted_at < cutoff)).rowcount
+
+
+def encode_watermark(positions):
+    """Opaque watermark string for a {kind: (time, id)} mapping"""
+    raw = {kind: [ts.isoformat(), object_id] for kind, (ts, object_id) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(raw, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_watermark(token):
+    """The {kind: (time, id)} mapping of a watermark; raises ValueError if it is malformed
+
+    Times with a UTC offset are converted to the naive UTC the columns hold.
+    """
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return {kind: (_naive_utc(datetime.fromisoformat(ts)), int(object_id))
+                for kind, (ts, object_id) in raw.items()}
+    except (ValueError, TypeError, AttributeError, binascii.Error):
+        raise ValueError('Invalid watermark')
+
+
+def _naive_utc(ts):
+    return ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo is not None else ts
@@ -0,0 +1,96 @@
+"""Gunicorn production profile
+
+    gunicorn wsgi:app -c gunicorn.conf.py
+
+GUNICORN_WORKER_CLASS selects the mode:
+  gthread (default)  CPU-count workers x GUNICORN_THREADS threads. A slow
+                     outbound call (Google OAuth, SMTP) only blocks one thread.
+  gevent             CPU-count workers with GUNICORN_WORKER_CONNECTIONS
+                     greenlets each (gevent is in requirements.txt).
+  sync               2 x CPU + 1 single-threaded workers (previous behaviour).
+
+The app is imported once in the master (preload_app) and shared copy-on-write
+with the workers; anything that must not cross a fork (DB connections, the
+hash pool, metric files) is reset in post_fork or created lazily per process.
+Each worker starts its email dispatcher in post_worker_init, so emails queued
+before a restart, or waiting to be retried, go out without a new enqueue, and
+its analytics rollup refresh thread, so requests never refresh rollups.
+Workers are recycled after max_requests (with jitter so they don't restart
+together); child_exit folds each exited worker's metrics into one file.
+
+WEB_CONCURRENCY overrides the worker count. With GUNICORN_INIT_DB=1 (the
+default) the master creates missing tables before starting workers; with
+GUNICORN_WARMUP=1 every worker runs app.warm_up() before taking requests.
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # Patch before the app (and its sockets, locks, requests sessions) is imported by preload_app
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+cpus = multiprocessing.cpu_count()
+
+bind = '0.0.0.0:%s' % os.getenv('PORT', '8000')
+if worker_class == 'sync':
+    workers = int(os.getenv('WEB_CONCURRENCY', cpus * 2 + 1))
+else:
+    workers = int(os.getenv('WEB_CONCURRENCY', cpus))
+threads = int(os.getenv('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', max(max_requests // 10, 1)))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# All workers write their metrics here; /metrics sums the files
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'mcb-metrics-%s' % os.getpid()))
+
+
+def on_starting(server):
+    import metrics
+    metrics.clear()
+
+
+def when_ready(server):
+    if os.getenv('GUNICORN_INIT_DB', '1') == '1':
+        from app import init_db
+        with server.app.wsgi().app_context():
+            init_db()
+
+
+def post_fork(server, worker):
+    # Connections opened in the master (preload, init_db) must not be shared between workers
+    mcb = sys.modules.get('app')
+    if mcb is not None:
+        for engine in mcb.db.created_engines():
+            engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    from app import start_analytics_refresher, start_email_dispatcher
+    with worker.wsgi.app_context():
+        start_email_dispatcher()
+        start_analytics_refresher()
+    if os.getenv('GUNICORN_WARMUP', '0') == '1':
+        from app import warm_up
+        with worker.wsgi.app_context():
+            warm_up()
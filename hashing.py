@@ -0,0 +1,195 @@
+"""Password hashing service
+
+Password hashes are CPU bound. Instead of running them inline in the request
+worker they are sent to a small, bounded process pool so a burst of logins can
+only ever occupy HASH_POOL_WORKERS cores, and requests beyond HASH_POOL_MAX_PENDING
+are rejected straight away instead of queueing behind each other.
+
+Configuration (environment):
+  PASSWORD_HASH_METHOD   werkzeug method string, e.g. "scrypt" or "pbkdf2:sha256:600000"
+  HASH_POOL_WORKERS      number of hashing processes (0 runs hashes inline)
+  HASH_POOL_MAX_PENDING  hashes allowed in flight or queued before rejecting
+  HASH_POOL_TIMEOUT      seconds to wait for a hash result
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+POOL_WORKERS = int(os.getenv('HASH_POOL_WORKERS', max((os.cpu_count() or 2) // 2, 1)))
+# Inline mode (0 workers) still caps hashes in flight, at the allowance of a one-process pool
+MAX_PENDING = int(os.getenv('HASH_POOL_MAX_PENDING', max(POOL_WORKERS, 1) * 8))
+TIMEOUT = float(os.getenv('HASH_POOL_TIMEOUT', 10))
+
+
+class HashPoolBusy(Exception):
+    """Raised when too many hashes are already queued, or a hash took longer than HASH_POOL_TIMEOUT"""
+
+
+_lock = threading.Lock()
+# Signalled whenever admitted hashes finish, for hash_passwords() waiting on free slots
+_slots = threading.Condition(_lock)
+_executor = None
+_executor_pid = None
+_pending = 0
+_rejected = 0
+_latencies = deque(maxlen=1024)
+_method_prefix = None
+
+
+def _get_executor():
+    # Gunicorn forks workers after import; each worker needs its own pool
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _admit(n, wait=0):
+    """Reserve ``n`` of the MAX_PENDING slots, waiting up to ``wait`` seconds for them; HashPoolBusy if they
+    don't free up"""
+    global _pending, _rejected
+    deadline = time.monotonic() + wait
+    with _slots:
+        while _pending + n > MAX_PENDING:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _rejected += 1
+                raise HashPoolBusy()
+            _slots.wait(remaining)
+        _pending += n
+
+
+def _release(n=1):
+    global _pending
+    with _slots:
+        _pending -= n
+        _slots.notify_all()
+
+
+def _submit(fn, *args):
+    """Run ``fn`` in the pool on an admitted slot, released when it finishes rather than when a caller
+    stops waiting: a hash that timed out still occupies a process"""
+    try:
+        future = _get_executor().submit(fn, *args)
+    except BaseException:
+        _release()
+        raise
+    future.add_done_callback(lambda _: _release())
+    return future
+
+
+def _results(futures):
+    """Results of ``futures``, HashPoolBusy if one takes longer than HASH_POOL_TIMEOUT
+
+    On a timeout the futures still queued are cancelled, which releases their
+    slots; a hash already running keeps its slot until its process is free.
+    """
+    global _rejected
+    deadline = time.monotonic() + TIMEOUT
+    try:
+        return [f.result(timeout=max(deadline - time.monotonic(), 0)) for f in futures]
+    except FutureTimeout:
+        for f in futures:
+            f.cancel()
+        with _lock:
+            _rejected += 1
+        raise HashPoolBusy()
+
+
+def _run(fn, *args):
+    _admit(1)
+    start = time.perf_counter()
+    if POOL_WORKERS <= 0:
+        try:
+            result = fn(*args)
+        finally:
+            _release()
+    else:
+        result = _results([_submit(fn, *args)])[0]
+    with _lock:
+        _latencies.append(time.perf_counter() - start)
+    return result
+
+
+def _current_prefix():
+    """Method prefix ("scrypt:32768:8:1") that a fresh hash would carry"""
+    global _method_prefix
+    if _method_prefix is None:
+        _method_prefix = generate_password_hash('', method=HASH_METHOD).split('$', 1)[0]
+    return _method_prefix
+
+
+def hash_password(password):
+    """Hash a password with the configured method"""
+    return _run(generate_password_hash, password, HASH_METHOD)
+
+
+def hash_passwords(passwords):
+    """Hash a batch of passwords in parallel across the pool (used by bulk import)
+
+    The batch goes through the same admission as single hashes, a quarter of
+    HASH_POOL_MAX_PENDING at a time, waiting up to HASH_POOL_TIMEOUT for each
+    slice; logins keep the rest of the queue and see the import in queue_depth().
+    """
+    if not passwords:
+        return []
+    start = time.perf_counter()
+    step = max(MAX_PENDING // 4, 1)
+    hashes = []
+    for i in range(0, len(passwords), step):
+        batch = passwords[i:i + step]
+        _admit(len(batch), wait=TIMEOUT)
+        if POOL_WORKERS <= 0:
+            try:
+                hashes.extend(generate_password_hash(p, HASH_METHOD) for p in batch)
+            finally:
+                _release(len(batch))
+        else:
+            hashes.extend(_results([_submit(generate_password_hash, p, HASH_METHOD) for p in batch]))
+    elapsed = (time.perf_counter() - start) / len(passwords)
+    with _lock:
+        _latencies.append(elapsed)
+    return hashes
+
+
+def verify_password(password_hash, password):
+    """Check a password; returns (matches, needs_rehash)"""
+    ok = _run(check_password_hash, password_hash, password)
+    needs_rehash = ok and password_hash.split('$', 1)[0] != _current_prefix()
+    return ok, needs_rehash
+
+
+def queue_depth():
+    """Hashes currently running or waiting in this worker"""
+    return _pending
+
+
+def stats():
+    """Latency and queue depth of the hashing service"""
+    with _lock:
+        samples = sorted(_latencies)
+        pending = _pending
+        rejected = _rejected
+
+    def pct(p):
+        if not samples:
+            return 0.0
+        return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+    return {
+        'method': HASH_METHOD,
+        'workers': POOL_WORKERS,
+        'max_pending': MAX_PENDING,
+        'queue_depth': pending,
+        'rejected': rejected,
+        'samples': len(samples),
+        'latency_p50_ms': round(pct(0.50) * 1000, 2),
+        'latency_p99_ms': round(pct(0.99) * 1000, 2),
+    }
@@ -0,0 +1,174 @@
+"""Response compression negotiated from Accept-Encoding (br, zstd, gzip)
+
+The encoding is the client's highest-quality choice among COMPRESS_ALGORITHMS,
+with ties going to the first one listed. Responses are left alone when any of
+these hold:
+  - the mimetype isn't compressible
+  - the body is smaller than COMPRESS_MIN_SIZE, where compressing costs CPU
+    and saves less than a packet
+  - the response is streamed, or already has a Content-Encoding
+  - the status is not 2xx
+Views can set their own levels with @compressor.levels(br=..., gzip=...);
+level 0 turns an algorithm off for that view.
+
+Compressed bodies are kept in a bounded LRU keyed by a hash of the
+uncompressed body, the algorithm and the level. Identical responses (the same
+user page for many clients, unchanged data on every poll) are compressed once
+per worker and then only hashed.
+
+zstd needs the optional `zstandard` package and brotli the `Brotli` package;
+missing ones are not offered.
+
+Configuration (environment):
+  COMPRESS_ALGORITHMS     preference order (default "br,zstd,gzip")
+  COMPRESS_MIN_SIZE       smallest body in bytes worth compressing (default 1024)
+  COMPRESS_BR_LEVEL, COMPRESS_ZSTD_LEVEL, COMPRESS_GZIP_LEVEL   defaults 4, 3, 6
+  COMPRESS_CACHE_BYTES    compressed bytes kept per worker (default 16 MiB, 0 disables)
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = ('text/html', 'text/css', 'text/xml', 'text/plain', 'text/csv', 'application/json',
+                          'application/javascript', 'application/x-ndjson')
+
+
+def _compress_br(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _compress_zstd(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _compress_gzip(data, level):
+    # mtime=0 so identical bodies compress to identical bytes
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+COMPRESSORS = {
+    'br': _compress_br if brotli is not None else None,
+    'zstd': _compress_zstd if zstandard is not None else None,
+    'gzip': _compress_gzip,
+}
+
+
+class CompressedBodyCache:
+    """Thread-safe LRU of compressed bodies bounded by their total size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._data[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'bytes': self._size, 'hits': self.hits, 'misses': self.misses}
+
+
+class ResponseCompressor:
+    def __init__(self, algorithms=('br', 'zstd', 'gzip'), min_size=1024, levels=None, cache_bytes=16 * 1024 * 1024,
+                 mimetypes=COMPRESSIBLE_MIMETYPES):
+        unknown = [a for a in algorithms if a not in COMPRESSORS]
+        if unknown:
+            raise ValueError('Unknown compression algorithms: %s' % ', '.join(unknown))
+        self.algorithms = [a for a in algorithms if COMPRESSORS[a] is not None]
+        self.min_size = min_size
+        self.default_levels = dict({'br': 4, 'zstd': 3, 'gzip': 6}, **(levels or {}))
+        self.mimetypes = frozenset(mimetypes)
+        self.cache = CompressedBodyCache(cache_bytes) if cache_bytes > 0 else None
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def levels(self, **levels):
+        """Per-view levels, e.g. @compressor.levels(br=6, gzip=9); 0 disables an algorithm"""
+        def decorator(view):
+            view.compress_levels = levels
+            return view
+
+        return decorator
+
+    def _levels(self):
+        view = current_app.view_functions.get(request.endpoint)
+        overrides = getattr(view, 'compress_levels', None)
+        return dict(self.default_levels, **overrides) if overrides else self.default_levels
+
+    def compress(self, data, algorithm, level):
+        """``data`` compressed with ``algorithm``, from the cache when the same body was compressed before"""
+        if self.cache is None:
+            return COMPRESSORS[algorithm](data, level)
+        key = (hashlib.blake2b(data, digest_size=16).digest(), algorithm, level)
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = COMPRESSORS[algorithm](data, level)
+            self.cache.set(key, compressed)
+        return compressed
+
+    def after_request(self, response):
+        if response.mimetype not in self.mimetypes:
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers
+                or not 200 <= response.status_code < 300 or 'Accept-Encoding' not in request.headers):
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        levels = self._levels()
+        algorithm = request.accept_encodings.best_match([a for a in self.algorithms if levels.get(a)])
+        if algorithm is None:
+            return response
+
+        compressed = self.compress(data, algorithm, levels[algorithm])
+        metrics.inc('mcb_compression_bytes_total', (('algorithm', algorithm), ('stage', 'in')), len(data))
+        metrics.inc('mcb_compression_bytes_total', (('algorithm', algorithm), ('stage', 'out')), len(compressed))
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = algorithm
+        # Same strong-ETag suffix as Flask-Compress: "abc" -> "abc:br" (respcache strips it)
+        etag = response.headers.get('ETag')
+        if etag:
+            response.headers['ETag'] = '%s:%s"' % (etag[:-1], algorithm)
+        return response
@@ -0,0 +1,102 @@
+"""Fast JSON provider for jsonify() and request.get_json()
+
+FastJSONProvider encodes with orjson when it is installed and with the
+stdlib json module otherwise (or with JSON_BACKEND=stdlib). Both backends
+produce the same documents:
+  - datetime, date and time values become ISO 8601 strings. Flask's default
+    provider sends HTTP dates instead.
+  - SQLAlchemy result rows become objects keyed by column name.
+  - Instances of classes passed to register() go through the registered
+    function, e.g. register(User, User.to_dict), so views can jsonify models.
+Everything else falls back to Flask's rules (Decimal, UUID, dataclasses,
+__html__).
+
+With orjson, datetimes are encoded natively and the response body is built
+from bytes (benchmarks/bench_json.py). Rows and registered types still go
+through default(): orjson can't encode a Row or a model itself, so each
+becomes a dict there (dict(zip()) for a row, with the column names looked up
+once per result).
+
+Configuration (environment):
+  JSON_BACKEND   "orjson" (default when installed) or "stdlib"
+"""
+import json
+import os
+from datetime import date, datetime, time
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy.engine import Row
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = os.getenv('JSON_BACKEND', 'orjson' if orjson is not None else 'stdlib')
+if BACKEND == 'orjson' and orjson is None:
+    raise RuntimeError('JSON_BACKEND=orjson needs `pip install orjson`')
+
+# dumps() arguments orjson's compact output already satisfies
+_COMPACT = {'separators': (',', ':')}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    backend = BACKEND
+
+    def __init__(self, app):
+        super().__init__(app)
+        self._serializers = {}
+        # (result metadata, column names) of the last row encoded: Row._fields is rebuilt on every access,
+        # and the rows of one response share their metadata
+        self._row_fields = (None, ())
+
+    def register(self, cls, serialize):
+        """Encode instances of ``cls`` (exact type) as ``serialize(obj)``"""
+        self._serializers[cls] = serialize
+
+    def default(self, o):
+        serialize = self._serializers.get(type(o))
+        if serialize is not None:
+            return serialize(o)
+        if isinstance(o, Row):
+            parent, fields = self._row_fields
+            if o._parent is not parent:
+                fields = o._fields
+                self._row_fields = (o._parent, fields)
+            return dict(zip(fields, o))
+        if isinstance(o, (datetime, date, time)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def _orjson_option(self, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if self.backend == 'orjson' and (not kwargs or kwargs == _COMPACT):
+            return orjson.dumps(obj, default=self.default, option=self._orjson_option()).decode()
+        kwargs.setdefault('default', self.default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.backend == 'orjson' and not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                # Let the stdlib decide: it also accepts NaN and integers beyond 64 bits
+                pass
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if self.backend != 'orjson':
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._orjson_option(indent))
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,307 @@
+"""Request metrics in Prometheus text format
+
+Each process writes its samples into its own memory-mapped file under
+METRICS_DIR (metrics_<pid>.db). /metrics reads every file in the directory and
+sums them, so the numbers are correct however many gunicorn workers served
+the traffic. Counters and histograms of exited workers are kept so totals
+never go backwards; gauges are only taken from live processes. When a worker
+exits (max_requests recycles them all the time) the gunicorn master folds its
+counters and histograms into dead_workers.db and removes its file, so the
+directory holds one file per live worker plus that one.
+
+Recording a sample is a dict lookup plus a struct.pack_into on the mapped
+file, so the per-request cost stays in the low microseconds
+(see benchmarks/bench_metrics.py).
+
+Configuration (environment):
+  METRICS_DIR  directory shared by all workers; wipe it when the server starts.
+               Without it each process only reports its own samples.
+"""
+import glob
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+METRICS_DIR = os.getenv('METRICS_DIR')
+# Counters and histograms of exited workers (see mark_process_dead)
+DEAD_WORKERS_FILE = 'dead_workers.db'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+# name -> (type, help)
+METRICS = {
+    'mcb_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status'),
+    'mcb_http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint'),
+    'mcb_http_requests_in_flight': ('gauge', 'HTTP requests currently being served'),
+    'mcb_db_pool_checked_out': ('gauge', 'DB connections checked out of the pool'),
+    'mcb_db_pool_checkout_seconds': ('histogram', 'Time spent waiting for a DB connection by bind'),
+    'mcb_hash_pool_queue_depth': ('gauge', 'Password hashes in flight or queued'),
+    'mcb_rate_limit_rejections_total': ('counter', 'Requests rejected by the auth rate limiter'),
+    'mcb_app_startup_seconds': ('histogram', 'Time from importing the app module until create_app() returned'),
+    'mcb_compression_bytes_total': ('counter', 'Response bytes before (stage="in") and after compression by algorithm'),
+}
+GAUGE_NAMES = {name for name, (kind, _) in METRICS.items() if kind == 'gauge'}
+
+
+class MmapedDict:
+    """Append-only key -> float64 map stored in a memory-mapped file
+
+    Layout: 8 byte used-size header, then records of
+    [uint32 key length][key bytes padded to 8][float64 value].
+    Only the owning process writes to the file.
+    """
+
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path):
+        self._path = path
+        self._f = open(path, 'a+b')
+        if os.fstat(self._f.fileno()).st_size == 0:
+            self._f.truncate(self.INITIAL_SIZE)
+        self._capacity = os.fstat(self._f.fileno()).st_size
+        self._m = mmap.mmap(self._f.fileno(), self._capacity)
+        self._positions = {}
+        self._used = struct.unpack_from('Q', self._m, 0)[0] or 8
+        for key, _, pos in self._read(self._m, self._used):
+            self._positions[key] = pos
+
+    @staticmethod
+    def _read(data, used):
+        pos = 8
+        while pos < used:
+            length = struct.unpack_from('I', data, pos)[0]
+            key = data[pos + 4:pos + 4 + length].decode('utf-8')
+            pos += 4 + length + (-(4 + length) % 8)
+            value = struct.unpack_from('d', data, pos)[0]
+            yield key, value, pos
+            pos += 8
+
+    @classmethod
+    def read_file(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < 8:
+            return []
+        return [(key, value) for key, value, _ in cls._read(data, struct.unpack_from('Q', data, 0)[0])]
+
+    def _init_key(self, key):
+        encoded = key.encode('utf-8')
+        padded = encoded + b' ' * (-(4 + len(encoded)) % 8)
+        record = struct.pack('I', len(encoded)) + padded + struct.pack('d', 0.0)
+        while self._used + len(record) > self._capacity:
+            self._capacity *= 2
+            self._f.truncate(self._capacity)
+            self._m.close()
+            self._m = mmap.mmap(self._f.fileno(), self._capacity)
+        self._m[self._used:self._used + len(record)] = record
+        self._positions[key] = self._used + len(record) - 8
+        self._used += len(record)
+        struct.pack_into('Q', self._m, 0, self._used)
+
+    def add(self, key, amount):
+        pos = self._positions.get(key)
+        if pos is None:
+            self._init_key(key)
+            pos = self._positions[key]
+        struct.pack_into('d', self._m, pos, struct.unpack_from('d', self._m, pos)[0] + amount)
+
+    def set(self, key, value):
+        pos = self._positions.get(key)
+        if pos is None:
+            self._init_key(key)
+            pos = self._positions[key]
+        struct.pack_into('d', self._m, pos, value)
+
+    def close(self):
+        self._m.close()
+        self._f.close()
+
+
+_lock = threading.Lock()
+_store = None
+_store_pid = None
+
+
+def _directory():
+    global METRICS_DIR
+    if not METRICS_DIR:
+        METRICS_DIR = tempfile.mkdtemp(prefix='mcb_metrics_')
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    return METRICS_DIR
+
+
+def _get_store():
+    # A forked worker must not write into its parent's file
+    global _store, _store_pid
+    if _store is None or _store_pid != os.getpid():
+        _store = MmapedDict(os.path.join(_directory(), 'metrics_%d.db' % os.getpid()))
+        _store_pid = os.getpid()
+    return _store
+
+
+@lru_cache(maxsize=4096)
+def _key(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"'))
+                                     for k, v in labels))
+
+
+def inc(name, labels=(), amount=1.0):
+    with _lock:
+        _get_store().add(_key(name, labels), amount)
+
+
+def set_gauge(name, value, labels=()):
+    with _lock:
+        _get_store().set(_key(name, labels), value)
+
+
+def _observe(store, name, value, labels):
+    for bound in LATENCY_BUCKETS:
+        if value <= bound:
+            break
+    le = '+Inf' if bound == float('inf') else repr(bound)
+    store.add(_key(name + '_bucket', labels + (('le', le),)), 1.0)
+    store.add(_key(name + '_sum', labels), value)
+    store.add(_key(name + '_count', labels), 1.0)
+
+
+def observe(name, value, labels=()):
+    """Add one observation to a histogram"""
+    with _lock:
+        _observe(_get_store(), name, value, labels)
+
+
+def observe_request(endpoint, method, status, duration):
+    """Record one finished request"""
+    with _lock:
+        store = _get_store()
+        store.add(_key('mcb_http_requests_total', (('endpoint', endpoint), ('method', method), ('status', status))), 1.0)
+        _observe(store, 'mcb_http_request_duration_seconds', duration, (('endpoint', endpoint),))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _directory_lock(exclusive):
+    """Readers share it; folding a dead worker's file takes it alone, so no reader counts that file twice"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(_directory(), 'metrics.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+def clear():
+    """Remove the metric files of other processes (call from the server master before workers start)"""
+    if METRICS_DIR:
+        own = os.path.join(METRICS_DIR, 'metrics_%d.db' % os.getpid())
+        for path in glob.glob(os.path.join(METRICS_DIR, 'metrics_*.db')) + [
+                os.path.join(METRICS_DIR, DEAD_WORKERS_FILE)]:
+            if path != own and os.path.exists(path):
+                os.remove(path)
+
+
+def mark_process_dead(pid):
+    """Fold an exited process's counters and histograms into DEAD_WORKERS_FILE and remove its file
+
+    Call from the gunicorn master (child_exit), the only writer of that file.
+    The process's gauges are dropped.
+    """
+    path = os.path.join(_directory(), 'metrics_%d.db' % pid)
+    if not os.path.exists(path):
+        return
+    with _directory_lock(exclusive=True):
+        dead = MmapedDict(os.path.join(_directory(), DEAD_WORKERS_FILE))
+        try:
+            for key, value in MmapedDict.read_file(path):
+                if key.split('{', 1)[0] not in GAUGE_NAMES:
+                    dead.add(key, value)
+        finally:
+            dead.close()
+        os.remove(path)
+
+
+def collect():
+    """Aggregate samples from every process file: {sample key: value}"""
+    _get_store()
+    totals = defaultdict(float)
+    with _directory_lock(exclusive=False):
+        for path in glob.glob(os.path.join(_directory(), 'metrics_*.db')):
+            pid = int(os.path.basename(path)[len('metrics_'):-len('.db')])
+            # Files of processes that died without mark_process_dead (no gunicorn master) still count
+            alive = pid == os.getpid() or _pid_alive(pid)
+            for key, value in MmapedDict.read_file(path):
+                if key.split('{', 1)[0] in GAUGE_NAMES and not alive:
+                    continue
+                totals[key] += value
+        dead = os.path.join(_directory(), DEAD_WORKERS_FILE)
+        if os.path.exists(dead):
+            for key, value in MmapedDict.read_file(dead):
+                totals[key] += value
+    return totals
+
+
+def render():
+    """Prometheus text exposition of the aggregated samples"""
+    samples = collect()
+    by_metric = defaultdict(list)
+    for key, value in samples.items():
+        name = key.split('{', 1)[0]
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                name = name[:-len(suffix)]
+                break
+        by_metric[name].append((key, value))
+
+    lines = []
+    for name in sorted(by_metric):
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        entries = by_metric[name]
+        # Histogram buckets keep their natural le order
+        entries = _cumulative_buckets(name, entries) if kind == 'histogram' else sorted(entries)
+        for key, value in entries:
+            lines.append('%s %s' % (key, repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+
+def _cumulative_buckets(name, entries):
+    """Buckets are stored per range; Prometheus expects cumulative counts"""
+    buckets = defaultdict(dict)
+    other = []
+    for key, value in entries:
+        if key.startswith(name + '_bucket{'):
+            labels = key[len(name + '_bucket{'):-1]
+            series, _, le = labels.rpartition('le=')
+            buckets[series.rstrip(',')][le.strip('"')] = value
+        else:
+            other.append((key, value))
+    for series, counts in buckets.items():
+        running = 0.0
+        for bound in LATENCY_BUCKETS:
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            running += counts.get(le, 0.0)
+            other.append(('%s_bucket{%sle="%s"}' % (name, series + ',' if series else '', le), running))
+    return other
@@ -0,0 +1,117 @@
+"""Cached OpenID Connect discovery document and JWKS
+
+Google sign-in needs the provider's discovery document (endpoints, issuer)
+and its signing keys (JWKS) to validate ID tokens locally. Both are cached
+for OIDC_CACHE_TTL seconds. Once an entry is stale it is still served while a
+background thread refreshes it, so a login never waits on discovery after
+the first one. An ID token signed with an unknown key id forces one JWKS
+refresh (at most every JWKS_FORCE_REFRESH_INTERVAL seconds) to pick up key
+rotation.
+
+All outbound calls use strict (connect, read) timeouts from OIDC_HTTP_TIMEOUT.
+"""
+import logging
+import os
+import threading
+import time
+
+import requests
+from authlib.integrations.flask_client import OAuth
+from authlib.integrations.flask_client.apps import FlaskOAuth2App
+
+log = logging.getLogger('mcb.oidc')
+
+CACHE_TTL = float(os.getenv('OIDC_CACHE_TTL', 3600))
+HTTP_TIMEOUT = tuple(float(x) for x in os.getenv('OIDC_HTTP_TIMEOUT', '2,5').split(','))
+JWKS_FORCE_REFRESH_INTERVAL = 60
+
+
+class CachedDocument:
+    """A JSON document fetched over HTTP, cached with TTL and refreshed in the background"""
+
+    def __init__(self, get_url, ttl=CACHE_TTL):
+        self._get_url = get_url
+        self.ttl = ttl
+        self._value = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.fetches = 0
+
+    def _fetch(self):
+        resp = requests.get(self._get_url(), timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
+        value = resp.json()
+        with self._lock:
+            self._value = value
+            self._fetched_at = time.monotonic()
+            self.fetches += 1
+        return value
+
+    def _refresh_in_background(self):
+        try:
+            self._fetch()
+        except Exception:
+            log.exception('Background refresh of %s failed; serving cached copy', self._get_url())
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self, force=False):
+        with self._lock:
+            value = self._value
+            age = time.monotonic() - self._fetched_at
+            stale = value is not None and age > self.ttl and not self._refreshing
+            if stale:
+                self._refreshing = True
+        if value is None or force:
+            return self._fetch()
+        if stale:
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return value
+
+    def age(self):
+        return time.monotonic() - self._fetched_at if self._value is not None else None
+
+
+class OIDCCache:
+    def __init__(self, discovery_url, ttl=CACHE_TTL):
+        self.discovery_url = discovery_url
+        self.metadata = CachedDocument(lambda: self.discovery_url, ttl)
+        self.jwks = CachedDocument(lambda: self.metadata.get()['jwks_uri'], ttl)
+        self._last_forced_jwks = 0.0
+
+    def get_metadata(self):
+        return self.metadata.get()
+
+    def get_jwks(self, force=False):
+        if force:
+            now = time.monotonic()
+            if now - self._last_forced_jwks < JWKS_FORCE_REFRESH_INTERVAL:
+                force = False
+            else:
+                self._last_forced_jwks = now
+        return self.jwks.get(force=force)
+
+
+class CachedOIDCApp(FlaskOAuth2App):
+    """Authlib client that reads discovery and JWKS from an OIDCCache"""
+
+    oidc_cache = None
+
+    def load_server_metadata(self):
+        if self.oidc_cache is None:
+            return super().load_server_metadata()
+        metadata = dict(self.oidc_cache.get_metadata())
+        metadata['_loaded_at'] = time.time()
+        self.server_metadata.update(metadata)
+        return self.server_metadata
+
+    def fetch_jwk_set(self, force=False):
+        if self.oidc_cache is None:
+            return super().fetch_jwk_set(force)
+        return self.oidc_cache.get_jwks(force=force)
+
+
+class CachedOAuth(OAuth):
+    oauth2_client_cls = CachedOIDCApp
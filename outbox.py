@@ -0,0 +1,264 @@
+"""Durable email outbox with a background SMTP dispatcher
+
+Requests only insert a row into the ``email_outbox`` table. A dispatcher
+thread claims due rows in batches, sends them over one reused SMTP
+connection and retries failures with exponential backoff. Rows with the same
+``dedupe_key`` that are still pending are updated in place, even while a
+dispatcher holds them, so repeated password-reset requests for one address
+produce a single email carrying the latest link. A partial unique index
+keeps one pending row per key, and the dispatcher re-reads a row just before
+sending it; if the row changed while it was on the wire it stays pending and
+the latest version goes out next.
+
+Several workers can run a dispatcher at once: rows are claimed with an
+UPDATE that stamps a claim token, so each row is sent by one dispatcher only.
+
+Configuration (environment):
+  SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_USE_TLS, MAIL_FROM
+  EMAIL_BATCH_SIZE      rows sent per batch (default 50)
+  EMAIL_MAX_ATTEMPTS    attempts before a row is marked failed (default 5)
+  EMAIL_RETRY_BASE      seconds before the first retry, doubled each attempt (default 30)
+  EMAIL_POLL_INTERVAL   seconds between polls when idle (default 5)
+Without SMTP_HOST emails are logged instead of sent.
+"""
+import logging
+import os
+import smtplib
+import threading
+import uuid
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+
+import sqlalchemy as sa
+
+log = logging.getLogger('mcb.outbox')
+
+SMTP_HOST = os.getenv('SMTP_HOST')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+SMTP_USERNAME = os.getenv('SMTP_USERNAME')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', '1') == '1'
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', 10))
+MAIL_FROM = os.getenv('MAIL_FROM', 'no-reply@mcb.app')
+BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 50))
+MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 5))
+RETRY_BASE = float(os.getenv('EMAIL_RETRY_BASE', 30))
+POLL_INTERVAL = float(os.getenv('EMAIL_POLL_INTERVAL', 5))
+# A claimed row whose dispatcher died becomes due again after this long
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+metadata = sa.MetaData()
+outbox_table = sa.Table(
+    'email_outbox', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('to_address', sa.String(120), nullable=False),
+    sa.Column('subject', sa.String(200), nullable=False),
+    sa.Column('body', sa.Text, nullable=False),
+    sa.Column('dedupe_key', sa.String(200), nullable=True),
+    sa.Column('status', sa.String(20), nullable=False, default='pending'),
+    sa.Column('attempts', sa.Integer, nullable=False, default=0),
+    sa.Column('next_attempt_at', sa.DateTime, nullable=False),
+    sa.Column('claim_token', sa.String(36), nullable=True),
+    sa.Column('claimed_at', sa.DateTime, nullable=True),
+    sa.Column('last_error', sa.Text, nullable=True),
+    sa.Column('created_at', sa.DateTime, nullable=False),
+    sa.Column('sent_at', sa.DateTime, nullable=True),
+    sa.Index('ix_email_outbox_due', 'status', 'next_attempt_at'),
+    sa.Index('ix_email_outbox_dedupe', 'dedupe_key', 'status'),
+)
+# One pending email per dedupe_key; created by install() on tables that predate it too
+pending_dedupe_index = sa.Index(
+    'uq_email_outbox_pending_dedupe', outbox_table.c.dedupe_key, unique=True,
+    postgresql_where=outbox_table.c.status == 'pending', sqlite_where=outbox_table.c.status == 'pending')
+
+_created = set()
+
+
+def install(engine):
+    """Create the outbox table and its indexes if missing"""
+    metadata.create_all(engine, checkfirst=True)
+    try:
+        pending_dedupe_index.create(engine, checkfirst=True)
+    except sa.exc.IntegrityError:
+        log.warning('email_outbox has several pending emails with one dedupe_key; '
+                    'unique index %s not created', pending_dedupe_index.name)
+
+
+def _ensure_table(engine):
+    if engine not in _created:
+        install(engine)
+        _created.add(engine)
+
+
+def enqueue(engine, to_address, subject, body, dedupe_key=None):
+    """Store an email for delivery; a pending email with the same dedupe_key is replaced"""
+    _ensure_table(engine)
+    now = datetime.utcnow()
+    # A second try covers a concurrent enqueue inserting the key's pending row first
+    for attempt in range(2):
+        try:
+            with engine.begin() as conn:
+                if dedupe_key:
+                    # Claimed rows too: the dispatcher re-reads the row before sending it
+                    updated = conn.execute(
+                        outbox_table.update()
+                        .where(outbox_table.c.dedupe_key == dedupe_key)
+                        .where(outbox_table.c.status == 'pending')
+                        .values(to_address=to_address, subject=subject, body=body, next_attempt_at=now)
+                    ).rowcount
+                    if updated:
+                        return
+                conn.execute(outbox_table.insert().values(
+                    to_address=to_address, subject=subject, body=body, dedupe_key=dedupe_key,
+                    status='pending', attempts=0, next_attempt_at=now, created_at=now))
+                return
+        except sa.exc.IntegrityError:
+            if attempt:
+                raise
+
+
+class SMTPPool:
+    """One long-lived SMTP connection, reopened when the server drops it"""
+
+    def __init__(self):
+        self._conn = None
+
+    def _connect(self):
+        conn = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_USE_TLS:
+            conn.starttls()
+        if SMTP_USERNAME:
+            conn.login(SMTP_USERNAME, SMTP_PASSWORD)
+        return conn
+
+    def connection(self):
+        if self._conn is not None:
+            try:
+                if self._conn.noop()[0] == 250:
+                    return self._conn
+            except smtplib.SMTPException:
+                pass
+            self.close()
+        self._conn = self._connect()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._conn = None
+
+    def send(self, row):
+        if not SMTP_HOST:
+            log.info("Email to %s (SMTP_HOST not set): %s\n%s", row.to_address, row.subject, row.body)
+            return
+        message = MIMEText(row.body)
+        message['Subject'] = row.subject
+        message['From'] = MAIL_FROM
+        message['To'] = row.to_address
+        try:
+            self.connection().sendmail(MAIL_FROM, [row.to_address], message.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # Stale pooled connection; retry once on a fresh one
+            self.close()
+            self.connection().sendmail(MAIL_FROM, [row.to_address], message.as_string())
+
+
+class Dispatcher:
+    def __init__(self, engine):
+        self.engine = engine
+        self.pool = SMTPPool()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _claim(self):
+        token = str(uuid.uuid4())
+        now = datetime.utcnow()
+        c = outbox_table.c
+        due = (sa.select(c.id)
+               .where(c.status == 'pending')
+               .where(c.next_attempt_at <= now)
+               .where(sa.or_(c.claim_token.is_(None), c.claimed_at < now - CLAIM_TIMEOUT))
+               .order_by(c.next_attempt_at)
+               .limit(BATCH_SIZE))
+        with self.engine.begin() as conn:
+            ids = conn.execute(due).scalars().all()
+            if not ids:
+                return []
+            conn.execute(outbox_table.update()
+                         .where(c.id.in_(ids))
+                         .where(sa.or_(c.claim_token.is_(None), c.claimed_at < now - CLAIM_TIMEOUT))
+                         .values(claim_token=token, claimed_at=now))
+            return conn.execute(sa.select(outbox_table).where(c.claim_token == token)).all()
+
+    def run_once(self):
+        """Send one batch of due emails; returns the number of rows processed"""
+        _ensure_table(self.engine)
+        rows = self._claim()
+        self._deliver(rows)
+        return len(rows)
+
+    def _deliver(self, rows):
+        c = outbox_table.c
+        for row in rows:
+            # The latest content: enqueue() may have replaced it since the claim
+            with self.engine.connect() as conn:
+                row = conn.execute(sa.select(outbox_table).where(c.id == row.id)
+                                   .where(c.claim_token == row.claim_token)).first()
+            if row is None:
+                continue
+            now = datetime.utcnow()
+            unchanged = sa.and_(c.to_address == row.to_address, c.subject == row.subject, c.body == row.body)
+            try:
+                self.pool.send(row)
+                values = {'status': 'sent', 'sent_at': now, 'attempts': row.attempts + 1, 'last_error': None}
+            except (smtplib.SMTPException, OSError) as e:
+                attempts = row.attempts + 1
+                log.warning("Email %s to %s failed (attempt %d): %s", row.id, row.to_address, attempts, e)
+                self.pool.close()
+                values = {
+                    'status': 'failed' if attempts >= MAX_ATTEMPTS else 'pending',
+                    'attempts': attempts,
+                    'last_error': str(e),
+                    'next_attempt_at': now + timedelta(seconds=RETRY_BASE * 2 ** (attempts - 1)),
+                }
+            with self.engine.begin() as conn:
+                if values['status'] == 'sent':
+                    marked = conn.execute(outbox_table.update().where(c.id == row.id).where(unchanged)
+                                          .values(claim_token=None, claimed_at=None, **values)).rowcount
+                    if marked:
+                        continue
+                    # Replaced while it was being sent: leave it pending so the latest version goes out
+                    values = {}
+                conn.execute(outbox_table.update().where(c.id == row.id)
+                             .values(claim_token=None, claimed_at=None, **values))
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once() >= BATCH_SIZE:
+                    continue
+            except Exception:
+                log.exception("Email dispatcher error")
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+        self.pool.close()
+
+    def wake(self):
+        """Start the dispatcher thread in this process if needed and poke it"""
+        # One check-and-start at a time, so concurrent callers can't each start a thread
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self.run_forever, name='email-dispatcher', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
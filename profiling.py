@@ -0,0 +1,313 @@
+"""On-demand sampling profiler for single requests
+
+A request is profiled when it carries "X-Profile: <PROFILE_TOKEN>" or, with
+PROFILE_SAMPLE_RATE set, when it is picked at random. While it runs, a
+background thread reads the request thread's stack every PROFILE_INTERVAL_MS
+(sys._current_frames(), no tracing hooks), so the request itself pays
+nothing per call. The samples are written to PROFILE_DIR as a speedscope
+file (open it at https://www.speedscope.app) or as collapsed stacks for
+flamegraph.pl, and the response gets an X-Profile-Id header naming it.
+
+PROFILE_DIR is a ring buffer: after each write only the newest PROFILE_KEEP
+profiles stay. /api/profiles lists them and /api/profiles/<id> downloads one.
+
+With neither PROFILE_TOKEN nor PROFILE_SAMPLE_RATE set, init_app() registers
+no hooks and requests run exactly as before. The sampler thread only runs
+while a profiled request is in flight, and at most MAX_ACTIVE requests are
+profiled at once.
+
+Under gevent all greenlets share the worker's thread, so a profile also
+contains whatever other requests ran while it was sampled.
+
+Configuration (environment):
+  PROFILE_TOKEN        value of the X-Profile header that profiles a request;
+                       also the bearer token for /api/profiles (without it,
+                       profiles can only be read from PROFILE_DIR)
+  PROFILE_SAMPLE_RATE  fraction of requests profiled without the header (default 0)
+  PROFILE_INTERVAL_MS  sampling interval (default 5)
+  PROFILE_FORMAT       "speedscope" (default) or "collapsed"
+  PROFILE_DIR          directory for profile files, shared by the workers
+                       (default <tmp>/mcb-profiles)
+  PROFILE_KEEP         profiles kept in PROFILE_DIR (default 100)
+"""
+import glob
+import hmac
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import request
+
+log = logging.getLogger('mcb.profiling')
+
+TOKEN = os.getenv('PROFILE_TOKEN') or None
+SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+INTERVAL = float(os.getenv('PROFILE_INTERVAL_MS', 5)) / 1000
+FORMAT = os.getenv('PROFILE_FORMAT', 'speedscope')
+PROFILE_DIR = os.getenv('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'mcb-profiles')
+KEEP = max(int(os.getenv('PROFILE_KEEP', 100)), 1)
+MAX_ACTIVE = 4
+# Samples kept per request (a minute at the default interval); longer requests keep their first minute
+MAX_SAMPLES = 12000
+
+EXTENSIONS = {'speedscope': '.speedscope.json', 'collapsed': '.collapsed.txt'}
+if FORMAT not in EXTENSIONS:
+    raise RuntimeError('PROFILE_FORMAT must be "speedscope" or "collapsed"')
+
+PROFILE_ID = re.compile(r'^\d{8}T\d{6}-\d+-\d+$')
+_FILENAME = re.compile(r'^(?P<id>\d{8}T\d{6}-\d+-\d+)\.(?P<endpoint>[\w.]+)\.(?P<ms>\d+)ms(?P<ext>\..+)$')
+
+
+def enabled():
+    return TOKEN is not None or SAMPLE_RATE > 0
+
+
+def _native_threads():
+    """start_new_thread, sleep, allocate_lock and get_ident of real OS threads, even after gevent's monkey patching"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched('threading'):
+        return (monkey.get_original('_thread', 'start_new_thread'), monkey.get_original('time', 'sleep'),
+                monkey.get_original('_thread', 'allocate_lock'), monkey.get_original('_thread', 'get_ident'))
+    import _thread
+    return _thread.start_new_thread, time.sleep, _thread.allocate_lock, _thread.get_ident
+
+
+class Profile:
+    """Stacks sampled from one request thread"""
+
+    def __init__(self, thread_id, profile_id):
+        self.thread_id = thread_id
+        self.id = profile_id
+        self.started = time.perf_counter()
+        self.duration = None
+        # Each sample is a tuple of code objects, outermost first
+        self.samples = []
+
+    def sample(self, frame):
+        if len(self.samples) >= MAX_SAMPLES:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack.reverse()
+        self.samples.append(tuple(stack))
+
+    @staticmethod
+    def _frame_name(code):
+        return '%s (%s:%d)' % (code.co_qualname, os.path.basename(code.co_filename), code.co_firstlineno)
+
+    def collapsed(self):
+        """One "frame;frame;frame count" line per distinct stack, the flamegraph.pl input format"""
+        names = {}
+        counts = Counter(self.samples)
+        lines = []
+        for stack, count in counts.most_common():
+            frames = [names.get(code) or names.setdefault(code, self._frame_name(code)) for code in stack]
+            lines.append('%s %d' % (';'.join(frames), count))
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self, name):
+        """A speedscope "sampled" profile with the samples in time order"""
+        frames = []
+        index = {}
+        samples = []
+        for stack in self.samples:
+            indexes = []
+            for code in stack:
+                i = index.get(code)
+                if i is None:
+                    i = index[code] = len(frames)
+                    frames.append({'name': code.co_qualname, 'file': code.co_filename, 'line': code.co_firstlineno})
+                indexes.append(i)
+            samples.append(indexes)
+        interval_ms = INTERVAL * 1000
+        return json.dumps({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': len(samples) * interval_ms,
+                'samples': samples,
+                'weights': [interval_ms] * len(samples),
+            }],
+            'name': name,
+            'exporter': 'mcb profiling.py',
+        })
+
+
+class Sampler:
+    """One background thread per process sampling every active Profile"""
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self._start_thread, self._sleep, allocate_lock, self._get_ident = _native_threads()
+        self._lock = allocate_lock()
+        self._active = {}
+        self._running = False
+        self._ids = itertools.count(1)
+
+    def start(self):
+        """Start sampling the calling thread; None when MAX_ACTIVE requests are already profiled"""
+        profile_id = '%s-%d-%06d' % (datetime.utcnow().strftime('%Y%m%dT%H%M%S'), os.getpid(), next(self._ids))
+        profile = Profile(self._get_ident(), profile_id)
+        with self._lock:
+            if len(self._active) >= MAX_ACTIVE:
+                return None
+            self._active[profile.id] = profile
+            if not self._running:
+                self._running = True
+                self._start_thread(self._run, ())
+        return profile
+
+    def stop(self, profile):
+        with self._lock:
+            self._active.pop(profile.id, None)
+        profile.duration = time.perf_counter() - profile.started
+        return profile
+
+    def _run(self):
+        while True:
+            self._sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    # Exits with nothing to sample; the next start() launches a new thread
+                    self._running = False
+                    return
+                profiles = list(self._active.values())
+            frames = sys._current_frames()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.sample(frame)
+
+
+_sampler = None
+_sampler_pid = None
+
+
+def sampler():
+    # One per process: a thread started before a fork doesn't exist in the child
+    global _sampler, _sampler_pid
+    if _sampler is None or _sampler_pid != os.getpid():
+        _sampler = Sampler()
+        _sampler_pid = os.getpid()
+    return _sampler
+
+
+def _token_matches(value):
+    return TOKEN is not None and hmac.compare_digest(value.encode(), TOKEN.encode())
+
+
+def _wants_profile():
+    if _token_matches(request.headers.get('X-Profile', '')):
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def save(profile, endpoint):
+    """Write ``profile`` to PROFILE_DIR and drop the oldest files beyond PROFILE_KEEP"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    filename = '%s.%s.%dms%s' % (profile.id, re.sub(r'[^\w.]', '_', endpoint or 'none'),
+                                 profile.duration * 1000, EXTENSIONS[FORMAT])
+    body = profile.speedscope(endpoint or 'none') if FORMAT == 'speedscope' else profile.collapsed()
+    path = os.path.join(PROFILE_DIR, filename)
+    with open(path + '.tmp', 'w') as f:
+        f.write(body)
+    os.replace(path + '.tmp', path)
+    # Names start with the UTC time, so sorting them orders every worker's profiles by age
+    for old in sorted(_profile_files())[:-KEEP]:
+        try:
+            os.unlink(os.path.join(PROFILE_DIR, old))
+        except FileNotFoundError:
+            pass
+    return filename
+
+
+def _profile_files():
+    return [os.path.basename(p) for p in glob.glob(os.path.join(PROFILE_DIR, '*'))
+            if _FILENAME.match(os.path.basename(p))]
+
+
+def list_profiles():
+    """Metadata of the stored profiles, newest first"""
+    profiles = []
+    for filename in sorted(_profile_files(), reverse=True):
+        match = _FILENAME.match(filename)
+        try:
+            size = os.path.getsize(os.path.join(PROFILE_DIR, filename))
+        except FileNotFoundError:
+            continue
+        profiles.append({
+            'id': match.group('id'),
+            'endpoint': match.group('endpoint'),
+            'duration_ms': int(match.group('ms')),
+            'format': 'speedscope' if match.group('ext') == EXTENSIONS['speedscope'] else 'collapsed',
+            'bytes': size,
+            'created_at': datetime.strptime(match.group('id').split('-')[0], '%Y%m%dT%H%M%S'),
+        })
+    return profiles
+
+
+def find(profile_id):
+    """File name of the profile with this id, or None"""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    matches = glob.glob(os.path.join(PROFILE_DIR, glob.escape(profile_id) + '.*'))
+    matches = [os.path.basename(p) for p in matches if _FILENAME.match(os.path.basename(p))]
+    return matches[0] if matches else None
+
+
+def authorized():
+    """Whether the request may read profiles: it carries the PROFILE_TOKEN bearer token
+
+    Stacks show code paths and timings, so with no token set nobody may read
+    them over HTTP, signed in or not.
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme == 'Bearer' and _token_matches(token)
+
+
+def init_app(app):
+    if not enabled():
+        return
+
+    # The profile is kept on the request, not g: batched sub-requests share the batch's g and their
+    # teardown would otherwise stop the batch's profile after its first item
+    @app.before_request
+    def start_profile():
+        if _wants_profile():
+            request.environ['mcb.profile'] = sampler().start()
+
+    @app.after_request
+    def profile_header(response):
+        profile = request.environ.get('mcb.profile')
+        if profile is not None:
+            response.headers['X-Profile-Id'] = profile.id
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        profile = request.environ.pop('mcb.profile', None)
+        if profile is None:
+            return
+        sampler().stop(profile)
+        try:
+            filename = save(profile, request.endpoint)
+            log.info('Profiled %s %s in %.0f ms: %s', request.method, request.path, profile.duration * 1000, filename)
+        except OSError:
+            log.exception('Could not write profile %s', profile.id)
@@ -0,0 +1,144 @@
+"""Token-bucket rate limiting and admission control
+
+Buckets refill continuously at ``rate`` tokens per second up to ``capacity``.
+Each admitted request takes one token; when the bucket is empty the caller is
+told how long to wait. A separate counter caps how many expensive requests
+may run at once.
+
+Backends:
+  MemoryRateLimitBackend  per-process state, fine for a single worker
+  RedisRateLimitBackend   shared state for multi-worker gunicorn; works with any
+                          client exposing eval/incr/decr/expire (redis-py, fakeredis, ...)
+"""
+import math
+import threading
+import time
+from collections import Counter
+
+from sessions import LRUCache
+
+
+class MemoryRateLimitBackend:
+    def __init__(self, maxsize=100000):
+        self._buckets = LRUCache(maxsize=maxsize)
+        self._active = Counter()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        """Take a token; returns 0 when admitted, otherwise seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key) or (capacity, now)
+            tokens = min(capacity, tokens + (now - last) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets.set(key, (tokens, now), ttl=capacity / rate + 1)
+        return wait
+
+    def acquire(self, key, limit):
+        with self._lock:
+            if self._active[key] >= limit:
+                return False
+            self._active[key] += 1
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._active[key] -= 1
+
+
+class RedisRateLimitBackend:
+    TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+    # Slots are released in a finally block; the expiry only matters if a worker dies mid-request
+    ACTIVE_TTL = 60
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def take(self, key, rate, capacity):
+        wait = self.client.eval(self.TOKEN_BUCKET, 1, self.prefix + key, rate, capacity, time.time())
+        return float(wait)
+
+    def acquire(self, key, limit):
+        key = self.prefix + 'active:' + key
+        if self.client.incr(key) > limit:
+            self.client.decr(key)
+            return False
+        self.client.expire(key, self.ACTIVE_TTL)
+        return True
+
+    def release(self, key):
+        self.client.decr(self.prefix + 'active:' + key)
+
+
+class RateLimited(Exception):
+    """Raised when a request is rejected; carries the suggested Retry-After"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+        self.rejections = Counter()
+        self._lock = threading.Lock()
+
+    def _reject(self, reason, retry_after):
+        with self._lock:
+            self.rejections[reason] += 1
+        raise RateLimited(reason, retry_after)
+
+    def check(self, kind, key, per_minute, burst=None):
+        """Admit one request for ``kind:key`` or raise RateLimited"""
+        rate = per_minute / 60.0
+        wait = self.backend.take('%s:%s' % (kind, key), rate, burst or per_minute)
+        if wait > 0:
+            self._reject(kind, wait)
+
+    def acquire(self, name, limit):
+        """Reserve one of ``limit`` concurrent slots or raise RateLimited"""
+        if not self.backend.acquire(name, limit):
+            self._reject('concurrency', 1)
+
+    def release(self, name):
+        self.backend.release(name)
+
+    def stats(self):
+        with self._lock:
+            return {'rejections': dict(self.rejections), 'rejected_total': sum(self.rejections.values())}
+
+
+def create_rate_limiter(backend, redis_url=None):
+    if backend == 'memory':
+        return RateLimiter(MemoryRateLimitBackend())
+    if backend == 'redis':
+        return RateLimiter(RedisRateLimitBackend.from_url(redis_url))
+    raise ValueError("Unknown RATE_LIMIT_BACKEND: %s" % backend)
@@ -0,0 +1,123 @@
+"""Per-user response cache for read endpoints
+
+Responses are cached by endpoint, view arguments, query string, Accept header
+and user, in a
+bounded LRU with TTL. Every entry carries a strong ETag so clients polling
+with If-None-Match get an empty 304. Concurrent misses for the same key are
+coalesced: one request renders the response while the others wait for it.
+
+Invalidation uses tags. Each cached view declares the tags it depends on
+(e.g. "user:42", "users"); invalidating a tag bumps its generation, which is
+part of every cache key, so stale entries are never served again and simply
+age out of the LRU. Generations are per worker process, so other workers may
+serve an entry for up to RESPONSE_CACHE_TTL seconds after a write.
+"""
+import hashlib
+import threading
+from collections import defaultdict
+from functools import wraps
+
+from flask import make_response, request
+
+from sessions import LRUCache
+
+
+class ResponseCache:
+    # Seconds a follower waits for the leader of a coalesced miss
+    SINGLE_FLIGHT_TIMEOUT = 10
+
+    def __init__(self, maxsize=2048, ttl=30, get_user_id=lambda: None, enabled=True):
+        self.enabled = enabled
+        self._entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._get_user_id = get_user_id
+        self._generations = defaultdict(int)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'not_modified': self.not_modified}
+
+    def _key(self, user_id, tags):
+        with self._lock:
+            generations = tuple((tag, self._generations[tag]) for tag in tags)
+        return (
+            request.endpoint,
+            tuple(sorted(request.view_args.items())),
+            tuple(sorted(request.args.items(multi=True))),
+            request.headers.get('Accept'),
+            user_id,
+            generations,
+        )
+
+    def _respond(self, entry):
+        body, status, mimetype, etag = entry
+        if etag in {tag.split(':', 1)[0] for tag in request.if_none_match.as_set()}:
+            with self._lock:
+                self.not_modified += 1
+            response = make_response('', 304)
+        else:
+            response = make_response(body, status)
+            response.mimetype = mimetype
+        response.headers['ETag'] = '"%s"' % etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def cached(self, tags=lambda uid, **view_args: ()):
+        """Cache a GET view; ``tags(uid, **view_args)`` lists the tags it depends on"""
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+                user_id = self._get_user_id()
+                key = self._key(user_id, tuple(tags(user_id, **kwargs)))
+
+                entry = self._entries.get(key)
+                if entry is not None:
+                    with self._lock:
+                        self.hits += 1
+                    return self._respond(entry)
+
+                with self._lock:
+                    self.misses += 1
+                    event = self._inflight.get(key)
+                    leader = event is None
+                    if leader:
+                        event = self._inflight[key] = threading.Event()
+
+                if not leader:
+                    event.wait(self.SINGLE_FLIGHT_TIMEOUT)
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        return self._respond(entry)
+                    return view(*args, **kwargs)
+
+                try:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    entry = (body, response.status_code, response.mimetype,
+                             hashlib.sha256(body).hexdigest()[:32])
+                    self._entries.set(key, entry)
+                    return self._respond(entry)
+                finally:
+                    with self._lock:
+                        self._inflight.pop(key, None)
+                    event.set()
+
+            return wrapped
+
+        return decorator
@@ -0,0 +1,275 @@
+"""Server-side session storage
+
+The session cookie only carries a random session id. Session data lives in a
+backend store (SQL table or any Redis-compatible client) with a small
+in-process LRU + TTL cache in front of it, so most requests never leave the
+worker to load their session. The cache is per worker: a session changed or
+deleted (logout) in one worker is still served from the other workers'
+caches for up to SESSION_CACHE_TTL seconds. A TTL of 0 turns the cache off.
+
+Configuration (environment):
+  SESSION_BACKEND     "sql" (default), "redis" or "memory"
+  SESSION_REDIS_URL   redis:// URL when SESSION_BACKEND=redis
+  SESSION_TTL         seconds a session lives in the backend (default 7 days)
+  SESSION_CACHE_SIZE  entries kept in the local cache
+  SESSION_CACHE_TTL   seconds a locally cached entry is trusted
+"""
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+import sqlalchemy as sa
+
+
+class LRUCache:
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds"""
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ===== Backends =====
+# Every backend stores opaque strings: get(sid) -> str | None, set(sid, value, ttl), delete(sid)
+
+class MemorySessionStore:
+    """Process-local store; only suitable for a single worker or tests"""
+
+    def __init__(self):
+        self._cache = LRUCache(maxsize=100000)
+
+    def get(self, sid):
+        return self._cache.get(sid)
+
+    def set(self, sid, value, ttl):
+        self._cache.set(sid, value, ttl)
+
+    def delete(self, sid):
+        self._cache.delete(sid)
+
+
+class RedisSessionStore:
+    """Store backed by any client exposing get/setex/delete (redis-py, fakeredis, ...)"""
+
+    def __init__(self, client, prefix='session:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, sid):
+        value = self.client.get(self.prefix + sid)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    def set(self, sid, value, ttl):
+        self.client.setex(self.prefix + sid, int(ttl), value)
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+
+metadata = sa.MetaData()
+session_table = sa.Table(
+    'server_session', metadata,
+    sa.Column('sid', sa.String(64), primary_key=True),
+    sa.Column('data', sa.Text, nullable=False),
+    sa.Column('expires_at', sa.DateTime, nullable=False, index=True),
+)
+
+
+class SQLSessionStore:
+    """Store backed by the ``server_session`` table in the application database"""
+
+    # Fraction of writes that also purge expired rows
+    PURGE_PROBABILITY = 0.01
+
+    def __init__(self, get_engine):
+        self._get_engine = get_engine
+        self._created = False
+
+    def _engine(self):
+        engine = self._get_engine()
+        if not self._created:
+            metadata.create_all(engine, checkfirst=True)
+            self._created = True
+        return engine
+
+    def get(self, sid):
+        with self._engine().connect() as conn:
+            row = conn.execute(
+                sa.select(session_table.c.data)
+                .where(session_table.c.sid == sid)
+                .where(session_table.c.expires_at > datetime.utcnow())
+            ).first()
+        return row.data if row else None
+
+    def set(self, sid, value, ttl):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        with self._engine().begin() as conn:
+            updated = conn.execute(
+                session_table.update()
+                .where(session_table.c.sid == sid)
+                .values(data=value, expires_at=expires_at)
+            ).rowcount
+            if not updated:
+                conn.execute(session_table.insert().values(sid=sid, data=value, expires_at=expires_at))
+            if random.random() < self.PURGE_PROBABILITY:
+                conn.execute(session_table.delete().where(session_table.c.expires_at <= now))
+
+    def delete(self, sid):
+        with self._engine().begin() as conn:
+            conn.execute(session_table.delete().where(session_table.c.sid == sid))
+
+
+class CachedSessionStore:
+    """Local LRU cache in front of a shared backend"""
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    def get(self, sid):
+        value = self.cache.get(sid)
+        if value is None:
+            value = self.backend.get(sid)
+            if value is not None:
+                self.cache.set(sid, value)
+        return value
+
+    def set(self, sid, value, ttl):
+        self.backend.set(sid, value, ttl)
+        self.cache.set(sid, value)
+
+    def delete(self, sid):
+        self.cache.delete(sid)
+        self.backend.delete(sid)
+
+
+# ===== Flask integration =====
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # Id whose stored record is deleted on save, after regenerate()
+        self.stale_sid = None
+
+    def regenerate(self):
+        """Move the session to a fresh id so an id known before login never carries the login"""
+        if not self.new and self.stale_sid is None:
+            self.stale_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps only the session id in the cookie"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            value = self.store.get(sid)
+            if value is not None:
+                return ServerSession(self.serializer.loads(value), sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.stale_sid is not None:
+            self.store.delete(session.stale_sid)
+            session.stale_sid = None
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            self.store.set(session.sid, self.serializer.dumps(dict(session)), self.ttl)
+
+        if self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def create_session_store(backend, get_engine, redis_url=None, cache_size=4096, cache_ttl=5):
+    """Build the configured backend wrapped in the local cache"""
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'redis':
+        store = RedisSessionStore.from_url(redis_url)
+    elif backend == 'sql':
+        store = SQLSessionStore(get_engine)
+    else:
+        raise ValueError("Unknown SESSION_BACKEND: %s" % backend)
+    return CachedSessionStore(store, LRUCache(maxsize=cache_size, ttl=cache_ttl))
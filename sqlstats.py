@@ -0,0 +1,117 @@
+"""Per-request SQL instrumentation
+
+Hooks every SQLAlchemy engine to record, for the current request, how many
+statements ran, the total time spent in the database and the slowest
+statements. Statements that run repeatedly with the same SQL inside one
+request are reported as a likely N+1 pattern, and any statement slower than
+SQL_SLOW_QUERY_MS is written to the "mcb.sql.slow" logger as JSON.
+
+Configuration (environment):
+  SQL_SLOW_QUERY_MS       slow-query log threshold in milliseconds (default 200)
+  SQL_N_PLUS_ONE_THRESHOLD  repeats of one statement that trigger a warning (default 5)
+  SQL_DEBUG_TIMING        "1" adds Server-Timing / X-DB-Query-Count response headers
+"""
+import heapq
+import json
+import logging
+import os
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', 200))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', 5))
+DEBUG_TIMING = os.getenv('SQL_DEBUG_TIMING', '0') == '1'
+SLOWEST_KEPT = 5
+
+slow_log = logging.getLogger('mcb.sql.slow')
+log = logging.getLogger('mcb.sql')
+
+
+class RequestSQLStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = []  # min-heap of (duration, statement)
+        self.statements = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total += duration
+        self.statements[statement] += 1
+        if len(self.slowest) < SLOWEST_KEPT:
+            heapq.heappush(self.slowest, (duration, statement))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, statement))
+
+    def repeated(self):
+        return [(stmt, n) for stmt, n in self.statements.most_common() if n >= N_PLUS_ONE_THRESHOLD]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start_time')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+
+    if duration * 1000 >= SLOW_QUERY_MS:
+        slow_log.warning(json.dumps({
+            'event': 'slow_query',
+            'duration_ms': round(duration * 1000, 2),
+            'statement': statement,
+            'executemany': executemany,
+            'endpoint': request.endpoint if has_request_context() else None,
+        }))
+
+    if has_request_context():
+        stats = g.get('_sql_stats')
+        if stats is not None:
+            stats.record(statement, duration)
+
+
+def current_stats():
+    """Statistics for the current request, or None outside a request"""
+    return g.get('_sql_stats') if has_request_context() else None
+
+
+def init_app(app):
+    for identifier, fn in (('before_cursor_execute', _before_cursor_execute),
+                           ('after_cursor_execute', _after_cursor_execute)):
+        if not event.contains(Engine, identifier, fn):
+            event.listen(Engine, identifier, fn)
+
+    @app.before_request
+    def start_sql_stats():
+        g._sql_stats = RequestSQLStats()
+
+    @app.after_request
+    def finish_sql_stats(response):
+        stats = g.get('_sql_stats')
+        if stats is None:
+            return response
+        for statement, n in stats.repeated():
+            log.warning(json.dumps({
+                'event': 'n_plus_one',
+                'endpoint': request.endpoint,
+                'repeats': n,
+                'statement': statement,
+            }))
+        log.debug(json.dumps({
+            'event': 'request_sql',
+            'endpoint': request.endpoint,
+            'queries': stats.count,
+            'db_ms': round(stats.total * 1000, 2),
+            'slowest': [{'duration_ms': round(d * 1000, 2), 'statement': s}
+                        for d, s in sorted(stats.slowest, reverse=True)],
+        }))
+        if DEBUG_TIMING:
+            response.headers.add('Server-Timing', 'db;dur=%.2f;desc="%d queries"' % (stats.total * 1000, stats.count))
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+        return response
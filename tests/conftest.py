@@ -0,0 +1,64 @@
+"""Shared fixtures: a fresh SQLite database and app per test
+
+The app modules read their configuration from the environment at import
+time, so it is set here before app is imported. Hashes run inline with a
+cheap method; sessions use the SQL store, as in production.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_tmp = tempfile.mkdtemp(prefix='mcb_tests_')
+os.environ.update(
+    DATABASE_URL='sqlite:///' + os.path.join(_tmp, 'unused.db'),
+    FLASK_SKIP_DOTENV='1',
+    SECRET_KEY='test',
+    RATE_LIMIT_ENABLED='0',
+    SESSION_BACKEND='sql',
+    SEED_DEMO_APPLICATIONS='0',
+    EMAIL_DISPATCHER='off',
+    ANALYTICS_REFRESHER='off',
+    PASSWORD_HASH_METHOD='pbkdf2:sha256:1000',
+    HASH_POOL_WORKERS='0',
+    METRICS_DIR=os.path.join(_tmp, 'metrics'),
+    SQL_SLOW_QUERY_MS='60000',
+)
+sys.path.insert(0, ROOT)
+
+import analytics  # noqa: E402
+import app as mcb  # noqa: E402
+import deadlines  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Per-process state would otherwise carry users and positions over from other tests' databases
+    mcb.user_cache.clear()
+    mcb.response_cache.clear()
+    monkeypatch.setattr(mcb, 'deadline_index', deadlines.DeadlineIndex(mcb.Application.__table__))
+    monkeypatch.setattr(mcb, 'application_rollups', analytics.RollupRefresher(mcb.Application.__table__))
+    app = mcb.create_app({
+        'SESSION_COOKIE_SECURE': False,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+    })
+    with app.app_context():
+        mcb.init_db()
+    yield app
+    with app.app_context():
+        mcb.db.session.remove()
+        for engine in mcb.db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def register(client, email='alice@example.com', password='secret123', name='Alice'):
+    response = client.post('/api/register', json={'email': email, 'password': password, 'name': name})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['user']
@@ -0,0 +1,56 @@
+import app as mcb
+from conftest import register
+
+
+def analytics(client):
+    mcb.response_cache.clear()
+    response = client.get('/api/applications/analytics')
+    assert response.status_code == 200
+    return response.get_json()['analytics']
+
+
+def test_the_endpoint_only_reads_and_the_background_pass_applies_changes(app, client):
+    user = register(client)
+    with app.app_context():
+        mcb.db.session.add(mcb.Application(user_id=user['id'], name='MIT', status='Submitted', progress=80))
+        mcb.db.session.commit()
+
+    assert analytics(client)['user']['applications'] == 0
+
+    with app.app_context():
+        mcb.application_rollups.refresh_pending(mcb.db.engine)
+    figures = analytics(client)
+    assert figures['user']['applications'] == 1
+    assert figures['user']['status_counts'] == {'Submitted': 1}
+    assert figures['cohort']['users'] == 1
+
+
+def test_the_endpoint_does_not_start_a_refresher_when_it_is_off(app, client):
+    register(client)
+    analytics(client)
+    assert mcb.application_rollups._thread is None
+
+
+class NoLock:
+    def __enter__(self):
+        raise AssertionError('start() took the lock with the refresher already running')
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_the_endpoint_starts_one_refresher_per_process_and_then_only_checks_it(app, client, monkeypatch):
+    monkeypatch.setattr(mcb, 'ANALYTICS_REFRESHER', 'thread')
+    register(client)
+    refresher = mcb.application_rollups
+    try:
+        analytics(client)
+        thread = refresher._thread
+        assert thread.is_alive()
+
+        monkeypatch.setattr(refresher, '_lock', NoLock())
+        for _ in range(3):
+            analytics(client)
+        assert refresher._thread is thread
+    finally:
+        refresher.stop()
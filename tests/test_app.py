@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+
+import sqlalchemy as sa
+
+import app as mcb
+from conftest import ROOT
+
+CHILD = r'''
+import json, sys
+import app as mcb
+flask_app = mcb.create_app()
+print(json.dumps({
+    'engines': len(mcb.db.created_engines()),
+    'modules': [m for m in ('sqlite3', 'psycopg2', 'authlib', 'requests') if m in sys.modules],
+    'google': 'mcb.google_oauth' in flask_app.extensions,
+}))
+'''
+
+
+def test_create_app_creates_no_engines_and_imports_no_drivers(tmp_path):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + str(tmp_path / 'cold.db'), FLASK_SKIP_DOTENV='1',
+               GOOGLE_CLIENT_ID='id', GOOGLE_CLIENT_SECRET='secret')
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    assert json.loads(output.strip().splitlines()[-1]) == {'engines': 0, 'modules': [], 'google': False}
+    assert not (tmp_path / 'cold.db').exists()
+
+
+def test_init_db_creates_the_schema_and_is_safe_to_rerun(tmp_path):
+    app = mcb.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'cli.db')})
+    runner = app.test_cli_runner()
+    try:
+        for _ in range(2):
+            result = runner.invoke(args=['init-db'])
+            assert result.exit_code == 0, result.output
+            assert 'Database schema is up to date' in result.output
+        with app.app_context():
+            tables = set(sa.inspect(mcb.db.engine).get_table_names())
+        assert {'user', 'application', 'email_outbox', 'server_session', 'application_rollup'} <= tables
+    finally:
+        with app.app_context():
+            for engine in mcb.db.engines.values():
+                engine.dispose()
+
+
+def test_warmup_reports_each_step(tmp_path):
+    app = mcb.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'warm.db')})
+    try:
+        result = app.test_cli_runner().invoke(args=['warmup'])
+        assert result.exit_code == 0, result.output
+        steps = [line.split(':')[0] for line in result.output.splitlines() if line.endswith(' ms')]
+        # No OIDC step: Google sign-in isn't configured
+        assert steps == ['schema', 'db_connect', 'hash_pool']
+    finally:
+        with app.app_context():
+            for engine in mcb.db.engines.values():
+                engine.dispose()
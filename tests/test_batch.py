@@ -0,0 +1,126 @@
+import json
+import time
+
+import pytest
+
+import app as mcb
+from conftest import register
+
+
+@pytest.fixture
+def user(client):
+    return register(client)
+
+
+def batch(client, *items, parallel=False, status=200):
+    response = client.post('/api/batch', json={'requests': list(items), 'parallel': parallel})
+    assert response.status_code == status, response.get_data(as_text=True)
+    return response.get_json()
+
+
+def statuses(body):
+    return {item['id']: item['status'] for item in body['responses']}
+
+
+def test_items_run_through_the_routes_with_their_own_status(client, user):
+    body = batch(client,
+                 {'id': 'me', 'path': '/api/users/%d' % user['id']},
+                 {'id': 'missing', 'path': '/api/users/999'},
+                 {'id': 'wrong-method', 'method': 'DELETE', 'path': '/api/schools'},
+                 {'id': 'no-route', 'path': '/api/nothing-here'},
+                 {'id': 'write', 'method': 'PUT', 'path': '/api/users/%d' % user['id'], 'body': {'name': 'Al'}})
+
+    assert [item['id'] for item in body['responses']] == ['me', 'missing', 'wrong-method', 'no-route', 'write']
+    assert statuses(body) == {'me': 200, 'missing': 404, 'wrong-method': 405, 'no-route': 404, 'write': 200}
+    me = body['responses'][0]
+    assert me['body']['user']['email'] == 'alice@example.com'
+    assert me['headers']['Content-Type'] == 'application/json'
+    assert body['responses'][4]['body']['user']['name'] == 'Al'
+
+
+def test_items_share_the_outer_session(client, user):
+    body = batch(client,
+                 {'id': 'before', 'path': '/api/users'},
+                 {'id': 'logout', 'path': '/logout'},
+                 {'id': 'after', 'path': '/api/users'})
+
+    assert statuses(body) == {'before': 200, 'logout': 200, 'after': 302}
+    # The batch's own response saved the logout
+    assert client.get('/api/users').status_code == 302
+
+
+def test_a_logged_out_batch_is_rejected_once(app):
+    response = app.test_client().post('/api/batch', json={'requests': [{'path': '/api/users'}] * 3})
+
+    assert response.status_code == 302
+    assert b'responses' not in response.get_data()
+
+
+def test_nested_batches_are_refused(client, user):
+    for path in ('/api/batch', '/api/batch/', '/api/batch?x=1'):
+        body = batch(client, {'path': '/api/schools'}, {'method': 'POST', 'path': path}, status=400)
+        assert body == {'error': 'Request 1: batches cannot be nested'}
+
+
+@pytest.mark.parametrize('payload, error', [
+    ({'requests': []}, '"requests" is empty'),
+    ([], 'Body must be a JSON object with a "requests" list'),
+    ({'requests': [{'path': 'api/users'}]}, 'Request 0: "path" must be an absolute path'),
+    ({'requests': [{'method': 'TRACE', 'path': '/'}]}, 'Request 0: unsupported method TRACE'),
+])
+def test_invalid_batches_are_a_400(client, user, payload, error):
+    response = client.post('/api/batch', json=payload)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
+
+
+def test_too_many_items_is_a_413(client, user, monkeypatch):
+    monkeypatch.setattr(mcb.batch_dispatcher, 'max_requests', 2)
+    body = batch(client, *[{'path': '/api/schools'}] * 3, status=413)
+    assert body == {'error': 'At most 2 requests per batch'}
+
+
+def test_a_body_over_the_size_limit_is_a_413(client, user, monkeypatch):
+    monkeypatch.setattr(mcb, 'BATCH_MAX_BODY_BYTES', 100)
+    batch(client, *[{'id': 'x' * 50, 'path': '/api/schools'}] * 3, status=413)
+
+
+def test_items_past_the_response_size_limit_are_a_413(client, user, monkeypatch):
+    monkeypatch.setattr(mcb.batch_dispatcher, 'max_response_bytes', 250)
+    body = batch(client, *[{'id': i, 'path': '/api/schools'} for i in range(5)])
+
+    codes = [item['status'] for item in body['responses']]
+    assert codes[0] == 200 and codes[-1] == 413
+    assert codes == sorted(codes)
+    assert body['responses'][-1]['body'] == {'error': 'Batch response size limit exceeded'}
+
+
+def test_parallel_items_not_done_in_time_are_a_504(app, client, user, monkeypatch):
+    monkeypatch.setattr(mcb.batch_dispatcher, 'timeout', 0.2)
+
+    def slow():
+        time.sleep(0.6)
+        return {'slow': True}
+
+    monkeypatch.setitem(app.view_functions, 'mcb.api_mentor', slow)
+    body = batch(client, {'id': 'fast', 'path': '/api/schools'}, {'id': 'slow', 'path': '/api/mentor'},
+                 parallel=True)
+
+    assert statuses(body) == {'fast': 200, 'slow': 504}
+    assert body['responses'][1]['body'] == {'error': 'Batch time limit exceeded'}
+    # Let the abandoned item finish before the test's database goes away
+    time.sleep(0.5)
+
+
+def test_parallel_items_reuse_the_batch_requests_user(client, user):
+    body = batch(client, *[{'id': i, 'path': '/api/users/%d' % user['id']} for i in range(4)], parallel=True)
+    assert set(statuses(body).values()) == {200}
+    assert {json.dumps(item['body']) for item in body['responses']} == {json.dumps(body['responses'][0]['body'])}
+
+
+def test_a_parallel_batch_with_writes_runs_in_order(client, user):
+    body = batch(client,
+                 {'id': 'rename', 'method': 'PUT', 'path': '/api/users/%d' % user['id'], 'body': {'name': 'Al'}},
+                 {'id': 'read', 'path': '/api/users/%d' % user['id']},
+                 parallel=True)
+    assert body['responses'][1]['body']['user']['name'] == 'Al'
@@ -0,0 +1,126 @@
+import gzip
+
+import brotli
+import pytest
+import zstandard
+from flask import Flask, Response, jsonify
+
+from httpcompress import ResponseCompressor
+
+BIG = {'rows': ['row %d' % i for i in range(200)]}
+
+
+@pytest.fixture
+def compressor():
+    return ResponseCompressor(min_size=1024)
+
+
+@pytest.fixture
+def client(compressor):
+    flask_app = Flask(__name__)
+    compressor.init_app(flask_app)
+
+    @flask_app.route('/big')
+    def big():
+        response = jsonify(BIG)
+        response.set_etag('abc')
+        return response
+
+    @flask_app.route('/small')
+    def small():
+        return jsonify({'ok': True})
+
+    @flask_app.route('/fast')
+    @compressor.levels(br=1, gzip=0)
+    def fast():
+        return jsonify(BIG)
+
+    @flask_app.route('/missing')
+    def missing():
+        return jsonify(BIG), 404
+
+    @flask_app.route('/image')
+    def image():
+        return Response(b'\0' * 4096, mimetype='image/png')
+
+    @flask_app.route('/stream')
+    def stream():
+        return Response((line for line in [b'{}\n'] * 1000), mimetype='application/x-ndjson')
+
+    return flask_app.test_client()
+
+
+def decode(response):
+    return {
+        'br': brotli.decompress,
+        'zstd': zstandard.ZstdDecompressor().decompress,
+        'gzip': gzip.decompress,
+    }[response.headers['Content-Encoding']](response.get_data())
+
+
+@pytest.mark.parametrize('accept, encoding', [
+    ('gzip', 'gzip'),
+    ('gzip, br', 'br'),
+    ('gzip, zstd', 'zstd'),
+    ('*', 'br'),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('br;q=0.5, zstd;q=0.8, gzip;q=0.1', 'zstd'),
+    ('br;q=0, gzip;q=0.2', 'gzip'),
+])
+def test_the_best_q_value_wins_with_ties_to_the_preference_order(client, accept, encoding):
+    response = client.get('/big', headers={'Accept-Encoding': accept})
+    assert response.headers['Content-Encoding'] == encoding
+    assert decode(response) == client.get('/big').get_data()
+
+
+@pytest.mark.parametrize('accept', ['identity', 'deflate', 'br;q=0, zstd;q=0, gzip;q=0'])
+def test_nothing_acceptable_is_sent_as_is(client, accept):
+    response = client.get('/big', headers={'Accept-Encoding': accept})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json() == BIG
+
+
+def test_bodies_under_the_minimum_size_are_sent_as_is(client, compressor):
+    small = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+    compressor.min_size = 1
+    assert client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers['Content-Encoding'] == 'gzip'
+
+
+def test_per_view_levels_override_and_disable(client):
+    response = client.get('/fast', headers={'Accept-Encoding': 'gzip, br'})
+    plain = client.get('/fast').get_data()
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.get_data() == brotli.compress(plain, quality=1)
+
+    # gzip=0 turns gzip off for this view only
+    assert 'Content-Encoding' not in client.get('/fast', headers={'Accept-Encoding': 'gzip'}).headers
+    assert client.get('/big', headers={'Accept-Encoding': 'gzip'}).get_data() == gzip.compress(
+        client.get('/big').get_data(), compresslevel=6, mtime=0)
+
+
+def test_compressible_responses_vary_on_accept_encoding(client):
+    for path in ('/big', '/small', '/missing'):
+        assert 'Accept-Encoding' in client.get(path).headers['Vary']
+    assert 'Vary' not in client.get('/image', headers={'Accept-Encoding': 'gzip'}).headers
+
+
+def test_errors_streams_and_other_mimetypes_are_sent_as_is(client):
+    for path in ('/missing', '/image', '/stream'):
+        assert 'Content-Encoding' not in client.get(path, headers={'Accept-Encoding': 'gzip'}).headers
+
+
+def test_the_etag_gets_the_encoding_as_a_suffix(client):
+    assert client.get('/big').headers['ETag'] == '"abc"'
+    assert client.get('/big', headers={'Accept-Encoding': 'br'}).headers['ETag'] == '"abc:br"'
+    assert client.get('/big', headers={'Accept-Encoding': 'gzip'}).headers['ETag'] == '"abc:gzip"'
+
+
+def test_identical_bodies_are_compressed_once(client, compressor):
+    first = client.get('/big', headers={'Accept-Encoding': 'gzip'}).get_data()
+    second = client.get('/big', headers={'Accept-Encoding': 'gzip'}).get_data()
+
+    assert first == second
+    assert compressor.cache.stats()['hits'] == 1
+    assert compressor.cache.stats()['misses'] == 1
@@ -0,0 +1,53 @@
+import pytest
+import sqlalchemy as sa
+
+import app as mcb
+import dbrouting
+import sessions
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    url = 'sqlite:///' + str(tmp_path / 'test.db')
+    app = mcb.create_app({
+        'SESSION_COOKIE_SECURE': False,
+        'SQLALCHEMY_DATABASE_URI': url,
+        # The primary's file doubles as the replica
+        'SQLALCHEMY_BINDS': {dbrouting.REPLICA_BIND: url},
+    })
+    with app.app_context():
+        mcb.init_db()
+    yield app
+    with app.app_context():
+        mcb.db.session.remove()
+        for engine in mcb.db.engines.values():
+            engine.dispose()
+    # The extension keeps a metadata per bind key; other apps have no replica bind
+    mcb.db.metadatas.pop(dbrouting.REPLICA_BIND, None)
+
+
+def session_rows(app):
+    with app.app_context(), mcb.db.engine.connect() as conn:
+        return conn.execute(sa.select(sa.func.count()).select_from(sessions.session_table)).scalar()
+
+
+def test_an_anonymous_write_sticks_to_the_primary_without_a_session_record(replica_app):
+    client = replica_app.test_client()
+    response = client.post('/forgot-password', json={'email': 'nobody@example.com'})
+
+    assert response.status_code == 200
+    assert client.get_cookie(dbrouting.STICKY_COOKIE) is not None
+    assert client.get_cookie('session') is None
+    assert session_rows(replica_app) == 0
+
+
+def test_reads_go_to_the_primary_while_the_cookie_is_current(replica_app):
+    with replica_app.test_request_context('/api/users'):
+        assert dbrouting._reads_from_replica()
+    with replica_app.test_request_context('/api/users', headers={'Cookie': '%s=%s' % (
+            dbrouting.STICKY_COOKIE, '9999999999')}):
+        assert not dbrouting._reads_from_replica()
+    with replica_app.test_request_context('/api/users', headers={'Cookie': '%s=1' % dbrouting.STICKY_COOKIE}):
+        assert dbrouting._reads_from_replica()
+    with replica_app.test_request_context('/api/users', headers={'Cookie': '%s=junk' % dbrouting.STICKY_COOKIE}):
+        assert dbrouting._reads_from_replica()
@@ -0,0 +1,152 @@
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+import app as mcb
+import deadlines
+import deltasync
+from conftest import register
+
+TODAY = date(2026, 3, 1)
+
+
+@pytest.fixture
+def alice(client):
+    return register(client)
+
+
+@pytest.fixture
+def clock():
+    return {'today': TODAY}
+
+
+@pytest.fixture
+def index(app, clock):
+    return deadlines.DeadlineIndex(mcb.Application.__table__, today=lambda: clock['today'])
+
+
+def add(app, user_id, name, days, status='Draft'):
+    with app.app_context():
+        application = mcb.Application(user_id=user_id, name=name, status=status,
+                                      deadline=TODAY + timedelta(days=days))
+        mcb.db.session.add(application)
+        mcb.db.session.commit()
+        return application.id
+
+
+def refresh(app, index, **kwargs):
+    with app.app_context():
+        index.refresh(mcb.db.engine, **kwargs)
+
+
+def due(index, user_id, days=30):
+    return [(item['name'], item['days_left']) for item in index.due(user_id, days)]
+
+
+def test_a_write_shows_up_on_the_refresh_after_mark_stale(app, index, alice):
+    add(app, alice['id'], 'MIT', 10)
+    refresh(app, index)
+    assert due(index, alice['id']) == [('MIT', 10)]
+
+    add(app, alice['id'], 'Yale', 3)
+    refresh(app, index)
+    # Within DEADLINE_REFRESH_SECONDS and not marked stale: the index isn't reloaded
+    assert due(index, alice['id']) == [('MIT', 10)]
+
+    index.mark_stale()
+    refresh(app, index)
+    assert due(index, alice['id']) == [('Yale', 3), ('MIT', 10)]
+
+
+def test_updates_and_deletes_are_applied_incrementally(app, index, alice):
+    mit, yale = add(app, alice['id'], 'MIT', 10), add(app, alice['id'], 'Yale', 3)
+    refresh(app, index)
+
+    with app.app_context():
+        table = mcb.Application.__table__
+        mcb.db.session.execute(table.update().where(table.c.id == mit).values(deadline=TODAY + timedelta(days=1)))
+        deltasync.delete_where(mcb.db.session, table, 'application', table.c.id == yale,
+                               owner_column=table.c.user_id)
+        mcb.db.session.commit()
+    refresh(app, index, force=True)
+
+    assert due(index, alice['id']) == [('MIT', 1)]
+    assert len(index) == 1
+
+
+def test_the_index_is_rebuilt_when_the_day_changes(app, index, clock, alice, monkeypatch):
+    monkeypatch.setattr(deadlines, 'HORIZON_DAYS', 10)
+    add(app, alice['id'], 'Today', 0)
+    add(app, alice['id'], 'Later', 11)
+    refresh(app, index)
+    assert due(index, alice['id']) == [('Today', 0)]
+
+    clock['today'] = TODAY + timedelta(days=1)
+    # No mark_stale() and well within the refresh interval: the new day alone rebuilds
+    refresh(app, index)
+    assert due(index, alice['id']) == [('Later', 10)]
+
+
+def test_other_users_deadlines_stay_separate(app, index, alice):
+    bob = register(app.test_client(), email='bob@example.com', name='Bob')
+    add(app, alice['id'], 'MIT', 5)
+    add(app, bob['id'], 'Yale', 5)
+    refresh(app, index)
+
+    assert due(index, alice['id']) == [('MIT', 5)]
+    assert due(index, bob['id']) == [('Yale', 5)]
+    assert due(index, alice['id'], days=4) == []
+
+
+def test_reminders_fire_once_per_window(app, index, clock, alice):
+    add(app, alice['id'], 'MIT', 9)
+    add(app, alice['id'], 'Done', 1, status='Submitted')
+    refresh(app, index)
+    tracker = deadlines.ReminderTracker(index, alice['id'], windows=(7, 1, 0))
+
+    assert tracker.snapshot() == []
+    for day, expected in ((2, [('MIT', 7)]), (2, []), (3, []), (8, [('MIT', 1)]), (8, []), (9, [('MIT', 0)])):
+        clock['today'] = TODAY + timedelta(days=day)
+        refresh(app, index)
+        assert [(r['name'], r['window']) for r in tracker.reminders()] == expected, day
+
+
+def test_a_new_application_inside_a_window_is_a_reminder(app, index, alice):
+    add(app, alice['id'], 'MIT', 5)
+    refresh(app, index)
+    tracker = deadlines.ReminderTracker(index, alice['id'], windows=(7, 1, 0))
+    assert [item['name'] for item in tracker.snapshot()] == ['MIT']
+    assert tracker.reminders() == []
+
+    add(app, alice['id'], 'Yale', 1)
+    index.mark_stale()
+    refresh(app, index)
+    assert [(r['name'], r['window']) for r in tracker.reminders()] == [('Yale', 1)]
+    assert tracker.reminders() == []
+
+
+def test_the_stream_opens_with_the_current_deadlines(app, client, alice, monkeypatch):
+    monkeypatch.setattr(mcb, 'DEADLINE_STREAM_SECONDS', 0)
+    monkeypatch.setattr(mcb, '_deadline_streams', threading.BoundedSemaphore(1))
+    add(app, alice['id'], 'MIT', (date.today() - TODAY).days + 2)
+
+    response = client.get('/api/deadlines/stream')
+
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert body.startswith('retry: 10000\n\nevent: deadlines\ndata: ')
+    assert '"name":"MIT"' in body.replace(' ', '')
+    # Closing the response gives its slot back
+    response.close()
+    assert mcb._deadline_streams.acquire(blocking=False)
+
+
+def test_streams_past_the_limit_are_a_503(client, alice, monkeypatch):
+    monkeypatch.setattr(mcb, '_deadline_streams', threading.BoundedSemaphore(1))
+    mcb._deadline_streams.acquire()
+
+    response = client.get('/api/deadlines/stream')
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '30'
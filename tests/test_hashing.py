@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+import hashing
+
+
+@pytest.fixture
+def small_queue(monkeypatch):
+    monkeypatch.setattr(hashing, 'MAX_PENDING', 4)
+    monkeypatch.setattr(hashing, 'TIMEOUT', 0.2)
+
+
+def test_inline_mode_admits_hashes():
+    assert hashing.POOL_WORKERS == 0
+    password_hash = hashing.hash_password('secret123')
+    assert hashing.verify_password(password_hash, 'secret123') == (True, False)
+    assert hashing.queue_depth() == 0
+
+
+def test_a_full_queue_rejects_single_hashes(small_queue):
+    hashing._admit(4)
+    try:
+        with pytest.raises(hashing.HashPoolBusy):
+            hashing.hash_password('secret123')
+    finally:
+        hashing._release(4)
+    assert hashing.queue_depth() == 0
+
+
+def test_bulk_hashes_count_in_the_queue_and_leave_room_for_logins(small_queue, monkeypatch):
+    depths = []
+    real = hashing.generate_password_hash
+
+    def observe(password, method):
+        depths.append(hashing.queue_depth())
+        # A login still gets a slot while the import holds its slice
+        hashing._admit(1)
+        hashing._release(1)
+        return real(password, method)
+
+    monkeypatch.setattr(hashing, 'generate_password_hash', observe)
+    hashes = hashing.hash_passwords(['p%d' % i for i in range(5)])
+
+    assert len(hashes) == 5
+    assert depths and max(depths) == 1
+    assert hashing.queue_depth() == 0
+
+
+def test_bulk_hashes_wait_for_free_slots_then_give_up(small_queue):
+    hashing._admit(4)
+    timer = threading.Timer(0.05, hashing._release, (4,))
+    timer.start()
+    assert len(hashing.hash_passwords(['a', 'b'])) == 2
+
+    hashing._admit(4)
+    try:
+        with pytest.raises(hashing.HashPoolBusy):
+            hashing.hash_passwords(['a'])
+    finally:
+        hashing._release(4)
+    assert hashing.queue_depth() == 0
+
+
+@pytest.fixture
+def one_process(monkeypatch):
+    monkeypatch.setattr(hashing, 'POOL_WORKERS', 1)
+    monkeypatch.setattr(hashing, '_executor', None)
+
+
+def test_a_timed_out_hash_is_busy_and_keeps_its_slot_until_it_finishes(small_queue, one_process):
+    try:
+        with pytest.raises(hashing.HashPoolBusy):
+            hashing._run(time.sleep, 1.0)
+        assert hashing.queue_depth() == 1
+        deadline = time.monotonic() + 5
+        while hashing.queue_depth() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert hashing.queue_depth() == 0
+    finally:
+        hashing._executor.shutdown()
+
+
+def test_a_hash_timing_out_in_the_queue_is_cancelled_and_frees_its_slot(small_queue, one_process):
+    try:
+        # One sleeper runs and up to two wait in the executor's call queue; the next can still be cancelled
+        hashing._admit(3)
+        running = [hashing._submit(time.sleep, 0.3) for _ in range(3)]
+        with pytest.raises(hashing.HashPoolBusy):
+            hashing._run(time.sleep, 0.3)
+        assert hashing.queue_depth() == 3
+        for future in running:
+            future.result()
+        assert hashing.queue_depth() == 0
+    finally:
+        hashing._executor.shutdown()
+
+
+def slow_hash(password, method):
+    time.sleep(0.6)
+    return password
+
+
+def test_bulk_hashes_that_time_out_are_busy(small_queue, one_process, monkeypatch):
+    monkeypatch.setattr(hashing, 'generate_password_hash', slow_hash)
+    try:
+        with pytest.raises(hashing.HashPoolBusy):
+            hashing.hash_passwords(['a', 'b'])
+        deadline = time.monotonic() + 5
+        while hashing.queue_depth() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert hashing.queue_depth() == 0
+    finally:
+        hashing._executor.shutdown()
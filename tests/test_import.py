@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+import app as mcb
+import hashing
+from conftest import register
+
+
+def ndjson(rows):
+    return '\n'.join(json.dumps(row) for row in rows)
+
+
+def user_rows(n, start=1):
+    return [{'email': 'user%d@example.com' % i, 'password': 'secret123', 'name': 'User %d' % i}
+            for i in range(start, start + n)]
+
+
+def emails_in_db(app):
+    with app.app_context():
+        return set(mcb.db.session.scalars(mcb.db.select(mcb.User.email)))
+
+
+@pytest.fixture
+def signed_in(client):
+    register(client)
+    return client
+
+
+def test_import_reports_created_duplicate_and_error_rows(app, signed_in):
+    rows = user_rows(2) + [{'email': 'USER1@example.com', 'password': 'x', 'name': 'Again'},
+                           {'email': 'alice@example.com', 'password': 'x', 'name': 'Existing'},
+                           {'email': 'nopassword@example.com', 'name': 'No password'}]
+    response = signed_in.post('/api/users/import', data=ndjson(rows), content_type='application/x-ndjson')
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['summary'] == {'created': 2, 'duplicate': 2, 'error': 1, 'rejected': 0}
+    assert [r['status'] for r in body['results']] == ['created', 'created', 'duplicate', 'duplicate', 'error']
+    assert emails_in_db(app) == {'alice@example.com', 'user1@example.com', 'user2@example.com'}
+
+
+def test_import_over_the_row_limit_reports_exactly_what_was_written(app, signed_in, monkeypatch):
+    monkeypatch.setattr(mcb, 'BULK_IMPORT_MAX_ROWS', 3)
+    monkeypatch.setattr(mcb, 'BULK_IMPORT_CHUNK', 2)
+    response = signed_in.post('/api/users/import', data=ndjson(user_rows(5)), content_type='application/x-ndjson')
+
+    assert response.status_code == 413
+    body = response.get_json()
+    assert body['error'] == 'Import is limited to 3 rows'
+    assert body['summary'] == {'created': 3, 'duplicate': 0, 'error': 0, 'rejected': 2}
+    created = {r['email'] for r in body['results'] if r['status'] == 'created'}
+    assert created == emails_in_db(app) - {'alice@example.com'}
+
+
+def test_import_csv(app, signed_in):
+    csv_body = 'email,password,name,is_premium\ncsv@example.com,secret123,Csv,yes\n'
+    response = signed_in.post('/api/users/import', data=csv_body, content_type='text/csv')
+
+    assert response.status_code == 200
+    assert response.get_json()['summary']['created'] == 1
+    with app.app_context():
+        assert mcb.user_by_email('csv@example.com').is_premium
+
+
+def test_import_while_the_hash_pool_is_busy_writes_nothing_it_reports_as_rejected(app, signed_in, monkeypatch):
+    monkeypatch.setattr(mcb, 'BULK_IMPORT_CHUNK', 2)
+    calls = []
+
+    def busy_after_first_chunk(passwords):
+        calls.append(len(passwords))
+        if len(calls) > 1:
+            raise hashing.HashPoolBusy()
+        return ['hash-%d' % i for i in range(len(passwords))]
+
+    monkeypatch.setattr(mcb, 'hash_passwords', busy_after_first_chunk)
+    response = signed_in.post('/api/users/import', data=ndjson(user_rows(5)), content_type='application/x-ndjson')
+
+    assert response.status_code == 503
+    body = response.get_json()
+    assert body['summary'] == {'created': 2, 'duplicate': 0, 'error': 0, 'rejected': 3}
+    assert [r['status'] for r in body['results']] == ['created', 'created', 'rejected', 'rejected']
+    assert emails_in_db(app) == {'alice@example.com', 'user1@example.com', 'user2@example.com'}
+
+
+def test_an_email_registered_in_another_case_during_the_import_is_a_duplicate(app, signed_in, monkeypatch):
+    real = mcb.hash_passwords
+
+    def register_meanwhile(passwords):
+        # After the import's duplicate check, before its insert
+        app.test_client().post('/api/register', json={'email': 'USER2@Example.com', 'password': 'secret123',
+                                                      'name': 'Racer'})
+        return real(passwords)
+
+    monkeypatch.setattr(mcb, 'hash_passwords', register_meanwhile)
+    response = signed_in.post('/api/users/import', data=ndjson(user_rows(3)), content_type='application/x-ndjson')
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [r['status'] for r in body['results']] == ['created', 'duplicate', 'created']
+    assert emails_in_db(app) == {'alice@example.com', 'user1@example.com', 'USER2@Example.com', 'user3@example.com'}
+
+
+@pytest.mark.parametrize('content_type, body', [
+    ('application/x-ndjson', b'{"email": "a@example.com", "password": "p", "name": "A"}\n'
+                             b'{"email": "b@example.com", "password": "p", "name": "\xff"}\n'),
+    ('text/csv', b'email,password,name\na@example.com,p,A\nb@example.com,p,\xe9\n'),
+])
+def test_rows_that_are_not_utf8_are_reported_not_a_500(app, signed_in, content_type, body):
+    response = signed_in.post('/api/users/import', data=body, content_type=content_type)
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == ['created', 'error']
+    assert results[1]['error'] == 'Not valid UTF-8'
+    assert emails_in_db(app) == {'alice@example.com', 'a@example.com'}
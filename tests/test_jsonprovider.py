@@ -0,0 +1,82 @@
+import json
+import uuid
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+
+import pytest
+
+import app as mcb
+from conftest import register
+from jsonprovider import FastJSONProvider
+
+
+@pytest.fixture
+def providers(app):
+    orjson_provider, stdlib_provider = FastJSONProvider(app), FastJSONProvider(app)
+    orjson_provider.backend, stdlib_provider.backend = 'orjson', 'stdlib'
+    for provider in (orjson_provider, stdlib_provider):
+        provider.register(mcb.User, mcb.User.to_dict)
+        provider.register(mcb.Application, mcb.Application.to_dict)
+    return orjson_provider, stdlib_provider
+
+
+@pytest.fixture
+def document(app, client):
+    user = register(client)
+    with app.app_context():
+        mcb.db.session.add(mcb.Application(user_id=user['id'], name='MIT', deadline=date(2026, 11, 1)))
+        mcb.db.session.commit()
+        rows = mcb.db.session.execute(mcb.db.select(mcb.User.id, mcb.User.email, mcb.User.created_at)).all()
+        yield {
+            'rows': rows,
+            'row': rows[0],
+            'user': mcb.db.session.get(mcb.User, user['id']),
+            'application': mcb.db.session.get(mcb.Application, 1),
+            'datetime': datetime(2026, 3, 1, 9, 30, 15, 123456),
+            'aware': datetime(2026, 3, 1, 9, 30, tzinfo=timezone.utc),
+            'date': date(2026, 3, 1),
+            'time': time(9, 30),
+            'decimal': Decimal('1.50'),
+            'uuid': uuid.UUID(int=1),
+            'nested': [{'b': 1, 'a': [None, True, 2.5]}],
+        }
+
+
+def test_both_backends_send_the_same_bytes(app, providers, document):
+    orjson_provider, stdlib_provider = providers
+    with app.app_context():
+        fast = orjson_provider.response(document).get_data()
+        slow = stdlib_provider.response(document).get_data()
+
+    assert fast == slow
+    body = json.loads(fast)
+    assert body['datetime'] == '2026-03-01T09:30:15.123456'
+    assert body['aware'] == '2026-03-01T09:30:00+00:00'
+    assert (body['date'], body['time']) == ('2026-03-01', '09:30:00')
+    assert body['row'] == {'id': 1, 'email': 'alice@example.com', 'created_at': body['row']['created_at']}
+    assert body['rows'] == [body['row']]
+    assert body['user']['email'] == 'alice@example.com'
+    assert body['application']['deadline'] == '2026-11-01'
+    assert (body['decimal'], body['uuid']) == ('1.50', str(uuid.UUID(int=1)))
+
+
+def test_both_backends_dump_the_same_document(app, providers, document):
+    orjson_provider, stdlib_provider = providers
+    fast = orjson_provider.dumps(document)
+    assert fast == stdlib_provider.dumps(document, separators=(',', ':'))
+    # Other arguments go to the stdlib
+    assert orjson_provider.dumps(document, indent=2) == stdlib_provider.dumps(document, indent=2)
+
+
+def test_non_ascii_text_decodes_the_same(app, providers):
+    orjson_provider, stdlib_provider = providers
+    document = {'name': 'Zoë – 東京'}
+    with app.app_context():
+        assert json.loads(orjson_provider.response(document).get_data()) == json.loads(
+            stdlib_provider.response(document).get_data()) == document
+
+
+def test_unknown_types_fail_on_both_backends(app, providers):
+    for provider in providers:
+        with pytest.raises(TypeError):
+            provider.dumps({'x': object()})
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(metrics, '_store', None)
+    yield tmp_path
+    if metrics._store is not None:
+        metrics._store.close()
+
+
+def serve(requests):
+    for duration in requests:
+        metrics.observe_request('mcb.api_users', 'GET', 200, duration)
+    metrics.inc('mcb_compression_bytes_total', (('algorithm', 'br'), ('stage', 'in')), 1000)
+    metrics.set_gauge('mcb_db_pool_checked_out', 3)
+
+
+def run_worker(requests):
+    worker = multiprocessing.get_context('fork').Process(target=serve, args=(requests,))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+    return worker.pid
+
+
+REQUESTS = 'mcb_http_requests_total{endpoint="mcb.api_users",method="GET",status="200"}'
+FAST = 'mcb_http_request_duration_seconds_bucket{endpoint="mcb.api_users",le="0.01"}'
+SLOW = 'mcb_http_request_duration_seconds_bucket{endpoint="mcb.api_users",le="1.0"}'
+BYTES = 'mcb_compression_bytes_total{algorithm="br",stage="in"}'
+GAUGE = 'mcb_db_pool_checked_out'
+
+
+def test_counters_and_histograms_are_summed_across_process_files(metrics_dir):
+    pids = [run_worker([0.008, 0.9]), run_worker([0.008])]
+    serve([0.9])
+
+    totals = metrics.collect()
+
+    assert len(list(metrics_dir.glob('metrics_*.db'))) == 3
+    assert (totals[REQUESTS], totals[FAST], totals[SLOW], totals[BYTES]) == (4, 2, 2, 3000)
+    # Only this process is alive
+    assert totals[GAUGE] == 3
+    assert all(not metrics._pid_alive(pid) for pid in pids)
+
+
+def test_an_exited_workers_samples_survive_the_removal_of_its_file(metrics_dir):
+    serve([0.9])
+    for _ in range(2):
+        pids = [run_worker([0.008, 0.9]), run_worker([0.008])]
+        before = metrics.render()
+        for pid in pids:
+            metrics.mark_process_dead(pid)
+            assert not (metrics_dir / ('metrics_%d.db' % pid)).exists()
+        assert metrics.render() == before
+
+    totals = metrics.collect()
+    assert (totals[REQUESTS], totals[FAST], totals[SLOW], totals[BYTES]) == (7, 4, 3, 5000)
+    assert totals[GAUGE] == 3
+    assert sorted(p.name for p in metrics_dir.glob('*.db')) == sorted(
+        [metrics.DEAD_WORKERS_FILE, 'metrics_%d.db' % os.getpid()])
+
+
+def test_marking_an_unknown_process_dead_does_nothing(metrics_dir):
+    metrics.mark_process_dead(1)
+    assert not (metrics_dir / metrics.DEAD_WORKERS_FILE).exists()
+
+
+def test_clear_removes_the_dead_workers_file(metrics_dir):
+    metrics.mark_process_dead(run_worker([0.008]))
+    metrics.clear()
+    assert metrics.collect() == {}
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+from urllib.parse import urlparse
+
+import pytest
+import requests
+
+import app as mcb
+import oidc
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from oidc_stub import StubOIDCProvider  # noqa: E402
+
+
+@pytest.fixture
+def provider():
+    provider = StubOIDCProvider().start()
+    yield provider
+    provider.stop()
+
+
+@pytest.fixture
+def google_app(app, provider, monkeypatch):
+    monkeypatch.setattr(mcb, 'GOOGLE_DISCOVERY_URL', provider.discovery_url)
+    app.config.update(GOOGLE_CLIENT_ID=provider.client_id, GOOGLE_CLIENT_SECRET='stub-secret')
+    return app
+
+
+def callback_url(client):
+    """Start a Google login and let the provider authorize it; the callback path with code and state"""
+    start = client.get('/login/google')
+    authorize = requests.get(start.headers['Location'], allow_redirects=False, timeout=10)
+    callback = urlparse(authorize.headers['Location'])
+    return callback.path + '?' + callback.query
+
+
+def login(client):
+    return client.get(callback_url(client))
+
+
+def provider_calls(provider):
+    return {path: n for path, n in provider.requests.items() if path != '/authorize'}
+
+
+def wait_for_refresh(document):
+    deadline = time.monotonic() + 5
+    while document._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not document._refreshing
+
+
+def test_the_id_token_is_validated_against_the_cached_jwks(google_app, provider):
+    client = google_app.test_client()
+
+    response = login(client)
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['user']['email'] == 'stub.user@example.com'
+    assert provider_calls(provider) == {'/.well-known/openid-configuration': 1, '/jwks': 1, '/token': 1}
+
+    provider.requests.clear()
+    assert login(google_app.test_client()).status_code == 200
+    # No discovery, JWKS or UserInfo round trips once they're cached
+    assert provider_calls(provider) == {'/token': 1}
+
+
+def test_userinfo_is_only_fetched_when_the_id_token_lacks_the_email(google_app, provider):
+    provider.id_token_has_email = False
+    assert login(google_app.test_client()).status_code == 200
+    assert provider.requests['/userinfo'] == 1
+
+
+def test_an_unknown_key_id_forces_one_jwks_refresh(google_app, provider):
+    assert login(google_app.test_client()).status_code == 200
+
+    provider.rotate_key('rotated-1')
+    provider.requests.clear()
+    assert login(google_app.test_client()).status_code == 200
+    assert provider.requests['/jwks'] == 1
+
+    # Within JWKS_FORCE_REFRESH_INTERVAL an unknown key is refused without another fetch
+    provider.rotate_key('rotated-2')
+    provider.requests.clear()
+    response = login(google_app.test_client())
+    assert response.status_code == 500
+    assert provider.requests['/jwks'] == 0
+    # The reason is logged, not sent
+    assert response.get_json() == {'error': 'Google authentication failed'}
+
+
+def test_stale_documents_are_served_while_they_refresh(provider):
+    cache = oidc.OIDCCache(provider.discovery_url, ttl=3600)
+    metadata, jwks = cache.get_metadata(), cache.get_jwks()
+    cache.metadata.ttl = cache.jwks.ttl = 0
+    provider.latency = 0.3
+
+    start = time.perf_counter()
+    for _ in range(3):
+        assert cache.get_metadata() is metadata
+        assert cache.get_jwks() is jwks
+    assert time.perf_counter() - start < 0.2
+
+    # One background refresh each, however many reads saw them stale
+    deadline = time.monotonic() + 5
+    while (cache.metadata.fetches, cache.jwks.fetches) != (2, 2) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert (cache.metadata.fetches, cache.jwks.fetches) == (2, 2)
+    assert provider.requests['/.well-known/openid-configuration'] == 2
+    assert cache.get_metadata() == metadata and cache.get_metadata() is not metadata
+    # Still stale, so that read started another refresh; it must not outlive the provider
+    wait_for_refresh(cache.metadata)
+
+
+def test_a_failed_background_refresh_keeps_the_cached_copy(provider):
+    cache = oidc.OIDCCache(provider.discovery_url, ttl=0)
+    metadata = cache.get_metadata()
+    provider.stop()
+
+    assert cache.get_metadata() is metadata
+    wait_for_refresh(cache.metadata)
+    assert cache.metadata.fetches == 1
+    assert cache.get_metadata() is metadata
+    # The failing refresh logs a traceback; let it finish inside this test
+    wait_for_refresh(cache.metadata)
+
+
+def test_provider_calls_time_out(google_app, provider, monkeypatch):
+    monkeypatch.setattr(oidc, 'HTTP_TIMEOUT', (0.5, 0.1))
+    client = google_app.test_client()
+    assert login(client).status_code == 200
+
+    provider.latency = 0.5
+    url = callback_url(client)
+    start = time.perf_counter()
+    assert client.get(url).status_code == 500
+    assert time.perf_counter() - start < 0.4
+
+    with pytest.raises(requests.Timeout):
+        oidc.OIDCCache(provider.discovery_url).get_metadata()
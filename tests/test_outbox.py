@@ -0,0 +1,159 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+import sqlalchemy as sa
+
+import app as mcb
+import outbox
+from conftest import ROOT, register
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from smtp_stub import StubSMTPServer  # noqa: E402
+
+KEY = 'password_reset:alice@example.com'
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    server = StubSMTPServer().start()
+    monkeypatch.setattr(outbox, 'SMTP_HOST', '127.0.0.1')
+    monkeypatch.setattr(outbox, 'SMTP_PORT', server.port)
+    monkeypatch.setattr(outbox, 'SMTP_USE_TLS', False)
+    monkeypatch.setattr(outbox, 'SMTP_TIMEOUT', 5)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def engine(app):
+    with app.app_context():
+        yield mcb.db.engine
+
+
+@pytest.fixture
+def dispatcher(engine):
+    dispatcher = outbox.Dispatcher(engine)
+    yield dispatcher
+    dispatcher.pool.close()
+
+
+def rows(engine):
+    with engine.connect() as conn:
+        return conn.execute(sa.select(outbox.outbox_table).order_by(outbox.outbox_table.c.id)).all()
+
+
+def make_due(engine):
+    with engine.begin() as conn:
+        conn.execute(outbox.outbox_table.update().values(next_attempt_at=datetime.utcnow()))
+
+
+def test_sends_queued_emails_over_one_connection(engine, dispatcher, smtp):
+    outbox.enqueue(engine, 'alice@example.com', 'Hello', 'First')
+    outbox.enqueue(engine, 'bob@example.com', 'Hello', 'Second')
+
+    assert dispatcher.run_once() == 2
+
+    assert [m['To'] for m in smtp.messages] == ['alice@example.com', 'bob@example.com']
+    assert smtp.messages[0].get_payload().strip() == 'First'
+    assert smtp.connections == 1
+    assert [(r.status, r.attempts) for r in rows(engine)] == [('sent', 1), ('sent', 1)]
+    assert dispatcher.run_once() == 0
+
+
+def test_a_temporary_failure_is_retried_after_a_backoff(engine, dispatcher, smtp):
+    outbox.enqueue(engine, 'alice@example.com', 'Hello', 'Body')
+    smtp.fail_next()
+
+    assert dispatcher.run_once() == 1
+    [row] = rows(engine)
+    assert (row.status, row.attempts) == ('pending', 1)
+    assert '451' in row.last_error
+    assert row.next_attempt_at > row.created_at
+    assert smtp.messages == []
+    # Not due until the backoff has passed
+    assert dispatcher.run_once() == 0
+
+    make_due(engine)
+    assert dispatcher.run_once() == 1
+    [row] = rows(engine)
+    assert (row.status, row.attempts, row.last_error) == ('sent', 2, None)
+    assert len(smtp.messages) == 1
+
+
+def test_gives_up_after_the_last_attempt(engine, dispatcher, smtp, monkeypatch):
+    monkeypatch.setattr(outbox, 'MAX_ATTEMPTS', 2)
+    outbox.enqueue(engine, 'alice@example.com', 'Hello', 'Body')
+    smtp.fail_next(2)
+
+    dispatcher.run_once()
+    make_due(engine)
+    dispatcher.run_once()
+
+    [row] = rows(engine)
+    assert (row.status, row.attempts) == ('failed', 2)
+    make_due(engine)
+    assert dispatcher.run_once() == 0
+
+
+def test_pending_emails_with_one_dedupe_key_are_replaced(engine, dispatcher, smtp):
+    outbox.enqueue(engine, 'alice@example.com', 'Reset', 'Old link', dedupe_key=KEY)
+    outbox.enqueue(engine, 'alice@example.com', 'Reset', 'New link', dedupe_key=KEY)
+
+    assert len(rows(engine)) == 1
+    dispatcher.run_once()
+    assert [m.get_payload().strip() for m in smtp.messages] == ['New link']
+
+    # Once sent, the next request is a new email
+    outbox.enqueue(engine, 'alice@example.com', 'Reset', 'Later link', dedupe_key=KEY)
+    assert [r.status for r in rows(engine)] == ['sent', 'pending']
+
+
+def test_an_email_replaced_after_its_claim_is_sent_once_with_the_latest_content(engine, dispatcher, smtp):
+    outbox.enqueue(engine, 'alice@example.com', 'Reset', 'Old link', dedupe_key=KEY)
+    claimed = dispatcher._claim()
+    outbox.enqueue(engine, 'alice@example.com', 'Reset', 'New link', dedupe_key=KEY)
+
+    assert len(rows(engine)) == 1
+    dispatcher._deliver(claimed)
+    assert [m.get_payload().strip() for m in smtp.messages] == ['New link']
+    assert [r.status for r in rows(engine)] == ['sent']
+
+
+def test_an_email_replaced_while_on_the_wire_stays_pending_for_the_latest_content(engine, dispatcher, smtp):
+    outbox.enqueue(engine, 'alice@example.com', 'Reset', 'Old link', dedupe_key=KEY)
+
+    def replace_once(message):
+        smtp.on_message = None
+        outbox.enqueue(engine, 'alice@example.com', 'Reset', 'New link', dedupe_key=KEY)
+
+    smtp.on_message = replace_once
+    dispatcher.run_once()
+    [row] = rows(engine)
+    assert (row.status, row.body, row.claim_token) == ('pending', 'New link', None)
+
+    dispatcher.run_once()
+    assert [m.get_payload().strip() for m in smtp.messages] == ['Old link', 'New link']
+    assert [r.status for r in rows(engine)] == ['sent']
+
+
+def test_the_unique_index_keeps_one_pending_row_per_key(engine):
+    outbox.enqueue(engine, 'alice@example.com', 'Reset', 'Link', dedupe_key=KEY)
+    with pytest.raises(sa.exc.IntegrityError):
+        with engine.begin() as conn:
+            conn.execute(outbox.outbox_table.insert().values(
+                to_address='alice@example.com', subject='Reset', body='Twin', dedupe_key=KEY, status='pending',
+                attempts=0, next_attempt_at=datetime.utcnow(), created_at=datetime.utcnow()))
+
+
+def test_a_reset_email_goes_to_the_address_on_the_account(app, client, engine):
+    register(client, email='Alice@Example.com')
+
+    for typed in (' alice@EXAMPLE.com ', 'nobody@example.com'):
+        response = app.test_client().post('/forgot-password', json={'email': typed})
+        assert response.status_code == 200
+
+    [row] = rows(engine)
+    assert row.to_address == 'Alice@Example.com'
+    assert row.dedupe_key == KEY
@@ -0,0 +1,105 @@
+import json
+import time
+
+import pytest
+
+import profiling
+from conftest import register
+
+TOKEN = 'profile-secret'
+
+
+@pytest.fixture
+def profiled_app(request, monkeypatch, tmp_path):
+    # Before the app exists: init_app() only installs its hooks when profiling is enabled
+    monkeypatch.setattr(profiling, 'TOKEN', TOKEN)
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    monkeypatch.setattr(profiling, 'INTERVAL', 0.001)
+    monkeypatch.setattr(profiling, '_sampler', None)
+    return request.getfixturevalue('app')
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def sampled(seconds=0.1):
+    sampler = profiling.Sampler(interval=0.001)
+    profile = sampler.start()
+    busy(seconds)
+    return sampler.stop(profile)
+
+
+def test_the_sampler_records_the_calling_threads_stack():
+    profile = sampled()
+
+    assert profile.duration >= 0.1
+    assert len(profile.samples) > 10
+    # Almost every sample lands in the loop; a few may catch start() or stop()
+    assert sum(stack[-1].co_name == 'busy' for stack in profile.samples) > len(profile.samples) * 0.8
+    lines = profile.collapsed().splitlines()
+    assert any('busy (test_profiling.py:' in line for line in lines)
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == len(profile.samples)
+
+
+def test_speedscope_output_indexes_its_frames():
+    profile = sampled()
+    body = json.loads(profile.speedscope('mcb.api_users'))
+
+    frames = body['shared']['frames']
+    [sampled_profile] = body['profiles']
+    assert sampled_profile['type'] == 'sampled'
+    assert len(sampled_profile['samples']) == len(sampled_profile['weights']) == len(profile.samples)
+    assert all(0 <= i < len(frames) for stack in sampled_profile['samples'] for i in stack)
+    assert 'busy' in {frame['name'] for frame in frames}
+
+
+def test_at_most_max_active_requests_are_profiled(monkeypatch):
+    monkeypatch.setattr(profiling, 'MAX_ACTIVE', 1)
+    sampler = profiling.Sampler(interval=0.001)
+    first = sampler.start()
+    assert sampler.start() is None
+    sampler.stop(first)
+    assert sampler.stop(sampler.start()) is not None
+
+
+def test_profiles_are_unreadable_without_a_configured_token(client, monkeypatch):
+    monkeypatch.setattr(profiling, 'TOKEN', None)
+    register(client)
+
+    assert client.get('/api/profiles').status_code == 401
+    assert client.get('/api/profiles', headers={'Authorization': 'Bearer '}).status_code == 401
+    assert client.get('/api/profiles/20251001T093000-4242-000001').status_code == 401
+
+
+def test_reading_profiles_needs_the_token_even_when_signed_in(profiled_app):
+    client = profiled_app.test_client()
+    register(client)
+
+    for headers in ({}, {'Authorization': 'Bearer wrong'}, {'Authorization': TOKEN}):
+        assert client.get('/api/profiles', headers=headers).status_code == 401
+    assert client.get('/api/profiles', headers={'Authorization': 'Bearer ' + TOKEN}).status_code == 200
+
+
+def test_a_request_with_the_header_is_profiled_and_downloadable(profiled_app, monkeypatch):
+    monkeypatch.setattr(profiling, 'KEEP', 2)
+    client = profiled_app.test_client()
+    auth = {'Authorization': 'Bearer ' + TOKEN}
+
+    assert 'X-Profile-Id' not in client.get('/api/schools').headers
+    assert 'X-Profile-Id' not in client.get('/api/schools', headers={'X-Profile': 'wrong'}).headers
+    ids = [client.get('/api/schools', headers={'X-Profile': TOKEN}).headers['X-Profile-Id'] for _ in range(3)]
+
+    listed = client.get('/api/profiles', headers=auth).get_json()['profiles']
+    # Newest first, and only PROFILE_KEEP of them
+    assert [p['id'] for p in listed] == ids[:0:-1]
+    assert listed[0]['endpoint'] == 'mcb.api_schools'
+    assert listed[0]['format'] == 'speedscope'
+
+    download = client.get('/api/profiles/' + ids[-1], headers=auth)
+    assert download.status_code == 200
+    assert json.loads(download.get_data())['name'] == 'mcb.api_schools'
+    assert client.get('/api/profiles/' + ids[0], headers=auth).status_code == 404
+    assert client.get('/api/profiles/..%2f..%2fetc', headers=auth).status_code == 404
@@ -0,0 +1,28 @@
+import pytest
+
+import app as mcb
+import ratelimit
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setattr(mcb, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(mcb, 'AUTH_RATE_PER_ACCOUNT', 1)
+    monkeypatch.setattr(mcb, 'rate_limiter', ratelimit.create_rate_limiter('memory'))
+
+
+@pytest.mark.parametrize('body', [[], ['alice@example.com'], 'x', 7, None, {'email': 12}, {'email': None}])
+def test_bodies_without_an_email_string_skip_the_account_bucket(app, limiter, body):
+    view = mcb.rate_limited(hashes=False)(lambda: 'ok')
+    for _ in range(3):
+        with app.test_request_context('/forgot-password', method='POST', json=body):
+            assert view() == 'ok'
+
+
+def test_the_account_bucket_still_applies_to_an_email(app, limiter):
+    view = mcb.rate_limited(hashes=False)(lambda: 'ok')
+    with app.test_request_context('/forgot-password', method='POST', json={'email': ' Alice@Example.com'}):
+        assert view() == 'ok'
+    with app.test_request_context('/forgot-password', method='POST', json={'email': 'alice@example.com'}):
+        with pytest.raises(ratelimit.RateLimited):
+            view()
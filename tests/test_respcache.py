@@ -0,0 +1,170 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify, request
+
+import app as mcb
+from conftest import register
+from respcache import ResponseCache
+
+
+@pytest.fixture
+def alice(client):
+    return register(client)
+
+
+def add_users(app, n):
+    with app.app_context():
+        mcb.db.session.execute(mcb.db.insert(mcb.User), [
+            {'email': 'user%d@example.com' % i, 'name': 'User %d' % i} for i in range(n)])
+        mcb.db.session.commit()
+
+
+def test_a_matching_if_none_match_is_an_empty_304(client, alice):
+    first = client.get('/api/users/%d' % alice['id'])
+    etag = first.headers['ETag']
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    again = client.get('/api/users/%d' % alice['id'], headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    assert again.headers['ETag'] == etag
+
+    other = client.get('/api/users/%d' % alice['id'], headers={'If-None-Match': '"something-else"'})
+    assert other.status_code == 200
+    assert other.get_json() == first.get_json()
+
+
+@pytest.mark.parametrize('suffix', ['br', 'gzip', 'zstd'])
+def test_a_compressed_etag_still_matches(client, alice, suffix):
+    etag = client.get('/api/users/%d' % alice['id']).headers['ETag']
+    suffixed = '%s:%s"' % (etag[:-1], suffix)
+
+    response = client.get('/api/users/%d' % alice['id'], headers={'If-None-Match': suffixed})
+    assert response.status_code == 304
+
+
+def test_the_etag_a_compressed_response_sends_back_is_a_304(app, client, alice):
+    add_users(app, 40)
+    response = client.get('/api/users', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'].endswith(':gzip"')
+
+    again = client.get('/api/users', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_an_update_invalidates_the_users_entries(client, alice):
+    path = '/api/users/%d' % alice['id']
+    etag = client.get(path).headers['ETag']
+    client.get('/api/users')
+
+    assert client.put(path, json={'name': 'Al'}).status_code == 200
+
+    response = client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['user']['name'] == 'Al'
+    assert [u['name'] for u in client.get('/api/users').get_json()['users']] == ['Al']
+
+
+def test_a_delete_invalidates_the_users_entries(app, client, alice):
+    add_users(app, 1)
+    assert client.get('/api/users/2').status_code == 200
+
+    assert client.delete('/api/users/2').status_code == 200
+
+    assert client.get('/api/users/2').status_code == 404
+    assert [u['id'] for u in client.get('/api/users').get_json()['users']] == [alice['id']]
+
+
+def test_users_never_get_each_others_entries(app, client, alice):
+    with app.app_context():
+        mcb.db.session.add(mcb.Application(user_id=alice['id'], name='MIT'))
+        mcb.db.session.commit()
+    bob = app.test_client()
+    register(bob, email='bob@example.com', name='Bob')
+
+    mine = client.get('/api/applications')
+    theirs = bob.get('/api/applications')
+
+    assert [a['name'] for a in mine.get_json()['applications']] == ['MIT']
+    assert theirs.get_json()['applications'] == []
+    assert bob.get('/api/applications', headers={'If-None-Match': mine.headers['ETag']}).status_code == 200
+
+
+# The rest use their own cache on a bare app, to count how often the view runs
+
+@pytest.fixture
+def counted():
+    user = {'id': 1}
+    calls = []
+    cache = ResponseCache(get_user_id=lambda: user['id'])
+    flask_app = Flask(__name__)
+
+    @flask_app.route('/items/<int:item_id>')
+    @cache.cached(lambda uid, item_id: ['item:%s' % item_id])
+    def item(item_id):
+        calls.append(item_id)
+        if request.args.get('slow'):
+            time.sleep(0.3)
+        return jsonify({'id': item_id, 'user': user['id'], 'args': request.args.to_dict()})
+
+    return cache, flask_app.test_client(), user, calls
+
+
+def test_the_key_covers_view_args_query_accept_and_user(counted):
+    cache, client, user, calls = counted
+
+    for _ in range(2):
+        client.get('/items/1')
+        client.get('/items/2')
+        client.get('/items/1?a=1&b=2')
+        client.get('/items/1?b=2&a=1')
+        client.get('/items/1', headers={'Accept': 'text/csv'})
+    assert len(calls) == 4
+
+    user['id'] = 2
+    assert client.get('/items/1').get_json()['user'] == 2
+    assert len(calls) == 5
+    assert cache.stats()['hits'] == 6
+
+
+def test_invalidating_a_tag_only_misses_its_entries(counted):
+    cache, client, _, calls = counted
+    client.get('/items/1')
+    client.get('/items/2')
+
+    cache.invalidate('item:1')
+    client.get('/items/1')
+    client.get('/items/2')
+
+    assert calls == [1, 2, 1]
+
+
+def test_concurrent_misses_render_once(counted):
+    cache, client, _, calls = counted
+    bodies = []
+
+    def fetch():
+        bodies.append(client.get('/items/7?slow=1').get_json())
+
+    threads = [threading.Thread(target=fetch) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [7]
+    assert len(bodies) == 5 and all(body == bodies[0] for body in bodies)
+    assert cache.stats()['misses'] == 5
+
+
+def test_a_disabled_cache_always_runs_the_view(counted):
+    cache, client, _, calls = counted
+    cache.enabled = False
+    client.get('/items/1')
+    response = client.get('/items/1')
+    assert calls == [1, 1]
+    assert 'ETag' not in response.headers
@@ -0,0 +1,143 @@
+import time
+
+import pytest
+
+import sessions
+from conftest import register
+
+
+class StubRedis:
+    """The get/setex/delete subset of redis-py that RedisSessionStore uses, returning bytes like it"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, name):
+        value, expires = self.data.get(name, (None, 0))
+        if value is not None and expires <= time.monotonic():
+            del self.data[name]
+            return None
+        return value
+
+    def setex(self, name, time_, value):
+        self.data[name] = (value.encode() if isinstance(value, str) else value, time.monotonic() + time_)
+
+    def delete(self, *names):
+        return sum(self.data.pop(name, None) is not None for name in names)
+
+
+def stored(app, sid):
+    with app.app_context():
+        return app.session_interface.store.get(sid)
+
+
+def plant(app, client, sid='planted-session-id'):
+    with app.app_context():
+        store = app.session_interface.store
+        store.set(sid, app.session_interface.serializer.dumps({'theme': 'dark'}), 60)
+    client.set_cookie('session', sid)
+    return sid
+
+
+def test_login_issues_a_new_session_id_and_drops_the_planted_one(app, client):
+    register(client)
+    client.get('/logout')
+    planted = plant(app, client)
+
+    response = client.post('/api/login', json={'email': 'alice@example.com', 'password': 'secret123'})
+
+    assert response.status_code == 200
+    sid = client.get_cookie('session').value
+    assert sid != planted
+    assert stored(app, planted) is None
+    assert stored(app, sid) is not None
+
+    attacker = app.test_client()
+    attacker.set_cookie('session', planted)
+    assert attacker.get('/api/users').status_code == 302
+    assert client.get('/api/users').status_code == 200
+
+
+def test_registration_also_regenerates_the_session(app, client):
+    planted = plant(app, client)
+    register(client)
+    assert client.get_cookie('session').value != planted
+    assert stored(app, planted) is None
+
+
+def test_logout_deletes_the_stored_session(app, client):
+    register(client)
+    sid = client.get_cookie('session').value
+    assert stored(app, sid) is not None
+
+    assert client.get('/logout').status_code == 200
+
+    assert stored(app, sid) is None
+    replay = app.test_client()
+    replay.set_cookie('session', sid)
+    assert replay.get('/api/users').status_code == 302
+
+
+@pytest.fixture
+def redis(app):
+    client = StubRedis()
+    store = sessions.CachedSessionStore(sessions.RedisSessionStore(client), sessions.LRUCache(ttl=5))
+    app.session_interface = sessions.ServerSideSessionInterface(store, ttl=3600)
+    return client
+
+
+def test_redis_store_keeps_the_session_under_its_prefix(app, client, redis):
+    register(client)
+    sid = client.get_cookie('session').value
+
+    value, _ = redis.data['session:' + sid]
+    assert b'user_id' in value
+    assert stored(app, sid) == value.decode()
+    assert client.get('/api/users').status_code == 200
+
+
+def test_redis_store_rotates_on_login_and_deletes_on_logout(app, client, redis):
+    register(client)
+    client.get('/logout')
+    planted = plant(app, client)
+
+    client.post('/api/login', json={'email': 'alice@example.com', 'password': 'secret123'})
+    sid = client.get_cookie('session').value
+    assert sid != planted
+    assert list(redis.data) == ['session:' + sid]
+
+    client.get('/logout')
+    assert redis.data == {}
+    replay = app.test_client()
+    replay.set_cookie('session', sid)
+    assert replay.get('/api/users').status_code == 302
+
+
+def test_redis_session_expires_with_its_ttl(app, client, redis):
+    app.session_interface.ttl = 60
+    register(client)
+    [(_, expires)] = redis.data.values()
+    assert 50 < expires - time.monotonic() <= 60
+
+    app.session_interface.store.cache.clear()
+    for key, (value, _) in redis.data.items():
+        redis.data[key] = (value, time.monotonic() - 1)
+    assert client.get('/api/users').status_code == 302
+
+
+def test_a_deleted_session_is_refused_by_a_worker_without_its_cache_entry(app, client):
+    # Another worker's cache only learns of a logout when its entry expires; with no entry it reads the store
+    register(client)
+    sid = client.get_cookie('session').value
+    with app.app_context():
+        app.session_interface.store.backend.delete(sid)
+        app.session_interface.store.cache.clear()
+    replay = app.test_client()
+    replay.set_cookie('session', sid)
+    assert replay.get('/api/users').status_code == 302
+
+
+def test_a_zero_ttl_turns_the_local_cache_off():
+    cache = sessions.LRUCache(ttl=0)
+    cache.set('sid', 'value')
+    assert cache.get('sid') is None
@@ -0,0 +1,77 @@
+import json
+import logging
+
+import pytest
+from flask import request
+
+import app as mcb
+import sqlstats
+
+
+@pytest.fixture
+def queries(app):
+    """/queries?n=N runs one identical SELECT N times (no session, so nothing else touches the database)"""
+    def run_queries():
+        for i in range(int(request.args.get('n', 1))):
+            mcb.db.session.execute(mcb.db.select(mcb.User.id).where(mcb.User.id == i)).all()
+        return {'ok': True}
+
+    app.add_url_rule('/queries', 'queries', run_queries)
+    return app.test_client()
+
+
+def events(caplog, logger):
+    return [json.loads(r.getMessage()) for r in caplog.records if r.name == logger]
+
+
+def test_statements_slower_than_the_threshold_are_logged(queries, caplog, monkeypatch):
+    caplog.set_level(logging.WARNING, logger='mcb.sql.slow')
+    queries.get('/queries')
+    assert events(caplog, 'mcb.sql.slow') == []
+
+    monkeypatch.setattr(sqlstats, 'SLOW_QUERY_MS', 0)
+    queries.get('/queries')
+    [slow] = events(caplog, 'mcb.sql.slow')
+    assert slow['event'] == 'slow_query'
+    assert slow['endpoint'] == 'queries'
+    assert slow['statement'].startswith('SELECT user.id')
+    assert slow['duration_ms'] >= 0
+
+
+def test_a_statement_repeated_within_one_request_is_an_n_plus_one(queries, caplog):
+    caplog.set_level(logging.WARNING, logger='mcb.sql')
+    queries.get('/queries', query_string={'n': sqlstats.N_PLUS_ONE_THRESHOLD - 1})
+    assert events(caplog, 'mcb.sql') == []
+
+    queries.get('/queries', query_string={'n': sqlstats.N_PLUS_ONE_THRESHOLD + 1})
+    [warning] = events(caplog, 'mcb.sql')
+    assert warning['event'] == 'n_plus_one'
+    assert warning['endpoint'] == 'queries'
+    assert warning['repeats'] == sqlstats.N_PLUS_ONE_THRESHOLD + 1
+
+
+def test_repeats_are_counted_per_request(queries, caplog):
+    caplog.set_level(logging.WARNING, logger='mcb.sql')
+    for _ in range(sqlstats.N_PLUS_ONE_THRESHOLD):
+        queries.get('/queries')
+    assert events(caplog, 'mcb.sql') == []
+
+
+def test_server_timing_is_only_sent_with_sql_debug_timing(queries, monkeypatch):
+    response = queries.get('/queries', query_string={'n': 3})
+    assert 'Server-Timing' not in response.headers
+    assert 'X-DB-Query-Count' not in response.headers
+
+    monkeypatch.setattr(sqlstats, 'DEBUG_TIMING', True)
+    response = queries.get('/queries', query_string={'n': 3})
+    assert response.headers['X-DB-Query-Count'] == '3'
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert response.headers['Server-Timing'].endswith(';desc="3 queries"')
+
+
+def test_another_create_app_does_not_count_statements_twice(queries, tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlstats, 'DEBUG_TIMING', True)
+    for i in range(2):
+        mcb.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / ('other%d.db' % i))})
+
+    assert queries.get('/queries', query_string={'n': 2}).headers['X-DB-Query-Count'] == '2'
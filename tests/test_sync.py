@@ -0,0 +1,173 @@
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as mcb
+import deltasync
+from conftest import register
+
+AN_HOUR_AGO = datetime.utcnow() - timedelta(hours=1)
+
+
+def sync(client, since=None, **params):
+    if since:
+        params['since'] = since
+    response = client.get('/api/sync', query_string=params)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def sync_all(client, since=None, **params):
+    """Follow has_more to the end; returns (pages, last watermark)"""
+    pages = []
+    while True:
+        page = sync(client, since, **params)
+        pages.append(page)
+        since = page['watermark']
+        if not page['has_more']:
+            return pages, since
+
+
+def add_users(app, n):
+    with app.app_context():
+        mcb.db.session.execute(mcb.db.insert(mcb.User), [
+            {'email': 'user%d@example.com' % i, 'name': 'User %d' % i} for i in range(n)])
+        mcb.db.session.commit()
+
+
+def add_application(app, user_id, name='MIT'):
+    with app.app_context():
+        application = mcb.Application(user_id=user_id, name=name)
+        mcb.db.session.add(application)
+        mcb.db.session.commit()
+        return application.id
+
+
+def age_everything(app):
+    """Move every row out of the settle window, all to the same updated_at"""
+    with app.app_context():
+        for model in (mcb.User, mcb.Application):
+            mcb.db.session.execute(mcb.db.update(model).values(updated_at=AN_HOUR_AGO))
+        mcb.db.session.commit()
+
+
+@pytest.fixture
+def alice(app, client):
+    return register(client)
+
+
+def test_pages_break_ties_in_updated_at_by_id(app, client, alice):
+    add_users(app, 4)
+    age_everything(app)
+
+    pages, _ = sync_all(client, limit=2)
+
+    assert [[u['id'] for u in page['users']] for page in pages] == [[1, 2], [3, 4], [5]]
+    assert [page['has_more'] for page in pages] == [True, True, False]
+
+
+def test_an_update_moves_a_row_past_the_watermark(app, client, alice):
+    add_users(app, 3)
+    age_everything(app)
+    _, watermark = sync_all(client)
+    assert sync(client, watermark)['users'] == []
+
+    assert client.put('/api/users/3', json={'name': 'Renamed'}).status_code == 200
+
+    page = sync(client, watermark)
+    assert [(u['id'], u['name']) for u in page['users']] == [(3, 'Renamed')]
+
+
+def test_rows_in_the_settle_window_are_sent_again(app, client, alice, monkeypatch):
+    monkeypatch.setattr(deltasync, 'SETTLE_SECONDS', 3600)
+    first = sync(client)
+    assert [u['id'] for u in first['users']] == [alice['id']]
+    # Written within the last SETTLE_SECONDS: a later commit could still land before it
+    assert [u['id'] for u in sync(client, first['watermark'])['users']] == [alice['id']]
+
+    age_everything(app)
+    monkeypatch.setattr(deltasync, 'SETTLE_SECONDS', 60)
+    assert sync(client, sync(client)['watermark'])['users'] == []
+
+
+def test_a_delete_is_a_tombstone_only_its_owner_sees(app, client, alice):
+    bob_client = app.test_client()
+    bob = register(bob_client, email='bob@example.com', name='Bob')
+    alice_app, bob_app = add_application(app, alice['id']), add_application(app, bob['id'])
+    age_everything(app)
+    _, alice_mark = sync_all(client)
+    _, bob_mark = sync_all(bob_client)
+
+    with app.app_context():
+        table = mcb.Application.__table__
+        deltasync.delete_where(mcb.db.session, table, 'application', table.c.id == alice_app,
+                               owner_column=table.c.user_id)
+        mcb.db.session.commit()
+
+    assert [(d['kind'], d['id']) for d in sync(client, alice_mark)['deleted']] == [('application', alice_app)]
+    bob_page = sync(bob_client, bob_mark)
+    assert bob_page['deleted'] == []
+    assert [a['id'] for a in sync(bob_client)['applications']] == [bob_app]
+
+
+def test_a_deleted_user_is_a_tombstone_everyone_sees(app, client, alice):
+    add_users(app, 1)
+    age_everything(app)
+    _, watermark = sync_all(client)
+
+    assert client.delete('/api/users/2').status_code == 200
+
+    assert [(d['kind'], d['id']) for d in sync(client, watermark)['deleted']] == [('user', 2)]
+
+
+def test_a_new_client_gets_no_old_tombstones(app, client, alice):
+    add_users(app, 1)
+    client.delete('/api/users/2')
+    with app.app_context():
+        mcb.db.session.execute(deltasync.tombstone_table.update().values(deleted_at=AN_HOUR_AGO))
+        mcb.db.session.commit()
+
+    assert sync(client)['deleted'] == []
+
+
+def b64(text):
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('since', ['garbage', b64('[]'), b64('{"users": ["yesterday", 1]}'),
+                                   b64('{"users": ["2026-01-01T00:00:00", "x"]}')])
+def test_a_malformed_watermark_is_a_400(client, alice, since):
+    response = client.get('/api/sync', query_string={'since': since})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid watermark'}
+
+
+def test_a_watermark_older_than_the_kept_tombstones_is_a_410(app, client, alice):
+    old = datetime.utcnow() - timedelta(days=deltasync.TOMBSTONE_DAYS + 1)
+    expired = deltasync.encode_watermark({'users': (old, 0), 'applications': (old, 0), 'deleted': (old, 0)})
+    # A watermark without a deletions position can't have seen prune() either
+    incomplete = deltasync.encode_watermark({'users': (datetime.utcnow(), 0)})
+
+    for since in (expired, incomplete):
+        response = client.get('/api/sync', query_string={'since': since})
+        assert response.status_code == 410
+
+    # Within the window the same positions are fine, and prune() keeps what they need
+    recent = datetime.utcnow() - timedelta(days=deltasync.TOMBSTONE_DAYS - 1)
+    with app.app_context():
+        assert deltasync.prune(mcb.db.engine) == 0
+    sync(client, deltasync.encode_watermark({'users': (recent, 0), 'deleted': (recent, 0)}))
+
+
+def test_prune_drops_tombstones_past_the_window(app, client, alice):
+    add_users(app, 2)
+    client.delete('/api/users/2')
+    client.delete('/api/users/3')
+    with app.app_context():
+        t = deltasync.tombstone_table
+        mcb.db.session.execute(t.update().where(t.c.object_id == 2).values(
+            deleted_at=datetime.utcnow() - timedelta(days=deltasync.TOMBSTONE_DAYS + 1)))
+        mcb.db.session.commit()
+        assert deltasync.prune(mcb.db.engine) == 1
+        assert mcb.db.session.scalars(mcb.db.select(t.c.object_id)).all() == [3]
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+import app as mcb
+from conftest import register
+
+
+@pytest.fixture
+def signed_in(app, client):
+    register(client)
+    with app.app_context():
+        mcb.db.session.execute(mcb.db.insert(mcb.User), [
+            {'email': 'user%d@example.com' % i, 'name': 'User %d' % i, 'is_premium': i % 2 == 0}
+            for i in range(2, 8)])
+        mcb.db.session.commit()
+    return client
+
+
+def page(client, **params):
+    response = client.get('/api/users', query_string=params)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_pages_follow_the_cursor_to_the_end(signed_in):
+    ids, cursor, cursors = [], None, []
+    while True:
+        body = page(signed_in, limit=3, **({'cursor': cursor} if cursor else {}))
+        ids.extend(u['id'] for u in body['users'])
+        cursor = body['next_cursor']
+        cursors.append(cursor)
+        if cursor is None:
+            break
+
+    assert ids == list(range(1, 8))
+    assert cursors == [3, 6, None]
+    assert [u['id'] for u in page(signed_in, cursor=5)['users']] == [6, 7]
+    assert page(signed_in, limit=7)['next_cursor'] is None
+
+
+def test_limit_is_capped(signed_in, monkeypatch):
+    monkeypatch.setattr(mcb, 'USERS_PAGE_MAX', 2)
+    assert len(page(signed_in, limit=50)['users']) == 2
+
+
+@pytest.mark.parametrize('params, error', [
+    ({'cursor': 'abc'}, 'cursor must be an integer of at least 0'),
+    ({'cursor': '1.5'}, 'cursor must be an integer of at least 0'),
+    ({'cursor': '-1'}, 'cursor must be an integer of at least 0'),
+    ({'limit': ''}, 'limit must be an integer of at least 1'),
+    ({'limit': '0'}, 'limit must be an integer of at least 1'),
+    ({'limit': 'ten', 'format': 'ndjson'}, 'limit must be an integer of at least 1'),
+    ({'fields': 'email,password_hash'}, 'Unknown fields: password_hash'),
+])
+def test_bad_parameters_are_a_400(signed_in, params, error):
+    response = signed_in.get('/api/users', query_string=params)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
+
+
+def test_fields_selects_columns_and_always_includes_id(signed_in):
+    body = page(signed_in, fields='email, name,email', limit=2)
+    assert body['users'] == [{'id': 1, 'email': 'alice@example.com', 'name': 'Alice'},
+                             {'id': 2, 'email': 'user2@example.com', 'name': 'User 2'}]
+    assert body['next_cursor'] == 2
+
+
+def test_ndjson_streams_every_user_after_the_cursor(signed_in):
+    response = signed_in.get('/api/users', query_string={'format': 'ndjson', 'cursor': 2, 'fields': 'is_premium'})
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.is_streamed
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == [
+        {'id': i, 'is_premium': i % 2 == 0} for i in range(3, 8)]
+
+
+def test_ndjson_by_accept_header_with_a_limit(signed_in):
+    response = signed_in.get('/api/users', query_string={'limit': 2, 'fields': 'id'},
+                             headers={'Accept': 'application/x-ndjson'})
+    assert response.get_data(as_text=True) == '{"id":1}\n{"id":2}\n'
@@ -0,0 +1,113 @@
+import pytest
+import sqlalchemy as sa
+
+import app as mcb
+import usersearch
+from conftest import register
+
+PEOPLE = [
+    ('ann@example.com', 'Ann Smith'),        # 2: email is exactly "ann@example.com"
+    ('annabel@example.com', 'Annabel Lee'),  # 3: email prefix "ann"
+    ('joe@example.com', 'Joanna Annis'),     # 4: name-word prefix "ann"
+    ('hannah@example.com', 'Hannah Ho'),     # 5: substring "ann"
+    ('zed@example.com', 'Zed'),              # 6: no match
+]
+
+
+@pytest.fixture
+def signed_in(app, client):
+    register(client, email='owner@example.com', name='Owner')
+    with app.app_context():
+        mcb.db.session.execute(mcb.db.insert(mcb.User), [{'email': e, 'name': n} for e, n in PEOPLE])
+        mcb.db.session.commit()
+    return client
+
+
+def search(client, q, **params):
+    response = client.get('/api/users/search', query_string=dict(params, q=q, fields='id,email'))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def ids(client, q, **params):
+    return [u['id'] for u in search(client, q, **params)['users']]
+
+
+def fts_rows(app):
+    with app.app_context(), mcb.db.engine.connect() as conn:
+        return sorted(conn.exec_driver_sql('SELECT rowid, email, name FROM %s' % usersearch.FTS_TABLE).all())
+
+
+def test_exact_then_email_prefix_then_name_prefix_then_substring(signed_in):
+    assert ids(signed_in, 'ann@example.com') == [2]
+    assert ids(signed_in, 'ANN') == [2, 3, 4, 5]
+    assert ids(signed_in, 'ann') == ids(signed_in, '  Ann ')
+
+
+def test_the_prefix_range_stops_after_the_prefix(app, signed_in):
+    with app.app_context():
+        mcb.db.session.execute(mcb.db.insert(mcb.User), [
+            {'email': 'ao@example.com', 'name': 'Ao'},          # just past "an"
+            {'email': 'an\uffff@example.com', 'name': 'Edge'},  # high code point, still "an..."
+        ])
+        mcb.db.session.commit()
+
+    assert ids(signed_in, 'an') == [2, 3, 8]
+
+
+def test_short_queries_only_match_prefixes(signed_in):
+    # "an" is inside "hannah" and starts a word of "Joanna Annis", but is too short for a substring match
+    assert ids(signed_in, 'an') == [2, 3]
+    assert ids(signed_in, 'h') == [5]
+    assert ids(signed_in, 'nn') == []
+
+
+def test_like_wildcards_are_matched_literally(signed_in):
+    assert ids(signed_in, 'a_n') == []
+    assert ids(signed_in, 'a%') == []
+
+
+def test_offset_pagination_follows_the_ranking(signed_in):
+    first = search(signed_in, 'ann', limit=3)
+    assert [u['id'] for u in first['users']] == [2, 3, 4]
+    assert first['next_offset'] == 3
+
+    last = search(signed_in, 'ann', limit=3, offset=first['next_offset'])
+    assert [u['id'] for u in last['users']] == [5]
+    assert last['next_offset'] is None
+
+
+@pytest.mark.parametrize('q', ['', ' ', 'x' * 101])
+def test_an_empty_or_long_query_is_a_400(signed_in, q):
+    assert signed_in.get('/api/users/search', query_string={'q': q}).status_code == 400
+
+
+def test_triggers_keep_the_fts_table_in_sync(app, signed_in):
+    ids(signed_in, 'ann')
+    assert [row[0] for row in fts_rows(app)] == [1, 2, 3, 4, 5, 6]
+
+    with app.app_context():
+        table = mcb.User.__table__
+        mcb.db.session.execute(sa.update(table).where(table.c.id == 6).values(name='Zed Hannigan'))
+        mcb.db.session.execute(sa.update(table).where(table.c.id == 5).values(email='h@example.com', name='H'))
+        mcb.db.session.execute(sa.delete(table).where(table.c.id == 3))
+        mcb.db.session.execute(mcb.db.insert(mcb.User), [{'email': 'xann@example.com', 'name': 'X'}])
+        mcb.db.session.commit()
+    mcb.response_cache.clear()
+
+    assert fts_rows(app)[-1] == (7, 'xann@example.com', 'X')
+    assert ids(signed_in, 'ann') == [2, 4, 6, 7]
+    assert ids(signed_in, 'hann') == [6]
+
+
+def test_install_indexes_users_that_already_exist(app, signed_in):
+    with app.app_context():
+        with mcb.db.engine.begin() as conn:
+            for trigger in ('ai', 'ad', 'au'):
+                conn.exec_driver_sql('DROP TRIGGER %s_%s' % (usersearch.FTS_TABLE, trigger))
+            conn.exec_driver_sql('DROP TABLE %s' % usersearch.FTS_TABLE)
+        assert usersearch.install(mcb.db.engine, mcb.User.__table__)
+    mcb.response_cache.clear()
+
+    assert len(fts_rows(app)) == 6
+    assert ids(signed_in, 'hann') == [5]
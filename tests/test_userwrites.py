@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy as sa
+
+import app as mcb
+import userwrites
+from conftest import register
+
+AN_HOUR_AGO = datetime.utcnow() - timedelta(hours=1)
+
+
+def user_count(app):
+    with app.app_context():
+        return mcb.db.session.scalar(sa.select(sa.func.count()).select_from(mcb.User.__table__))
+
+
+@pytest.mark.parametrize('email', ['alice@example.com', 'ALICE@Example.com', '  alice@example.com '])
+def test_registering_a_taken_email_is_a_409_without_a_second_row(app, client, email):
+    register(client)
+
+    response = app.test_client().post('/api/register', json={'email': email, 'password': 'other123', 'name': 'A'})
+
+    assert response.status_code == 409
+    assert response.get_json() == {'error': 'User with this email already exists'}
+    assert user_count(app) == 1
+
+
+def test_insert_users_splits_the_union_at_the_row_limit(app):
+    statements = []
+    n = userwrites.MAX_ROWS_PER_INSERT * 2 + 3
+    rows = [{'email': 'user%d@example.com' % i, 'name': 'User %d' % i} for i in range(n)]
+    with app.app_context():
+        table = mcb.User.__table__
+        # Taken on either side of the first chunk boundary
+        limit = userwrites.MAX_ROWS_PER_INSERT
+        taken = [dict(rows[limit - 1], email='USER%d@example.com' % (limit - 1)), rows[limit]]
+        userwrites.insert_users(mcb.db.session, table, taken, [table.c.id])
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sa.event.listen(mcb.db.engine, 'before_cursor_execute', record)
+        try:
+            inserted = userwrites.insert_users(mcb.db.session, table, rows, [table.c.email])
+        finally:
+            sa.event.remove(mcb.db.engine, 'before_cursor_execute', record)
+        mcb.db.session.commit()
+
+    inserts = [s for s in statements if s.startswith('INSERT')]
+    assert len(inserts) == 3
+    assert len(inserted) == n - 2
+    assert {'user%d@example.com' % (limit - 1), 'user%d@example.com' % limit}.isdisjoint(r.email for r in inserted)
+    assert user_count(app) == n
+
+
+def test_update_user_without_values_leaves_updated_at_alone(app, client):
+    user = register(client)
+    with app.app_context():
+        table = mcb.User.__table__
+        mcb.db.session.execute(sa.update(table).values(updated_at=AN_HOUR_AGO))
+        mcb.db.session.commit()
+
+        row = userwrites.update_user(mcb.db.session, table, user['id'], {}, [table.c.id, table.c.updated_at])
+        mcb.db.session.commit()
+        assert row.updated_at == AN_HOUR_AGO
+        assert mcb.db.session.scalar(sa.select(table.c.updated_at)) == AN_HOUR_AGO
+
+        assert userwrites.update_user(mcb.db.session, table, 999, {}, [table.c.id]) is None
+
+    # Through the view too: a PUT with nothing to change
+    assert client.put('/api/users/%d' % user['id'], json={'email': 'ignored@example.com'}).status_code == 200
+    with app.app_context():
+        assert mcb.db.session.scalar(sa.select(mcb.User.__table__.c.updated_at)) == AN_HOUR_AGO
+
+
+def test_a_reset_token_works_exactly_once(app, client):
+    register(client)
+    with app.app_context():
+        table = mcb.User.__table__
+        assert userwrites.set_reset_token(mcb.db.session, table, 'Alice@Example.com', 'tok') is not None
+        mcb.db.session.commit()
+
+    anon = app.test_client()
+    first = anon.post('/reset-password', json={'token': 'tok', 'password': 'newsecret'})
+    second = anon.post('/reset-password', json={'token': 'tok', 'password': 'another1'})
+
+    assert first.status_code == 200
+    assert second.status_code == 400
+    assert second.get_json() == {'error': 'Invalid or expired reset token'}
+    assert anon.post('/api/login', json={'email': 'alice@example.com', 'password': 'newsecret'}).status_code == 200
+
+
+def test_an_expired_reset_token_is_refused(app, client):
+    register(client)
+    with app.app_context():
+        table = mcb.User.__table__
+        userwrites.set_reset_token(mcb.db.session, table, 'alice@example.com', 'tok')
+        mcb.db.session.execute(sa.update(table).values(reset_token_expires=AN_HOUR_AGO))
+        mcb.db.session.commit()
+        assert userwrites.reset_password(mcb.db.session, table, 'tok', 'hash') is None
@@ -0,0 +1,140 @@
+"""Case-insensitive user search by email and name
+
+search() matches the query as a prefix or substring of a user's email or
+name, ignoring case, and ranks exact email matches first, then email
+prefixes, then name or name-word prefixes, then other substring matches.
+Queries shorter than three characters only match prefixes: shorter
+substrings match most of the table and no index can serve them.
+
+Indexes (created by install(); `flask init-db` runs it and search() makes
+sure it ran once per engine):
+  every database  lower(email) and lower(name) expression indexes, used for
+                  exact and prefix matches and case-insensitive email lookups
+  PostgreSQL      pg_trgm GIN indexes on lower(email) and lower(name), so a
+                  LIKE '%q%' substring match is an index scan
+  SQLite          an FTS5 table "user_search" with the trigram tokenizer,
+                  kept in sync with "user" by triggers
+Without pg_trgm (no permission to create the extension) or FTS5 trigram
+support (SQLite < 3.34), substring matches fall back to a table scan.
+"""
+import logging
+
+import sqlalchemy as sa
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+
+log = logging.getLogger('mcb.usersearch')
+
+MIN_SUBSTRING_LENGTH = 3
+FTS_TABLE = 'user_search'
+
+_installed = {}
+
+
+def _install_sqlite(conn, table):
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)).first()
+    if exists:
+        return True
+    try:
+        conn.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(email, name, content='%s', content_rowid='id', "
+            "tokenize='trigram')" % (FTS_TABLE, table.name))
+    except DBAPIError:
+        log.warning('SQLite has no FTS5 trigram tokenizer; user search will scan the table')
+        return False
+    user = '"%s"' % table.name
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {user} BEGIN "
+        "INSERT INTO {fts}(rowid, email, name) VALUES (new.id, new.email, new.name); END".format(
+            fts=FTS_TABLE, user=user))
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {user} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, email, name) VALUES ('delete', old.id, old.email, old.name); END".format(
+            fts=FTS_TABLE, user=user))
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF email, name ON {user} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, email, name) VALUES ('delete', old.id, old.email, old.name); "
+        "INSERT INTO {fts}(rowid, email, name) VALUES (new.id, new.email, new.name); END".format(
+            fts=FTS_TABLE, user=user))
+    # Index the users that existed before the table
+    conn.exec_driver_sql("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=FTS_TABLE))
+    return True
+
+
+def _install_postgresql(conn, table):
+    try:
+        with conn.begin_nested():
+            conn.exec_driver_sql('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DBAPIError:
+        log.warning('Cannot create the pg_trgm extension; user search will scan the table')
+        return False
+    for column in ('email', 'name'):
+        conn.exec_driver_sql(
+            'CREATE INDEX IF NOT EXISTS ix_%s_%s_trgm ON "%s" USING gin (lower(%s) gin_trgm_ops)'
+            % (table.name, column, table.name, column))
+    return True
+
+
+def install(engine, table):
+    """Create the search indexes for ``table`` (the users table) if missing"""
+    with engine.begin() as conn:
+        # Expression indexes declared on the model but missing from an older database
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+        if engine.dialect.name == 'sqlite':
+            substring_index = _install_sqlite(conn, table)
+        elif engine.dialect.name == 'postgresql':
+            substring_index = _install_postgresql(conn, table)
+        else:
+            substring_index = False
+    _installed[engine] = substring_index
+    return substring_index
+
+
+def _like_escape(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search(session, engine, table, q, columns, limit, offset=0):
+    """One page of users matching ``q``: (rows, has_more)
+
+    ``columns`` are selected from ``table``; ``engine`` is the primary, used
+    to install the indexes on first use.
+    """
+    if engine not in _installed:
+        install(engine, table)
+    q = q.strip().lower()
+    email = sa.func.lower(table.c.email)
+    name = sa.func.lower(table.c.name)
+    prefix = _like_escape(q) + '%'
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        # Range scans on the lower() expression indexes; SQLite won't use them for LIKE
+        upper = q + '\U0010ffff'
+        prefix_match = sa.or_(sa.and_(email >= q, email < upper), sa.and_(name >= q, name < upper))
+    else:
+        prefix_match = sa.or_(email.like(prefix, escape='\\'), name.like(prefix, escape='\\'))
+
+    if len(q) < MIN_SUBSTRING_LENGTH:
+        match = prefix_match
+    elif dialect == 'sqlite' and _installed[engine]:
+        phrase = '"%s"' % q.replace('"', '""')
+        match = table.c.id.in_(sa.select(sa.literal_column('rowid')).select_from(sa.table(FTS_TABLE))
+                               .where(sa.literal_column(FTS_TABLE).op('MATCH')(phrase)))
+    else:
+        substring = '%' + _like_escape(q) + '%'
+        match = sa.or_(email.like(substring, escape='\\'), name.like(substring, escape='\\'))
+
+    rank = sa.case(
+        (email == q, 0),
+        (email.like(prefix, escape='\\'), 1),
+        (sa.or_(name.like(prefix, escape='\\'), name.like('% ' + prefix, escape='\\')), 2),
+        else_=3,
+    )
+    query = (sa.select(*columns).where(match)
+             .order_by(rank, table.c.id)
+             .limit(limit + 1).offset(offset))
+    rows = session.execute(query).all()
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,101 @@
+"""Single-statement writes to the users table
+
+Each function here is one SQL statement that both checks and writes, so a
+view needs no SELECT before it writes and can't race another request
+between the two:
+  insert_user       INSERT ... SELECT ... WHERE NOT EXISTS (same email, any
+                    case) ON CONFLICT DO NOTHING RETURNING
+  insert_users      the same for many users, from a UNION ALL of their rows
+  update_user       UPDATE ... WHERE id = ? RETURNING
+  set_reset_token   UPDATE of the account that owns an email, RETURNING
+  reset_password    UPDATE ... WHERE reset_token = ? AND not expired RETURNING
+A function returns the written row, or None when nothing matched (duplicate
+email, unknown id, invalid token). None of them commits: the view commits
+once after its other writes.
+
+Works on PostgreSQL and on SQLite 3.35+ (RETURNING). On PostgreSQL two
+concurrent registrations of one email in different letter case can both
+pass the NOT EXISTS check; the same email in the same case hits the unique
+constraint and the second insert does nothing.
+"""
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+RESET_TOKEN_TTL = timedelta(hours=1)
+
+_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+# SQLite's default limit on the SELECTs of one UNION ALL
+MAX_ROWS_PER_INSERT = 500
+
+
+def _email_match(table, email):
+    return sa.func.lower(table.c.email) == email.strip().lower()
+
+
+def insert_user(session, table, values, returning):
+    """Insert a user unless one with the same email (ignoring case) exists
+
+    ``values`` maps column names to values; SQLAlchemy adds the column
+    defaults (created_at, updated_at) to the SELECT. Returns the
+    ``returning`` columns of the new row or None.
+    """
+    columns = list(values)
+    taken = sa.exists().where(_email_match(table, values['email']))
+    new_row = sa.select(*[sa.literal(values[name], table.c[name].type) for name in columns]).where(~taken)
+    insert = _INSERTS[session.get_bind().dialect.name](table)
+    statement = insert.from_select(columns, new_row).on_conflict_do_nothing().returning(*returning)
+    return session.execute(statement).first()
+
+
+def insert_users(session, table, rows, returning):
+    """Insert each of ``rows`` unless a user with its email (ignoring case) exists
+
+    ``rows`` are dicts with the same keys and emails that differ ignoring
+    case. Runs one statement per MAX_ROWS_PER_INSERT rows and returns the
+    ``returning`` columns of the rows inserted; the others were duplicates.
+    """
+    columns = list(rows[0])
+    insert = _INSERTS[session.get_bind().dialect.name]
+    inserted = []
+    for i in range(0, len(rows), MAX_ROWS_PER_INSERT):
+        selects = [sa.select(*[sa.literal(row[name], table.c[name].type).label(name) for name in columns])
+                   for row in rows[i:i + MAX_ROWS_PER_INSERT]]
+        candidates = (sa.union_all(*selects) if len(selects) > 1 else selects[0]).subquery('candidate')
+        taken = sa.exists().where(sa.func.lower(table.c.email) == sa.func.lower(candidates.c.email))
+        new_rows = sa.select(*[candidates.c[name] for name in columns]).where(~taken)
+        statement = insert(table).from_select(columns, new_rows).on_conflict_do_nothing().returning(*returning)
+        inserted.extend(session.execute(statement).all())
+    return inserted
+
+
+def update_user(session, table, user_id, values, returning):
+    """Apply ``values`` to one user; the ``returning`` columns afterwards or None for an unknown id
+
+    With no values it only reads the row, so updated_at doesn't move.
+    """
+    if not values:
+        return session.execute(sa.select(*returning).where(table.c.id == user_id)).first()
+    statement = sa.update(table).where(table.c.id == user_id).values(**values).returning(*returning)
+    return session.execute(statement).first()
+
+
+def set_reset_token(session, table, email, token):
+    """Give the password account with this email a reset token; (id, email) or None"""
+    account = (sa.select(table.c.id)
+               .where(_email_match(table, email), table.c.password_hash.isnot(None))
+               .order_by(table.c.id).limit(1).scalar_subquery())
+    statement = (sa.update(table).where(table.c.id == account)
+                 .values(reset_token=token, reset_token_expires=datetime.utcnow() + RESET_TOKEN_TTL)
+                 .returning(table.c.id, table.c.email))
+    return session.execute(statement).first()
+
+
+def reset_password(session, table, token, password_hash):
+    """Set the password of the user holding an unexpired ``token`` and clear it; the user id or None"""
+    statement = (sa.update(table)
+                 .where(table.c.reset_token == token, table.c.reset_token_expires > datetime.utcnow())
+                 .values(password_hash=password_hash, reset_token=None, reset_token_expires=None)
+                 .returning(table.c.id))
+    return session.execute(statement).scalar()